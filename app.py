@@ -6,6 +6,7 @@ from cdk_stacks import (
   OpsServerlessStack,
   OpsServerlessIngestionStack,
   OpsKeyspacesStack,
+  OpsKeyspacesCdcStack,
   OpsApigwLambdaStack
 )
 
@@ -35,4 +36,9 @@ ops_keyspaces_stack = OpsKeyspacesStack(app, "OpsKeyspacesStack", env=AWS_ENV)
 apigw_lambda_stack = OpsApigwLambdaStack(app, "OpsApigwLambdaStack", env=AWS_ENV)
 apigw_lambda_stack.add_dependency(ops_serverless_ingestion_stack)
 
+if str(app.node.try_get_context('cdc_enabled')).lower() == "true":
+  ops_keyspaces_cdc_stack = OpsKeyspacesCdcStack(app, "OpsKeyspacesCdcStack", env=AWS_ENV)
+  ops_keyspaces_cdc_stack.add_dependency(ops_keyspaces_stack)
+  ops_keyspaces_cdc_stack.add_dependency(ops_serverless_ingestion_stack)
+
 app.synth()
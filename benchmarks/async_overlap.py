@@ -0,0 +1,71 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compares serial processing of write requests with the overlapped asyncio path of
+lambda/index.py, against local Keyspaces and ingestion stand-ins.
+
+    python benchmarks/async_overlap.py --items 50 --keyspaces-latency-ms 10 --ingestion-latency-ms 30
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import requests
+from requests_auth_aws_sigv4 import AWSSigV4
+
+from standins import IngestionStub, fake_query_manager, sample_operations
+
+import index
+
+TABLE_NAME = "productsearch.product_by_item"
+
+
+def run_serial(qm, endpoint, operations):
+    """One Keyspaces write and one blocking ingestion POST per item, each awaited in turn."""
+    for body in operations:
+        asyncio.run(qm.execute_write_async(TABLE_NAME, "insert", body["item"]))
+        requests.request('POST', f'{endpoint}/product-pipeline/test_ingestion_path',
+                         headers={"Content-Type": "application/json"},
+                         json=[body],
+                         auth=AWSSigV4('osis'))
+
+
+async def run_overlapped(endpoint, operations):
+    """All items go through process_payload_async concurrently."""
+    await asyncio.gather(*(
+        index.process_payload_async(None, "productsearch", TABLE_NAME, endpoint, body)
+        for body in operations
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=50)
+    parser.add_argument("--keyspaces-latency-ms", type=float, default=10)
+    parser.add_argument("--ingestion-latency-ms", type=float, default=30)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    operations = sample_operations(args.items)
+    with IngestionStub(latency=args.ingestion_latency_ms / 1000) as stub:
+        qm = fake_query_manager(latency=args.keyspaces_latency_ms / 1000)
+        start = time.perf_counter()
+        run_serial(qm, stub.endpoint, operations)
+        serial = time.perf_counter() - start
+
+        index._query_manager = fake_query_manager(latency=args.keyspaces_latency_ms / 1000)
+        start = time.perf_counter()
+        asyncio.run(run_overlapped(stub.endpoint, operations))
+        overlapped = time.perf_counter() - start
+
+    print(f"items:      {args.items}")
+    print(f"serial:     {serial * 1000:.1f} ms ({serial * 1000 / args.items:.2f} ms/item)")
+    print(f"overlapped: {overlapped * 1000:.1f} ms ({overlapped * 1000 / args.items:.2f} ms/item)")
+    print(f"speedup:    {serial / overlapped:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Measures the cold start of the API handler in fresh interpreters: the time to
+import lambda/index.py, the time to prime it, and the latency of the first and of a
+warm write, with and without priming. Keyspaces connections are emulated with a
+fixed connect latency and the ingestion pipeline with a local stub.
+
+    python benchmarks/cold_start.py --runs 5 --connect-latency-ms 300
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+HEAVY_MODULES = ("boto3", "requests", "cassandra")
+
+
+def child(args):
+    """Runs in a fresh interpreter and prints the timings of one cold start."""
+    os.environ["PRIME_ON_INIT"] = "false"
+    sys.path.insert(0, LAMBDA_DIR)
+    start = time.perf_counter()
+    import index
+    import_ms = (time.perf_counter() - start) * 1000
+    loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    # The stand-ins import the Cassandra driver, so they are only imported once the
+    # import of the handler has been timed.
+    import query
+    from standins import FakeCluster, FakeSession, sample_operations
+
+    def connect(self):
+        time.sleep(args.connect_latency_ms / 1000)
+        self.cluster = FakeCluster()
+        self.session = FakeSession(latency=args.keyspaces_latency_ms / 1000)
+        return self
+
+    query.QueryManager.connect = connect
+    prime_ms = 0.0
+    if args.prime:
+        start = time.perf_counter()
+        index.prime()
+        prime_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for operation in sample_operations(2):
+        event = {"httpMethod": "POST", "resource": "/", "body": json.dumps(operation)}
+        start = time.perf_counter()
+        response = index.handler(event, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response["statusCode"] == 200, response
+    index.close_clients()
+    print(json.dumps({
+        "import_ms": import_ms, "loaded": loaded, "prime_ms": prime_ms,
+        "first_request_ms": latencies[0], "warm_request_ms": latencies[1],
+    }))
+
+
+def cold_starts(args, prime, endpoint):
+    """Runs args.runs cold starts in fresh interpreters and returns their timings."""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--child",
+        "--connect-latency-ms", str(args.connect_latency_ms),
+        "--keyspaces-latency-ms", str(args.keyspaces_latency_ms),
+    ] + (["--prime"] if prime else [])
+    env = {**os.environ, "INGESTION_ENDPOINT": endpoint, "INGESTION_MODE": "sync",
+           "KEYSPACE_NAME": "productsearch", "TABLE_NAME": "product_by_item", "LOG_LEVEL": "WARNING"}
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        # The handler also prints its metrics, the timings are on the last line.
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--connect-latency-ms", type=float, default=300)
+    parser.add_argument("--keyspaces-latency-ms", type=float, default=5)
+    parser.add_argument("--ingestion-latency-ms", type=float, default=20)
+    parser.add_argument("--prime", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    from standins import IngestionStub
+
+    with IngestionStub(latency=args.ingestion_latency_ms / 1000) as stub:
+        for label, prime in (("unprimed", False), ("primed", True)):
+            runs = cold_starts(args, prime, stub.endpoint)
+            median = {key: statistics.median(run[key] for run in runs)
+                      for key in ("import_ms", "prime_ms", "first_request_ms", "warm_request_ms")}
+            print(f"{label + ':':<10} import {median['import_ms']:.1f} ms, prime {median['prime_ms']:.1f} ms, "
+                  f"first request {median['first_request_ms']:.1f} ms, warm request {median['warm_request_ms']:.1f} ms")
+        print(f"modules loaded by the import: {', '.join(runs[0]['loaded']) or 'none of ' + ', '.join(HEAVY_MODULES)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Drives the handler of lambda/index.py in-process with concurrent requests of a
+configurable mix, against local stand-ins for Keyspaces, the ingestion pipeline
+and the collection, and reports the throughput, the p50/p95/p99 latency of every
+request kind and the round trips made to each dependency.
+
+    python benchmarks/load_test.py --requests 2000 --concurrency 16 --mix write=60,batch=20,read=15,search=5
+
+Batches can be sent as NDJSON and gzip compressed, the way API Gateway passes
+binary bodies, and the ingestion requests can be compressed, to compare the bytes
+each setting puts on the wire:
+
+    python benchmarks/load_test.py --batch-format ndjson-gzip --ingestion-compression gzip
+
+Results can be saved as a baseline, and a later run compared against it, which
+exits with status 1 if the throughput or a p95 latency regressed by more than
+the tolerance:
+
+    python benchmarks/load_test.py --save-baseline baseline.json
+    python benchmarks/load_test.py --baseline baseline.json --tolerance 0.2
+"""
+
+import argparse
+import base64
+import contextlib
+import gzip
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from standins import FakeCluster, FakeSession, IngestionStub, SearchStub
+
+KINDS = ("write", "batch", "read", "search")
+BATCH_FORMATS = ("json", "json-gzip", "ndjson", "ndjson-gzip")
+
+
+def parse_mix(text):
+    """Parses a mix like write=60,batch=20 into normalized weights."""
+    weights = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise argparse.ArgumentTypeError(f"unknown request kind {kind!r}, expected one of {', '.join(KINDS)}")
+        weights[kind.strip()] = float(weight or 1)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("the mix must have a positive weight")
+    return {kind: weight / total for kind, weight in weights.items()}
+
+
+def percentile(values, share):
+    """Returns the nearest-rank percentile of values, for share between 0 and 1."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+class Workload:
+    """Builds random requests of a mix over a fixed range of products."""
+
+    def __init__(self, mix, products, batch_size, seed, batch_format="json"):
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.products = products
+        self.batch_size = batch_size
+        self.batch_format = batch_format
+        self.random = random.Random(seed)
+
+    def operation(self):
+        product_id = self.random.randrange(self.products)
+        operation = self.random.choices(("insert", "update", "delete"), (6, 3, 1))[0]
+        item = {"product_id": product_id}
+        if operation != "delete":
+            item["product_name"] = f"Product {product_id}"
+            item["product_description"] = f"Description {self.random.randrange(1000)} of product {product_id}."
+        return {"operation": operation, "item": item}
+
+    def batch_event(self, operations):
+        """Returns the event of a batch in the batch format."""
+        if self.batch_format.startswith("ndjson"):
+            body = "".join(json.dumps(operation) + "\n" for operation in operations)
+            headers = {"Content-Type": "application/x-ndjson"}
+        else:
+            body = json.dumps({"operations": operations})
+            headers = {"Content-Type": "application/json"}
+        if not self.batch_format.endswith("gzip"):
+            return {"httpMethod": "POST", "resource": "/", "headers": headers, "body": body}
+        if headers["Content-Type"] == "application/json":
+            headers["Content-Type"] = "application/gzip"
+        compressed = base64.b64encode(gzip.compress(body.encode("utf-8"))).decode("ascii")
+        return {"httpMethod": "POST", "resource": "/", "headers": headers, "body": compressed, "isBase64Encoded": True}
+
+    def request(self):
+        """Returns a (kind, event) tuple."""
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        if kind == "write":
+            event = {"httpMethod": "POST", "resource": "/", "body": json.dumps(self.operation())}
+        elif kind == "batch":
+            event = self.batch_event([self.operation() for _ in range(self.batch_size)])
+        elif kind == "read":
+            ids = ",".join(str(self.random.randrange(self.products)) for _ in range(self.random.randint(1, 10)))
+            event = {"httpMethod": "GET", "resource": "/items", "queryStringParameters": {"ids": ids}, "body": None}
+        else:
+            params = {"q": f"product {self.random.randrange(self.products)}"}
+            event = {"httpMethod": "GET", "resource": "/search", "queryStringParameters": params, "body": None}
+        return kind, event
+
+
+def run(args):
+    """Runs the load test and returns its results."""
+    import index
+    import query
+
+    session = FakeSession(latency=args.keyspaces_latency_ms / 1000, throttle_rate=args.keyspaces_throttle_rate)
+
+    def connect(self):
+        self.cluster = FakeCluster(session)
+        self.session = session
+        return self
+
+    query.QueryManager.connect = connect
+    workload = Workload(args.mix, args.products, args.batch_size, args.seed, args.batch_format)
+    requests = [workload.request() for _ in range(args.requests)]
+    request_bytes = sum(len(event.get("body") or "") for _, event in requests)
+    latencies = defaultdict(list)
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def send(request):
+        kind, event = request
+        start = time.perf_counter()
+        response = index.handler(event, None)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies[kind].append(elapsed)
+            statuses[response["statusCode"]] += 1
+
+    ingestion = IngestionStub(latency=args.ingestion_latency_ms / 1000, throttle_rate=args.ingestion_throttle_rate)
+    collection = SearchStub(latency=args.search_latency_ms / 1000)
+    with ingestion, collection, open(os.devnull, "w") as devnull:
+        os.environ["INGESTION_ENDPOINT"] = ingestion.endpoint
+        os.environ["COLLECTION_ENDPOINT"] = collection.endpoint
+        # The handler writes one metrics line per request to stdout.
+        with contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                list(pool.map(send, requests))
+            pool_stats = index.get_query_manager(None, os.environ["KEYSPACE_NAME"]).pool_stats()
+            # Buffered documents are only sent when the buffer is flushed.
+            index.close_clients()
+            elapsed = time.perf_counter() - start
+
+    total = args.requests
+    results = {
+        "requests": total,
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput": round(total / elapsed, 1),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "bytes": {"requests": request_bytes, "ingestion": ingestion.bytes},
+        "latency_ms": {
+            kind: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50), 2),
+                "p95": round(percentile(values, 0.95), 2),
+                "p99": round(percentile(values, 0.99), 2),
+            }
+            for kind, values in sorted(latencies.items())
+        },
+        "round_trips": {
+            "keyspaces": session.round_trips,
+            "keyspaces_prepares": session.prepares,
+            "keyspaces_throttled": session.throttled,
+            "ingestion": ingestion.requests,
+            "ingestion_throttled": ingestion.throttled,
+            "ingestion_documents": ingestion.documents,
+            "search": collection.requests,
+        },
+        "keyspaces_pool": pool_stats,
+    }
+    all_latencies = [value for values in latencies.values() for value in values]
+    results["latency_ms"]["all"] = {
+        "count": len(all_latencies),
+        "p50": round(percentile(all_latencies, 0.50), 2),
+        "p95": round(percentile(all_latencies, 0.95), 2),
+        "p99": round(percentile(all_latencies, 0.99), 2),
+    }
+    return results
+
+
+def report(results):
+    print(f"requests:    {results['requests']} at concurrency {results['concurrency']} in {results['seconds']} s")
+    print(f"throughput:  {results['throughput']} requests/s")
+    print(f"statuses:    {', '.join(f'{status}={count}' for status, count in results['statuses'].items())}")
+    print(f"bytes:       requests {results['bytes']['requests']}, ingestion {results['bytes']['ingestion']}")
+    print(f"{'latency ms':<12} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for kind, latency in results["latency_ms"].items():
+        print(f"{kind:<12} {latency['count']:>7} {latency['p50']:>9.2f} {latency['p95']:>9.2f} {latency['p99']:>9.2f}")
+    trips = results["round_trips"]
+    per_request = (trips["keyspaces"] + trips["ingestion"] + trips["search"]) / results["requests"]
+    print(f"round trips: keyspaces {trips['keyspaces']} ({trips['keyspaces_prepares']} prepares, "
+          f"{trips['keyspaces_throttled']} throttled), ingestion {trips['ingestion']} "
+          f"({trips['ingestion_documents']} documents, {trips['ingestion_throttled']} throttled), "
+          f"search {trips['search']}, {per_request:.2f} per request")
+    pool = results["keyspaces_pool"]
+    print(f"keyspaces:   {pool['sessions']} sessions, peak {pool['peak_in_flight']} in flight "
+          f"({pool['peak_utilization']:.1%} of capacity), {pool['expansions']} expansions")
+
+
+def regressions(results, baseline, tolerance):
+    """Compares results with a baseline and returns the regressions found."""
+    found = []
+    if results["throughput"] < baseline["throughput"] * (1 - tolerance):
+        found.append(f"throughput fell from {baseline['throughput']} to {results['throughput']} requests/s")
+    for kind, latency in baseline["latency_ms"].items():
+        current = results["latency_ms"].get(kind)
+        if current is not None and current["p95"] > latency["p95"] * (1 + tolerance):
+            found.append(f"{kind} p95 rose from {latency['p95']} to {current['p95']} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", type=parse_mix, default="write=60,batch=20,read=15,search=5",
+                        help="weights of the request kinds write, batch, read and search")
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--batch-format", choices=BATCH_FORMATS, default="json",
+                        help="how batch bodies are sent: a JSON document or NDJSON lines, optionally gzip compressed")
+    parser.add_argument("--products", type=int, default=500, help="the number of distinct products written and read")
+    parser.add_argument("--ingestion-mode", choices=("sync", "buffer", "cdc"), default="sync")
+    parser.add_argument("--ingestion-compression", choices=("none", "gzip"), default="none")
+    parser.add_argument("--keyspaces-latency-ms", type=float, default=5)
+    parser.add_argument("--keyspaces-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--ingestion-latency-ms", type=float, default=20)
+    parser.add_argument("--ingestion-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--search-latency-ms", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", help="a results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="the regression allowed against the baseline")
+    parser.add_argument("--save-baseline", help="a file to save the results to")
+    args = parser.parse_args()
+
+    # The handler reads its configuration when it is imported.
+    os.environ["INGESTION_MODE"] = args.ingestion_mode
+    os.environ["INGESTION_COMPRESSION"] = args.ingestion_compression
+    os.environ.setdefault("KEYSPACE_NAME", "productsearch")
+    os.environ.setdefault("TABLE_NAME", "product_by_item")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = run(args)
+    report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
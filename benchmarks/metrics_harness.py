@@ -0,0 +1,142 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Runs write, batch and read requests through the handler of lambda/index.py against
+local Keyspaces and ingestion stand-ins, and checks that every request emits one
+valid CloudWatch Embedded Metric Format line with the expected metrics, and that
+payloads are only logged at DEBUG.
+
+    python benchmarks/metrics_harness.py
+"""
+
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+from standins import FakeCluster, FakeSession, IngestionStub, sample_operations
+
+os.environ.setdefault("KEYSPACE_NAME", "productsearch")
+os.environ.setdefault("TABLE_NAME", "product_by_item")
+os.environ.setdefault("INGESTION_MODE", "sync")
+
+import index
+import query
+from query import QueryManager
+
+MARKER = "payload-marker-5f1c"
+
+
+class LocalQueryManager(QueryManager):
+    """A QueryManager that connects to a FakeSession instead of Amazon Keyspaces."""
+
+    def connect(self):
+        time.sleep(0.01)
+        self.cluster = FakeCluster()
+        self.session = FakeSession(latency=0.002)
+        return self
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def emf_lines(output):
+    """Parses the EMF documents out of captured stdout."""
+    documents = []
+    for line in output.splitlines():
+        if line.startswith("{") and '"_aws"' in line:
+            documents.append(json.loads(line))
+    return documents
+
+
+def check_emf(document, route, expected):
+    """Checks that an EMF document is well formed and has the expected metrics."""
+    directive, = document["_aws"]["CloudWatchMetrics"]
+    names = [metric["Name"] for metric in directive["Metrics"]]
+    for name in names:
+        assert isinstance(document[name], (int, float)), f"{name} has no numeric value"
+    for dimension_set in directive["Dimensions"]:
+        for dimension in dimension_set:
+            assert dimension in document, f"dimension {dimension} has no value"
+    assert document["Route"] == route, f"expected route {route}, got {document['Route']}"
+    missing = set(expected) - set(names)
+    assert not missing, f"{route} request did not emit {sorted(missing)}"
+    return names
+
+
+def run(event):
+    """Runs one request and returns its response, EMF documents and log messages."""
+    output = io.StringIO()
+    records = Records()
+    logging.getLogger().addHandler(records)
+    try:
+        with contextlib.redirect_stdout(output):
+            response = index.handler(event, None)
+    finally:
+        logging.getLogger().removeHandler(records)
+    return response, emf_lines(output.getvalue()), records.messages
+
+
+def main():
+    logging.getLogger().setLevel(logging.INFO)
+    query.QueryManager = LocalQueryManager
+    index.get_tls_cert = lambda: None
+    operation = sample_operations(1)[0]
+    operation["item"]["product_description"] = MARKER
+
+    with IngestionStub(latency=0.005) as stub:
+        os.environ["INGESTION_ENDPOINT"] = stub.endpoint
+
+        response, documents, messages = run({"httpMethod": "POST", "resource": "/", "body": json.dumps(operation)})
+        assert response["statusCode"] == 200, response
+        assert len(documents) == 1, f"expected one EMF line, got {len(documents)}"
+        names = check_emf(documents[0], "write", [
+            "TotalLatency", "CertLoadLatency", "ConnectLatency", "PrepareLatency",
+            "KeyspacesLatency", "IngestionLatency", "RequestBytes", "IngestionDocuments",
+        ])
+        assert not any(MARKER in message for message in messages), "payload was logged at INFO"
+        print(f"write: {', '.join(f'{name}={documents[0][name]}' for name in names)}")
+
+        batch = {"operations": sample_operations(20, start=1) + sample_operations(5, start=1)}
+        response, documents, _ = run({"httpMethod": "POST", "resource": "/", "body": json.dumps(batch)})
+        assert response["statusCode"] == 200, response
+        names = check_emf(documents[0], "batch", [
+            "TotalLatency", "KeyspacesLatency", "IngestionLatency", "RequestBytes",
+            "BatchSize", "Writes", "WritesSaved", "IngestionDocuments",
+        ])
+        assert documents[0]["BatchSize"] == 25 and documents[0]["WritesSaved"] == 5, documents[0]
+        print(f"batch: {', '.join(f'{name}={documents[0][name]}' for name in names)}")
+
+        read = {"httpMethod": "GET", "resource": "/items", "queryStringParameters": {"ids": "1,2,3"}, "body": None}
+        response, documents, _ = run(read)
+        assert response["statusCode"] == 200, response
+        names = check_emf(documents[0], "items", ["TotalLatency", "KeyspacesLatency", "ItemCacheHits"])
+        print(f"items: {', '.join(f'{name}={documents[0][name]}' for name in names)}")
+
+        logging.getLogger().setLevel(logging.DEBUG)
+        try:
+            _, _, messages = run({"httpMethod": "POST", "resource": "/", "body": json.dumps(operation)})
+        finally:
+            logging.getLogger().setLevel(logging.INFO)
+        assert any(MARKER in message for message in messages), "payload was not logged at DEBUG"
+
+    index.close_clients()
+    print("All metrics were emitted.")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as e:
+        print(f"FAILED: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,426 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Local stand-ins for Amazon Keyspaces and the OpenSearch Ingestion endpoint, so the
+Lambda code in lambda/ can be benchmarked in-process without AWS resources.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda")
+if LAMBDA_DIR not in sys.path:
+    sys.path.insert(0, LAMBDA_DIR)
+
+# The ingestion requests are SigV4 signed, which needs some credentials and a region.
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+from cassandra import WriteTimeout, WriteType
+
+from query import QueryManager
+
+
+class FakeResponseFuture:
+    """Mimics the driver's ResponseFuture, completing after a fixed latency."""
+
+    def __init__(self, latency, error=None, rows=()):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._error = error
+        self._rows = list(rows)
+        timer = threading.Timer(latency, self._complete)
+        timer.daemon = True
+        timer.start()
+
+    def _complete(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback, errback in callbacks:
+            self._fire(callback, errback)
+
+    def _fire(self, callback, errback):
+        if self._error is not None:
+            errback(self._error)
+        else:
+            callback(self._rows)
+
+    def add_callbacks(self, callback, errback):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append((callback, errback))
+                return
+        self._fire(callback, errback)
+
+    def result(self):
+        self._event.wait()
+        if self._error is not None:
+            raise self._error
+        return self._rows
+
+
+class FakePreparedStatement:
+    def __init__(self, query):
+        self.query_string = query
+
+    def bind(self, values):
+        return FakeBoundStatement(self.query_string, values)
+
+
+class FakeBoundStatement:
+    def __init__(self, query, values):
+        self.query_string = query
+        self.values = list(values)
+        self.fetch_size = None
+
+
+def fake_token(values):
+    """Hashes the partition key values of a row into a signed 64 bit token, like Murmur3Partitioner."""
+    return int.from_bytes(hashlib.sha1(repr(tuple(values)).encode("utf-8")).digest()[:8], "big", signed=True)
+
+
+class FakeSession:
+    """
+    Mimics a driver Session, counting the round trips it is asked to make. Writes,
+    point reads by primary key and scans of token ranges are applied to an in-memory
+    table, and a share of
+    writes can be throttled with the WriteTimeout Keyspaces reports when a table
+    runs out of capacity.
+    """
+
+    def __init__(self, latency=0.005, throttle_rate=0.0, key_columns=None):
+        """
+        :param key_columns: A dict of the primary key columns of every table, by table
+            name. Tables that are not listed are keyed by product_id.
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.key_columns = key_columns or {}
+        self.throttled = 0
+        self.is_shutdown = False
+        self.round_trips = 0
+        self.prepares = 0
+        self.rows = {}
+        self.timestamps = {}
+        self._lock = threading.Lock()
+
+    def _throttle(self, statement):
+        query = getattr(statement, "query_string", "").lstrip().upper()
+        if not self.throttle_rate or query.startswith("SELECT"):
+            return None
+        with self._lock:
+            if self.throttled >= self.round_trips * self.throttle_rate:
+                return None
+            self.throttled += 1
+        return WriteTimeout("Operation timed out - received only 0 responses.", write_type=WriteType.SIMPLE)
+
+    def _scan(self, query, parameters):
+        """Reads the rows of a table whose partition token falls in a range, in token order."""
+        selection = re.search(r"SELECT\s+(.*?)\s+FROM\b", query, re.IGNORECASE).group(1)
+        selected = re.findall(r"\w+\([^)]*\)|[\w\"]+", selection)
+        partition_key = _names(re.search(r"\btoken\(([^)]*)\)", query, re.IGNORECASE).group(1))
+        table = re.search(r"\bFROM\s+([\w.]+)", query, re.IGNORECASE).group(1).rpartition(".")[2]
+        start, end = parameters
+        Row = namedtuple("Row", [column.strip('"') for column in selected], rename=True)
+        rows = []
+        with self._lock:
+            for key, row in self.rows.items():
+                if key[0] != table:
+                    continue
+                token = fake_token(row.get(column) for column in partition_key)
+                if not start < token <= end:
+                    continue
+                values = []
+                for expression in selected:
+                    function = re.match(r"(\w+)\(([^)]*)\)", expression)
+                    if function is None:
+                        values.append(row.get(expression.strip('"')))
+                    elif function.group(1).lower() == "token":
+                        values.append(token)
+                    else:
+                        values.append(self.timestamps.get(key) if row.get(_names(function.group(2))[0]) is not None else None)
+                rows.append((token, Row(*values)))
+        return [row for _, row in sorted(rows, key=lambda entry: entry[0])]
+
+    def _apply(self, statement, parameters):
+        query = getattr(statement, "query_string", "").strip().rstrip(";")
+        verb = query.split(None, 1)[0].upper()
+        parameters = list(parameters if parameters is not None else getattr(statement, "values", None) or [])
+        if verb == "SELECT" and re.search(r"\bWHERE\s+token\(", query, re.IGNORECASE):
+            return self._scan(query, parameters)
+        timestamp = None
+        if "USING TIMESTAMP" in query.upper():
+            timestamp = parameters.pop() if verb == "INSERT" else parameters.pop(0)
+        if verb == "INSERT":
+            columns = re.search(r"\(([^)]*)\)\s*VALUES", query, re.IGNORECASE).group(1)
+            values = dict(zip(_names(columns), parameters))
+        else:
+            assignments = re.search(r"\bSET\s+(.*?)\s+WHERE\b", query, re.IGNORECASE)
+            columns = _names(assignments.group(1).replace("=?", "").replace("= ?", "")) if assignments else []
+            where = _names(re.split(r"\bWHERE\b", query, flags=re.IGNORECASE)[1].replace("AND", ",").replace("= ?", "").replace("=?", ""))
+            values = dict(zip(columns + where, parameters))
+        table = re.search(r"\b(?:INTO|UPDATE|FROM)\s+([\w.]+)", query, re.IGNORECASE).group(1).rpartition(".")[2]
+        key = (table,) + tuple(values.get(column) for column in self.key_columns.get(table, ("product_id",)))
+        with self._lock:
+            if verb in ("INSERT", "UPDATE", "DELETE"):
+                # Like Keyspaces, a write older than the stored one is ignored.
+                if timestamp is not None and timestamp < self.timestamps.get(key, 0):
+                    return []
+                if timestamp is not None:
+                    self.timestamps[key] = timestamp
+            if verb in ("INSERT", "UPDATE"):
+                self.rows.setdefault(key, {}).update(values)
+            elif verb == "DELETE":
+                self.rows.pop(key, None)
+            elif verb == "SELECT":
+                row = self.rows.get(key)
+                if row is None:
+                    return []
+                selected = _names(re.search(r"SELECT\s+(.*?)\s+FROM\b", query, re.IGNORECASE).group(1))
+                return [namedtuple("Row", selected)(*(row.get(column) for column in selected))]
+        return []
+
+    def _count(self):
+        with self._lock:
+            self.round_trips += 1
+
+    def prepare(self, query):
+        self._count()
+        self.prepares += 1
+        time.sleep(self.latency)
+        return FakePreparedStatement(query)
+
+    def execute(self, statement, parameters=None):
+        self._count()
+        time.sleep(self.latency)
+        error = self._throttle(statement)
+        if error is not None:
+            raise error
+        self._apply(statement, parameters)
+        return type("ResultSet", (), {"response_future": None})()
+
+    def execute_async(self, statement, parameters=None):
+        self._count()
+        error = self._throttle(statement)
+        if error is not None:
+            return FakeResponseFuture(self.latency, error=error)
+        return FakeResponseFuture(self.latency, rows=self._apply(statement, parameters))
+
+
+def _names(columns):
+    """Splits a CQL column list into unquoted column names."""
+    return [column.strip().strip('"') for column in columns.split(",") if column.strip()]
+
+
+class FakeHost:
+    is_up = True
+
+
+class FakeMetadata:
+    def __init__(self):
+        self.keyspaces = {}
+        self.partitioner = "org.apache.cassandra.dht.Murmur3Partitioner"
+
+    def add_table(self, keyspace_name, table_name, partition_key, clustering_key, columns):
+        """
+        Describes a table the way the driver's schema metadata does.
+
+        :param columns: A dict of the CQL type of every column, primary key first.
+        """
+        column = namedtuple("ColumnMetadata", ["name", "cql_type"])
+        keyspace = self.keyspaces.setdefault(keyspace_name, SimpleNamespace(tables={}))
+        keyspace.tables[table_name] = SimpleNamespace(
+            name=table_name,
+            partition_key=[column(name, columns[name]) for name in partition_key],
+            clustering_key=[column(name, columns[name]) for name in clustering_key],
+            columns={name: column(name, cql_type) for name, cql_type in columns.items()},
+        )
+
+    def all_hosts(self):
+        return [FakeHost()]
+
+
+class FakeCluster:
+    def __init__(self, session=None):
+        self.metadata = FakeMetadata()
+        self.session = session
+
+    def connect(self, keyspace=None):
+        """Returns the one FakeSession, so that every session of a pool shares its counters."""
+        return self.session
+
+    def shutdown(self):
+        pass
+
+
+def fake_query_manager(keyspace_name="productsearch", latency=0.005, item_cache=None, throttle_rate=0.0):
+    """Builds a QueryManager whose session is a FakeSession."""
+    qm = QueryManager(None, None, keyspace_name, item_cache=item_cache)
+    qm.session = FakeSession(latency, throttle_rate)
+    qm.cluster = FakeCluster(qm.session)
+    return qm
+
+
+class IngestionStub:
+    """
+    A local HTTP server emulating the OpenSearch Ingestion endpoint. Every request
+    waits for a fixed latency, and a share of requests can be throttled with 429, or
+    failed with another error_status. Gzip bodies are decompressed like the pipeline
+    does with compression: gzip, and the bytes received are counted.
+    """
+
+    def __init__(self, latency=0.02, throttle_rate=0.0, error_status=429):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.documents = 0
+        self.throttled = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                size = len(body)
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                time.sleep(stub.latency)
+                with stub._lock:
+                    stub.requests += 1
+                    stub.bytes += size
+                    throttle = stub.throttle_rate and stub.throttled < stub.requests * stub.throttle_rate
+                    if throttle:
+                        stub.throttled += 1
+                    else:
+                        stub.documents += len(json.loads(body or b"[]"))
+                status, text = (stub.error_status, b"Request failed") if throttle else (200, b"200 OK")
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def sample_operations(count, start=0):
+    """Builds insert operations for count distinct products."""
+    return [
+        {
+            "operation": "insert",
+            "item": {
+                "product_id": product_id,
+                "product_name": f"Product {product_id}",
+                "product_description": f"Description of product {product_id}.",
+            },
+        }
+        for product_id in range(start, start + count)
+    ]
+
+
+class SearchStub:
+    """
+    A local HTTP server emulating the _search API of an OpenSearch collection over
+    in-memory documents. It supports match_all, term and multi_match queries,
+    sorting by one or more fields and search_after paging.
+    """
+
+    def __init__(self, documents=None, latency=0.0):
+        self.documents = documents if documents is not None else {}
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                time.sleep(stub.latency)
+                stub.requests += 1
+                text = json.dumps(stub.search(body)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(text)))
+                self.end_headers()
+                self.wfile.write(text)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _matches(self, document, query):
+        if "term" in query:
+            (field, value), = query["term"].items()
+            return document.get(field) == (value["value"] if isinstance(value, dict) else value)
+        if "multi_match" in query:
+            words = str(query["multi_match"]["query"]).lower().split()
+            text = " ".join(str(document.get(field.split("^")[0], "")) for field in query["multi_match"]["fields"]).lower()
+            return any(word in text for word in words)
+        if "bool" in query:
+            clauses = query["bool"].get("must", []) + query["bool"].get("filter", [])
+            return all(self._matches(document, clause) for clause in clauses)
+        return True
+
+    def search(self, body):
+        hits = [d for d in self.documents.values() if self._matches(d, body.get("query", {"match_all": {}}))]
+        sort_fields = [field for sort in body.get("sort", []) for field in sort]
+        if sort_fields:
+            hits.sort(key=lambda d: [d[field] for field in sort_fields])
+            if "search_after" in body:
+                hits = [d for d in hits if [d[field] for field in sort_fields] > body["search_after"]]
+        total = len(hits)
+        start = body.get("from", 0)
+        hits = hits[start:start + body.get("size", 10)]
+        return {"hits": {"total": {"value": total}, "hits": [
+            dict({"_id": str(d.get("product_id")), "_source": d}, **({"sort": [d[field] for field in sort_fields]} if sort_fields else {}))
+            for d in hits
+        ]}}
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
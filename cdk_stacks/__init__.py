@@ -2,4 +2,5 @@ from .collection_pipeline_role import OpsCollectionPipelineRoleStack
 from .opensearch_serverless import OpsServerlessStack
 from .opensearch_serverless_ingestion import OpsServerlessIngestionStack
 from .keyspaces import OpsKeyspacesStack
+from .keyspaces_cdc import OpsKeyspacesCdcStack
 from .apigw_lambda import OpsApigwLambdaStack
\ No newline at end of file
@@ -7,7 +7,14 @@ from aws_cdk import (
     aws_lambda as lambda_,
     aws_iam as iam_,
     aws_kms as kms_,
+    aws_sqs as sqs_,
+    aws_lambda_event_sources as lambda_event_sources_,
+    aws_opensearchserverless as aws_opss,
     )
+import json
+
+from .entities import entities_from_context, lambda_entities
+from .pipeline_config import pipeline_settings_from_context
 
 class OpsApigwLambdaStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -46,6 +53,16 @@ class OpsApigwLambdaStack(Stack):
           ] 
         }))          
 
+        #Create an IAM policy to search the collection.
+        search_policy_doc = iam_.PolicyDocument()
+        search_policy_doc.add_statements(iam_.PolicyStatement(**{
+          "effect": iam_.Effect.ALLOW,
+          "resources": [ f"arn:aws:aoss:*:{cdk.Aws.ACCOUNT_ID}:collection/*"],
+          "actions": [
+              "aoss:APIAccessAll"
+          ]
+        }))
+
         #Create an IAM role for the Lambda function
         lambda_role = iam_.Role(
             self,
@@ -56,10 +73,83 @@ class OpsApigwLambdaStack(Stack):
                 iam_.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole')
             ],
             inline_policies={
-                "IngestPolicy": ingest_policy_doc
+                "IngestPolicy": ingest_policy_doc,
+                "SearchPolicy": search_policy_doc
             }
         )
-                      
+
+        #Allow the Lambda function to read the indexes of the collection.
+        collection_name = self.node.try_get_context('collection_name') or "ingestion-collection"
+        search_access_policy = json.dumps([
+          {
+            "Rules": [
+              {
+                "Resource": [
+                  f"index/{collection_name}/*"
+                ],
+                "Permission": [
+                  "aoss:DescribeIndex",
+                  "aoss:ReadDocument"
+                ],
+                "ResourceType": "index"
+              }
+            ],
+            "Principal": [
+              lambda_role.role_arn
+            ],
+            "Description": "search-access-rule"
+          }
+        ], indent=2)
+
+        #XXX: max length of policy name is 32
+        search_access_policy_name = f"{collection_name}-api-policy"
+        assert len(search_access_policy_name) <= 32
+
+        aws_opss.CfnAccessPolicy(
+            self,
+            "SearchDataAccessPolicy",
+            name=search_access_policy_name,
+            description="Policy for search access from the API",
+            policy=search_access_policy,
+            type="data"
+        )
+
+        #Create the queue that buffers documents between the API and the ingestion pipeline.
+        #Messages that repeatedly fail to be ingested are moved to the dead-letter queue.
+        #With the change stream enabled, OpsKeyspacesCdcStack indexes the writes instead of the API.
+        cdc_enabled = str(self.node.try_get_context('cdc_enabled')).lower() == "true"
+        ingestion_mode = self.node.try_get_context('ingestion_mode') or ("cdc" if cdc_enabled else "sync")
+        ingestion_compression = pipeline_settings_from_context(self.node)["compression"]
+        ingestion_dlq = sqs_.Queue(
+            self,
+            "IngestionDeadLetterQueue",
+            retention_period=cdk.Duration.days(14),
+            encryption=sqs_.QueueEncryption.SQS_MANAGED
+        )
+        ingestion_queue = sqs_.Queue(
+            self,
+            "IngestionQueue",
+            visibility_timeout=cdk.Duration.minutes(6),
+            encryption=sqs_.QueueEncryption.SQS_MANAGED,
+            dead_letter_queue=sqs_.DeadLetterQueue(max_receive_count=5, queue=ingestion_dlq)
+        )
+
+        #The entities, each a table and an index, served by the API. The first one is the default.
+        entities = entities_from_context(self.node)
+
+        #Batches and NDJSON bodies of up to 64 MiB decompressed fan out to many writes and
+        #ingestion requests, so the function gets as long as the API waits for it, at most
+        #29 seconds, and the memory to parse a whole JSON body.
+        api_timeout_seconds = int(self.node.try_get_context('api_timeout_seconds') or 29)
+        if not 1 <= api_timeout_seconds <= 29:
+            raise ValueError(f"api_timeout_seconds must be an integer between 1 and 29, got {api_timeout_seconds!r}.")
+        api_memory_size = int(self.node.try_get_context('api_memory_size') or 512)
+        if not 128 <= api_memory_size <= 10240:
+            raise ValueError(f"api_memory_size must be an integer between 128 and 10240, got {api_memory_size!r}.")
+        #Open the Keyspaces session and prepare the statements while the function initializes.
+        prime_on_init = self.node.try_get_context('prime_on_init')
+        prime_on_init = True if prime_on_init is None else str(prime_on_init).lower() == "true"
+
         #Create the Lambda function to insert/update/delete a keyspaces table. 
         apigw_lambda = lambda_.Function(
             self,
@@ -67,22 +157,85 @@ class OpsApigwLambdaStack(Stack):
             runtime=lambda_.Runtime.PYTHON_3_9,
             handler="index.handler",
             code=lambda_.Code.from_asset("lambda"),
+            timeout=cdk.Duration.seconds(api_timeout_seconds),
+            memory_size=api_memory_size,
             environment={
-                "TABLE_NAME": "product_by_item",
-                "KEYSPACE_NAME": "productsearch",
-                "INGESTION_ENDPOINT": cdk.Fn.import_value('OpsServerlessIngestionStackPipelineUrl')
+                "TABLE_NAME": entities[0]["table"],
+                "KEYSPACE_NAME": entities[0]["keyspace"],
+                "INDEX_NAME": entities[0]["index"],
+                "ENTITIES": lambda_entities(entities),
+                "INGESTION_ENDPOINT": cdk.Fn.import_value('OpsServerlessIngestionStackPipelineUrl'),
+                "INGESTION_MODE": ingestion_mode,
+                "INGESTION_COMPRESSION": ingestion_compression,
+                "INGESTION_QUEUE_URL": ingestion_queue.queue_url,
+                "INGESTION_DLQ_URL": ingestion_dlq.queue_url,
+                "COLLECTION_ENDPOINT": cdk.Fn.import_value('OpsServerlessStackCollectionEndpoint'),
+                "PRIME_ON_INIT": str(prime_on_init).lower()
             },
             layers=[requests_layer, boto3_layer, requests_auth_aws_sigv4_layer],
             role=lambda_role
         )
+        ingestion_queue.grant_send_messages(apigw_lambda)
+        #Documents that still fail to be ingested after retries are dead-lettered.
+        ingestion_dlq.grant_send_messages(apigw_lambda)
+
+        #Create an IAM role for the ingestion worker, which only needs to ingest into the pipeline.
+        worker_role = iam_.Role(
+            self,
+            "IngestionWorkerRole",
+            assumed_by=iam_.ServicePrincipal("lambda.amazonaws.com"),
+            managed_policies=[
+                iam_.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole')
+            ],
+            inline_policies={
+                "IngestPolicy": ingest_policy_doc
+            }
+        )
+
+        #Create the Lambda function that delivers queued documents to the ingestion pipeline in bulk.
+        ingestion_worker = lambda_.Function(
+            self,
+            "IngestionWorker",
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            handler="ingest_worker.handler",
+            code=lambda_.Code.from_asset("lambda"),
+            timeout=cdk.Duration.minutes(1),
+            environment={
+                "INGESTION_ENDPOINT": cdk.Fn.import_value('OpsServerlessIngestionStackPipelineUrl'),
+                "INGESTION_DLQ_URL": ingestion_dlq.queue_url,
+                "INGESTION_COMPRESSION": ingestion_compression
+            },
+            layers=[requests_layer, boto3_layer, requests_auth_aws_sigv4_layer],
+            role=worker_role
+        )
+        #Payloads the pipeline rejects as invalid are dead-lettered without being retried.
+        ingestion_dlq.grant_send_messages(ingestion_worker)
+        ingestion_worker.add_event_source(lambda_event_sources_.SqsEventSource(
+            ingestion_queue,
+            batch_size=1000,
+            max_batching_window=cdk.Duration.seconds(5),
+            report_batch_item_failures=True
+        ))
 
         #Create the API Gateway.
+        #Gzip and NDJSON request bodies are passed to the function as binary, base64 encoded,
+        #and responses larger than 1 KiB are compressed for clients that accept gzip.
         api = apigw_.LambdaRestApi(
             self,
             "Keyspaces-OpenSearch-Endpoint",
-            handler=apigw_lambda
+            handler=apigw_lambda,
+            binary_media_types=["application/gzip", "application/x-gzip", "application/x-ndjson"],
+            min_compression_size=cdk.Size.kibibytes(1)
             )
 
+        #Searches are served by the same function, so that writes can invalidate its search cache.
+        api.root.add_resource("search").add_method("GET")
+
+        #Point reads are served from Keyspaces through the function's item cache, which writes invalidate.
+        items_resource = api.root.add_resource("items")
+        items_resource.add_method("GET")
+        items_resource.add_resource("{product_id}").add_method("GET")
+
         deployment = apigw_.Deployment(
             self,
             "Deployment",
@@ -0,0 +1,86 @@
+import json
+import re
+
+#The entities deployed when the cdk.json context has no "entities": the products table and index.
+DEFAULT_ENTITIES = [
+  {
+    "name": "product",
+    "keyspace": "productsearch",
+    "table": "product_by_item",
+    "index": "products",
+    "partition_key": [{"name": "product_id", "type": "int"}],
+    "clustering_key": [],
+    "columns": [
+      {"name": "product_description", "type": "text"},
+      {"name": "product_name", "type": "text"}
+    ],
+    "search_fields": ["product_name^2", "product_description"]
+  }
+]
+
+NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_]{0,47}$")
+INDEX_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_\-]{0,79}$")
+TEXT_TYPES = {"text", "varchar", "ascii"}
+
+
+def entities_from_context(node):
+  """
+  Reads the entities of the deployment from the "entities" context value. Every
+  entity is a Keyspaces table and the OpenSearch index its items are searched in.
+  The first entity is the default one of requests that do not name an entity.
+
+  :raises ValueError: If the configuration is invalid.
+  """
+  entities = node.try_get_context('entities') or DEFAULT_ENTITIES
+  if isinstance(entities, str):
+    entities = json.loads(entities)
+  names, tables, indexes = set(), set(), set()
+  for entity in entities:
+    for field in ("name", "keyspace", "table", "index", "partition_key"):
+      if not entity.get(field):
+        raise ValueError(f"Entity {entity.get('name')} has no {field}.")
+    name = entity["name"]
+    for field in ("name", "keyspace", "table"):
+      if not NAME_PATTERN.match(entity[field]):
+        raise ValueError(f"Entity {name} has an invalid {field}: {entity[field]}.")
+    if not INDEX_PATTERN.match(entity["index"]):
+      raise ValueError(f"Entity {name} has an invalid index: {entity['index']}.")
+    table = (entity["keyspace"], entity["table"])
+    if name in names or table in tables or entity["index"] in indexes:
+      raise ValueError(f"Entity {name} repeats the name, table or index of another entity.")
+    names.add(name)
+    tables.add(table)
+    indexes.add(entity["index"])
+    columns = entity["partition_key"] + entity.get("clustering_key", []) + entity.get("columns", [])
+    column_names = [column.get("name") for column in columns]
+    if not all(column.get("name") and column.get("type") for column in columns) or len(set(column_names)) != len(column_names):
+      raise ValueError(f"Entity {name} has columns without a name or type, or with the same name.")
+    unknown = set(entity.get("filter_fields", [])) - set(column_names)
+    if unknown:
+      raise ValueError(f"Entity {name} has filter_fields that are not columns: {', '.join(sorted(unknown))}.")
+  return entities
+
+
+def key_columns(entity):
+  """The primary key columns of an entity, partition key first."""
+  return entity["partition_key"] + entity.get("clustering_key", [])
+
+
+def lambda_entities(entities):
+  """
+  Returns the ENTITIES environment variable of the functions: the table, index,
+  primary key column types and search fields of every entity, as JSON.
+  """
+  return json.dumps([
+    {
+      "name": entity["name"],
+      "keyspace": entity["keyspace"],
+      "table": entity["table"],
+      "index": entity["index"],
+      "key": {column["name"]: column["type"] for column in key_columns(entity)},
+      "search_fields": entity.get("search_fields") or [
+        column["name"] for column in entity.get("columns", []) if column["type"] in TEXT_TYPES
+      ]
+    }
+    for entity in entities
+  ], separators=(",", ":"))
@@ -0,0 +1,94 @@
+import re
+
+from .entities import TEXT_TYPES, key_columns
+
+#The analyzer of searched text: words are lower cased, folded to ASCII and stemmed,
+#so that a search for "sweaters" also matches "Sweater".
+TEXT_ANALYZER = "item_text"
+ANALYSIS = {
+  "analyzer": {
+    TEXT_ANALYZER: {
+      "type": "custom",
+      "tokenizer": "standard",
+      "filter": ["lowercase", "asciifolding", "porter_stem"]
+    }
+  }
+}
+
+#The OpenSearch field types of CQL types. Types that are not listed, such as
+#user-defined types, are kept in the document source without being indexed.
+FIELD_TYPES = {
+  "tinyint": "byte",
+  "smallint": "short",
+  "int": "integer",
+  "bigint": "long",
+  "varint": "long",
+  "counter": "long",
+  "float": "float",
+  "double": "double",
+  "decimal": "double",
+  "boolean": "boolean",
+  "timestamp": "date",
+  "date": "date",
+  "uuid": "keyword",
+  "timeuuid": "keyword",
+  "inet": "ip",
+  "blob": "binary",
+  **{name: "keyword" for name in TEXT_TYPES}
+}
+
+
+def element_type(cql_type):
+  """The type of the values of a CQL type: list<int> and set<int> hold int values."""
+  match = re.match(r"^\s*(?:frozen\s*<\s*)?(list|set)\s*<\s*([a-z]+)\s*>", cql_type.lower())
+  if match:
+    return match.group(2)
+  return cql_type.strip().lower()
+
+
+def field_mapping(cql_type, searched, indexed):
+  """
+  The mapping of one column.
+
+  :param searched: Whether the column is searched as text.
+  :param indexed: Whether the column is looked up, filtered or sorted by exact value.
+  """
+  value_type = element_type(cql_type)
+  if searched and value_type in TEXT_TYPES:
+    #Searches are scored by term frequency and never match phrases, so the positions
+    #of the terms are not indexed.
+    return {"type": "text", "analyzer": TEXT_ANALYZER, "index_options": "freqs"}
+  field_type = FIELD_TYPES.get(value_type)
+  if field_type is None:
+    return {"type": "object", "enabled": False}
+  if field_type == "binary":
+    return {"type": "binary"}
+  if searched or indexed:
+    return {"type": field_type}
+  #Other columns are only returned with the documents.
+  return {"type": field_type, "index": False, "doc_values": False}
+
+
+def index_template(entity):
+  """
+  Builds the index template of an entity's index. Key columns and filter_fields are
+  indexed by exact value, search_fields are analyzed as text, and the other columns
+  are only kept in the document source. Columns added to the table later are not
+  indexed until the template is deployed again.
+  """
+  search_fields = {field.split("^")[0] for field in entity.get("search_fields") or [
+    column["name"] for column in entity.get("columns", []) if column["type"] in TEXT_TYPES
+  ]}
+  indexed = {column["name"] for column in key_columns(entity)} | set(entity.get("filter_fields", []))
+  properties = {
+    column["name"]: field_mapping(column["type"], column["name"] in search_fields, column["name"] in indexed)
+    for column in key_columns(entity) + entity.get("columns", [])
+  }
+  return {
+    "index_patterns": [entity["index"]],
+    "priority": 100,
+    "template": {
+      "settings": {"index": {"analysis": ANALYSIS}},
+      "mappings": {"dynamic": False, "properties": properties}
+    }
+  }
@@ -6,31 +6,75 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from .entities import entities_from_context
+from .table_options import auto_scaling_specifications, billing_mode, table_options_from_context, warm_throughput
+
 class OpsKeyspacesStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
-        ks = cassandra.CfnKeyspace(
-            self, "OpsKeyspaces", keyspace_name="productsearch"
-        )
-        cassandra.CfnTable(
-            self,
-            "productsearch",
-            table_name="product_by_item",
-            keyspace_name="productsearch",
-            regular_columns=[
-                cassandra.CfnTable.ColumnProperty(
-                    column_name="product_description", 
-                    column_type="text"
-                ),
-                cassandra.CfnTable.ColumnProperty(
-                    column_name="product_name", 
-                    column_type="text"
-                ),                               
-            ],
-            partition_key_columns=[
-                cassandra.CfnTable.ColumnProperty(
-                    column_name="product_id", column_type="int"
-                )                
-            ],
-        ).add_depends_on(ks)
\ No newline at end of file
+        cdc_enabled = str(self.node.try_get_context('cdc_enabled')).lower() == "true"
+
+        #Create a keyspace and table for every entity. The first entity keeps the construct IDs
+        #of the original productsearch keyspace and table, so existing deployments are not replaced.
+        keyspaces = {}
+        for position, entity in enumerate(entities_from_context(self.node)):
+            #The capacity, TTL and recovery options of the table, from the "table_options"
+            #context value and the entity's own "table_options".
+            options = table_options_from_context(self.node, entity)
+            keyspace_name = entity["keyspace"]
+            if keyspace_name not in keyspaces:
+                keyspaces[keyspace_name] = cassandra.CfnKeyspace(
+                    self, "OpsKeyspaces" if not keyspaces else f"{keyspace_name}Keyspace",
+                    keyspace_name=keyspace_name
+                )
+            table = cassandra.CfnTable(
+                self,
+                "productsearch" if position == 0 else f"{entity['name']}Table",
+                table_name=entity["table"],
+                keyspace_name=keyspace_name,
+                regular_columns=[
+                    cassandra.CfnTable.ColumnProperty(
+                        column_name=column["name"],
+                        column_type=column["type"]
+                    )
+                    for column in entity.get("columns", [])
+                ],
+                partition_key_columns=[
+                    cassandra.CfnTable.ColumnProperty(
+                        column_name=column["name"], column_type=column["type"]
+                    )
+                    for column in entity["partition_key"]
+                ],
+                clustering_key_columns=[
+                    cassandra.CfnTable.ClusteringKeyColumnProperty(
+                        column=cassandra.CfnTable.ColumnProperty(
+                            column_name=column["name"], column_type=column["type"]
+                        ),
+                        order_by=column.get("order", "ASC")
+                    )
+                    for column in entity.get("clustering_key", [])
+                ] or None,
+                #Writes carry their version as USING TIMESTAMP, which needs client-side timestamps.
+                client_side_timestamps_enabled=True,
+                default_time_to_live=options["default_ttl"] or None,
+                point_in_time_recovery_enabled=options["point_in_time_recovery"] or None,
+            )
+            table.add_depends_on(keyspaces[keyspace_name])
+
+            #Provisioned capacity, its auto scaling and pre-warming are set as CloudFormation
+            #properties, since they are not in this version of the CfnTable construct.
+            for name, value in (
+                ("BillingMode", billing_mode(options)),
+                ("AutoScalingSpecifications", auto_scaling_specifications(options)),
+                ("WarmThroughput", warm_throughput(options)),
+            ):
+                if value is not None:
+                    table.add_property_override(name, value)
+
+            #Enable the change stream read by OpsKeyspacesCdcStack.
+            if cdc_enabled:
+                table.add_property_override("CdcSpecification", {
+                    "Status": "ENABLED",
+                    "ViewType": "NEW_IMAGE"
+                })
@@ -0,0 +1,107 @@
+import aws_cdk as cdk
+
+from aws_cdk import (
+  Stack,
+  aws_dynamodb,
+  aws_events,
+  aws_events_targets,
+  aws_iam,
+  aws_lambda
+)
+from constructs import Construct
+
+from .entities import entities_from_context, lambda_entities
+from .pipeline_config import pipeline_settings_from_context
+
+
+class OpsKeyspacesCdcStack(Stack):
+
+  def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    super().__init__(scope, construct_id, **kwargs)
+
+    # One consumer follows the change streams of the tables of all entities.
+    entities = entities_from_context(self.node)
+
+    # Stores the last ingested sequence number of every shard of the change streams, keyed
+    # by the stream ARN and shard ID since shard IDs can repeat across streams.
+    checkpoint_table = aws_dynamodb.Table(self, "CdcCheckpointTable",
+      partition_key=aws_dynamodb.Attribute(name="shard_id", type=aws_dynamodb.AttributeType.STRING),
+      billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+      removal_policy=cdk.RemovalPolicy.DESTROY
+    )
+
+    requests_layer = aws_lambda.LayerVersion(self, "requests-cassandra",
+      code=aws_lambda.Code.from_asset("lambda_layers/requests-cassandra.zip"),
+      compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9]
+    )
+    boto3_layer = aws_lambda.LayerVersion(self, "boto3",
+      code=aws_lambda.Code.from_asset("lambda_layers/boto3.zip"),
+      compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9]
+    )
+    requests_auth_aws_sigv4_layer = aws_lambda.LayerVersion(self, "requests-auth-aws-sigv4",
+      code=aws_lambda.Code.from_asset("lambda_layers/requests-auth-aws-sigv4.zip"),
+      compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9]
+    )
+
+    cdc_policy_doc = aws_iam.PolicyDocument()
+    cdc_policy_doc.add_statements(aws_iam.PolicyStatement(**{
+      "effect": aws_iam.Effect.ALLOW,
+      "resources": [
+        resource
+        for entity in entities
+        for resource in (
+          f"arn:aws:cassandra:{cdk.Aws.REGION}:{cdk.Aws.ACCOUNT_ID}:/keyspace/{entity['keyspace']}/table/{entity['table']}",
+          f"arn:aws:cassandra:{cdk.Aws.REGION}:{cdk.Aws.ACCOUNT_ID}:/keyspace/{entity['keyspace']}/table/{entity['table']}/stream/*"
+        )
+      ],
+      "actions": [
+        "cassandra:ListStreams",
+        "cassandra:GetStream",
+        "cassandra:GetShardIterator",
+        "cassandra:GetRecords"
+      ]
+    }))
+    cdc_policy_doc.add_statements(aws_iam.PolicyStatement(**{
+      "effect": aws_iam.Effect.ALLOW,
+      "resources": [f"arn:aws:osis:*:{cdk.Aws.ACCOUNT_ID}:pipeline/*"],
+      "actions": [
+        "osis:Ingest"
+      ]
+    }))
+
+    cdc_role = aws_iam.Role(self, "CdcConsumerRole",
+      assumed_by=aws_iam.ServicePrincipal("lambda.amazonaws.com"),
+      managed_policies=[
+        aws_iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole')
+      ],
+      inline_policies={
+        "CdcPolicy": cdc_policy_doc
+      }
+    )
+
+    # A single consumer polls all shards, so the change order of each product is kept.
+    cdc_consumer = aws_lambda.Function(self, "CdcConsumer",
+      runtime=aws_lambda.Runtime.PYTHON_3_9,
+      handler="cdc.handler",
+      code=aws_lambda.Code.from_asset("lambda"),
+      timeout=cdk.Duration.minutes(5),
+      reserved_concurrent_executions=1,
+      environment={
+        "KEYSPACE_NAME": entities[0]["keyspace"],
+        "TABLE_NAME": entities[0]["table"],
+        "ENTITIES": lambda_entities(entities),
+        "CHECKPOINT_TABLE_NAME": checkpoint_table.table_name,
+        "INGESTION_ENDPOINT": cdk.Fn.import_value('OpsServerlessIngestionStackPipelineUrl'),
+        "INGESTION_COMPRESSION": pipeline_settings_from_context(self.node)["compression"]
+      },
+      layers=[requests_layer, boto3_layer, requests_auth_aws_sigv4_layer],
+      role=cdc_role
+    )
+    checkpoint_table.grant_read_write_data(cdc_consumer)
+
+    aws_events.Rule(self, "CdcConsumerSchedule",
+      schedule=aws_events.Schedule.rate(cdk.Duration.minutes(1)),
+      targets=[aws_events_targets.LambdaFunction(cdc_consumer)]
+    )
+
+    cdk.CfnOutput(self, f'{self.stack_name}CheckpointTable', value=checkpoint_table.table_name)
@@ -128,6 +128,7 @@ class OpsServerlessStack(Stack):
 
     self.collection_endpoint = cfn_collection.attr_collection_endpoint
 
-    cdk.CfnOutput(self, f'{self.stack_name}-Endpoint', value=cfn_collection.attr_collection_endpoint)
+    cdk.CfnOutput(self, f'{self.stack_name}-Endpoint', value=cfn_collection.attr_collection_endpoint,
+      export_name=f'{self.stack_name}CollectionEndpoint')
     cdk.CfnOutput(self, f'{self.stack_name}-DashboardsURL', value=cfn_collection.attr_dashboard_endpoint)
 
@@ -1,3 +1,5 @@
+import json
+
 import aws_cdk as cdk
 
 from aws_cdk import (
@@ -5,10 +7,17 @@ from aws_cdk import (
   aws_logs,
   aws_osis,
   aws_kms,
-  aws_iam
+  aws_iam,
+  aws_lambda,
+  aws_opensearchserverless as aws_opss,
+  custom_resources
 )
 from constructs import Construct
 
+from .entities import entities_from_context
+from .index_mappings import index_template
+from .pipeline_config import pipeline_configuration, pipeline_settings_from_context
+
 
 class OpsServerlessIngestionStack(Stack):
 
@@ -17,31 +26,18 @@ class OpsServerlessIngestionStack(Stack):
 
     pipeline_name = "serverless-ingestion"
 
-    pipeline_configuration_body = f'''version: "2"
-product-pipeline:
-  source:
-    http:
-      path: "/${{pipelineName}}/test_ingestion_path"
-  processor:
-    - date:
-        from_time_received: true
-        destination: "@timestamp"
-  sink:
-    - opensearch:
-        hosts: [ "{collection_endpoint}" ]
-        document_root_key: "item"
-        index_type: custom
-        index: "products"
-        document_id_field: "item/product_id"
-        flush_timeout: -1
-        actions:
-          - type: "delete"
-            when: '/operation == "delete"'
-          - type: "index"                      
-        aws:
-          sts_role_arn: "{pipeline_role_arn}"
-          region: "{cdk.Aws.REGION}"
-          serverless: true'''
+    #Documents carry the name of their entity and are routed to the entity's index.
+    #The capacity, buffer, bulk requests and compression of the pipeline are tuned
+    #with the "pipeline" context value.
+    entities = entities_from_context(self.node)
+    pipeline_settings = pipeline_settings_from_context(self.node)
+    pipeline_configuration_body = pipeline_configuration(
+      entities, pipeline_settings, pipeline_role_arn, collection_endpoint, cdk.Aws.REGION
+    )
+
+    #Create the index template and the index of every entity before the pipeline starts,
+    #so that the indexes get explicit mappings instead of dynamic ones.
+    index_setup = self.index_setup(entities, collection_endpoint)
 
     # Create a kms key to encrypt logs with key rotation enabled.
     kms_key = aws_kms.Key(self, "OSISPipelineLogKey",
@@ -75,8 +71,8 @@ product-pipeline:
     )
 
     cfn_pipeline = aws_osis.CfnPipeline(self, "CfnOSISPipeline",
-      max_units=4,
-      min_units=1,
+      max_units=pipeline_settings["max_units"],
+      min_units=pipeline_settings["min_units"],
       pipeline_configuration_body=pipeline_configuration_body,
       pipeline_name=pipeline_name,
 
@@ -89,9 +85,114 @@ product-pipeline:
       )
     )
 
+    cfn_pipeline.node.add_dependency(index_setup)
+
     cdk.CfnOutput(self, f'{self.stack_name}PipelineName', value=cfn_pipeline.pipeline_name)
     cdk.CfnOutput(
       self, f'{self.stack_name}PipelineUrl', 
       value=cdk.Fn.select(0, cfn_pipeline.attr_ingest_endpoint_urls),
       export_name=f'{self.stack_name}PipelineUrl'
-      )
\ No newline at end of file
+      )
+
+  def index_setup(self, entities, collection_endpoint):
+    """Creates the custom resource that puts the index templates and creates the indexes."""
+    collection_name = self.node.try_get_context('collection_name') or "ingestion-collection"
+
+    #Create layers with the requests library and the SigV4 signer.
+    requests_layer = aws_lambda.LayerVersion(self, "requests-cassandra",
+      code=aws_lambda.Code.from_asset("lambda_layers/requests-cassandra.zip"),
+      compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9]
+    )
+    requests_auth_aws_sigv4_layer = aws_lambda.LayerVersion(self, "requests-auth-aws-sigv4",
+      code=aws_lambda.Code.from_asset("lambda_layers/requests-auth-aws-sigv4.zip"),
+      compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9]
+    )
+
+    index_setup_policy_doc = aws_iam.PolicyDocument()
+    index_setup_policy_doc.add_statements(aws_iam.PolicyStatement(**{
+      "effect": aws_iam.Effect.ALLOW,
+      "resources": [f"arn:aws:aoss:*:{cdk.Aws.ACCOUNT_ID}:collection/*"],
+      "actions": [
+        "aoss:APIAccessAll"
+      ]
+    }))
+
+    index_setup_role = aws_iam.Role(self, "IndexSetupRole",
+      assumed_by=aws_iam.ServicePrincipal("lambda.amazonaws.com"),
+      managed_policies=[
+        aws_iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole')
+      ],
+      inline_policies={
+        "IndexSetupPolicy": index_setup_policy_doc
+      }
+    )
+
+    #Allow the function to manage the index templates and the indexes of the collection.
+    index_access_policy = json.dumps([
+      {
+        "Rules": [
+          {
+            "Resource": [
+              f"collection/{collection_name}"
+            ],
+            "Permission": [
+              "aoss:CreateCollectionItems",
+              "aoss:DeleteCollectionItems",
+              "aoss:UpdateCollectionItems",
+              "aoss:DescribeCollectionItems"
+            ],
+            "ResourceType": "collection"
+          },
+          {
+            "Resource": [
+              f"index/{collection_name}/*"
+            ],
+            "Permission": [
+              "aoss:CreateIndex",
+              "aoss:UpdateIndex",
+              "aoss:DescribeIndex"
+            ],
+            "ResourceType": "index"
+          }
+        ],
+        "Principal": [
+          index_setup_role.role_arn
+        ],
+        "Description": "index-setup-rule"
+      }
+    ], indent=2)
+
+    #XXX: max length of policy name is 32
+    index_access_policy_name = f"{collection_name}-idx-policy"
+    assert len(index_access_policy_name) <= 32
+
+    cfn_index_access_policy = aws_opss.CfnAccessPolicy(self, "IndexSetupDataAccessPolicy",
+      name=index_access_policy_name,
+      description="Policy for managing the indexes of the collection",
+      policy=index_access_policy,
+      type="data"
+    )
+
+    index_setup_function = aws_lambda.Function(self, "IndexSetup",
+      runtime=aws_lambda.Runtime.PYTHON_3_9,
+      handler="index_setup.handler",
+      code=aws_lambda.Code.from_asset("lambda"),
+      timeout=cdk.Duration.minutes(10),
+      layers=[requests_layer, requests_auth_aws_sigv4_layer],
+      role=index_setup_role
+    )
+
+    provider = custom_resources.Provider(self, "IndexSetupProvider",
+      on_event_handler=index_setup_function
+    )
+
+    #The templates are properties of the resource, so that changing a mapping updates them.
+    index_setup = cdk.CustomResource(self, "IndexTemplates",
+      service_token=provider.service_token,
+      properties={
+        "CollectionEndpoint": collection_endpoint,
+        "Templates": json.dumps({entity["index"]: index_template(entity) for entity in entities}, sort_keys=True)
+      }
+    )
+    index_setup.node.add_dependency(cfn_index_access_policy)
+    return index_setup
@@ -0,0 +1,185 @@
+import json
+
+from .entities import key_columns
+
+#The settings of the ingestion pipeline when the cdk.json context has no "pipeline".
+#Settings that are None are left out of the pipeline configuration, so that the
+#pipeline uses its own defaults for them.
+DEFAULT_PIPELINE = {
+  #The OpenSearch Compute Units the pipeline scales between.
+  "min_units": 1,
+  "max_units": 4,
+  #The threads that run the processors and sinks, and the milliseconds they wait
+  #for a batch to fill up.
+  "workers": None,
+  "delay": None,
+  #The number of events held in the buffer, and read from it in one batch.
+  "buffer_size": None,
+  "batch_size": None,
+  #The size of the bulk requests to the collection in MiB, the number of times a
+  #failed bulk request is retried, and the milliseconds a bulk request is filled
+  #before it is sent; -1 sends it only once it is full or the batch ends.
+  "bulk_size": None,
+  "max_retries": None,
+  "flush_timeout": -1,
+  #none, or gzip for producers that compress their requests.
+  "compression": "none"
+}
+
+#The bounds of OpenSearch Ingestion and of the Data Prepper options.
+MAX_UNITS = 96
+MAX_BULK_SIZE = 100
+COMPRESSIONS = ("none", "gzip")
+
+
+def _check_integer(settings, name, minimum, maximum=None):
+  value = settings[name]
+  if value is None:
+    return
+  if not isinstance(value, int) or isinstance(value, bool) or value < minimum or (maximum is not None and value > maximum):
+    bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+    raise ValueError(f"Pipeline setting {name} must be an integer {bounds}, got {value!r}.")
+
+
+def pipeline_settings_from_context(node):
+  """
+  Reads the settings of the ingestion pipeline from the "pipeline" context value,
+  an object or a JSON string of the settings of DEFAULT_PIPELINE to change. The
+  compression can also be set with the "ingestion_compression" context value.
+
+  :raises ValueError: If a setting is unknown or out of its bounds.
+  """
+  overrides = node.try_get_context('pipeline') or {}
+  if isinstance(overrides, str):
+    overrides = json.loads(overrides)
+  unknown = sorted(set(overrides) - set(DEFAULT_PIPELINE))
+  if unknown:
+    raise ValueError(f"Unknown pipeline settings: {', '.join(unknown)}.")
+  settings = {**DEFAULT_PIPELINE, **overrides}
+  if 'compression' not in overrides and node.try_get_context('ingestion_compression'):
+    settings["compression"] = node.try_get_context('ingestion_compression')
+
+  _check_integer(settings, "min_units", 1, MAX_UNITS)
+  _check_integer(settings, "max_units", 1, MAX_UNITS)
+  if settings["min_units"] > settings["max_units"]:
+    raise ValueError(f"Pipeline setting min_units ({settings['min_units']}) is larger than max_units ({settings['max_units']}).")
+  _check_integer(settings, "workers", 1)
+  _check_integer(settings, "delay", 0)
+  _check_integer(settings, "buffer_size", 1)
+  _check_integer(settings, "batch_size", 1)
+  if (settings["buffer_size"] is None) != (settings["batch_size"] is None):
+    raise ValueError("Pipeline settings buffer_size and batch_size must be set together.")
+  if settings["buffer_size"] is not None and settings["batch_size"] > settings["buffer_size"]:
+    raise ValueError("Pipeline setting batch_size is larger than buffer_size.")
+  _check_integer(settings, "bulk_size", 1, MAX_BULK_SIZE)
+  _check_integer(settings, "max_retries", 0)
+  _check_integer(settings, "flush_timeout", -1)
+  if settings["compression"] not in COMPRESSIONS:
+    raise ValueError(f"Pipeline setting compression must be one of {', '.join(COMPRESSIONS)}, got {settings['compression']!r}.")
+  return settings
+
+
+def route_condition(entity_name):
+  """The Data Prepper condition, as a quoted YAML scalar, that matches the documents of an entity."""
+  return f"""'/entity == "{entity_name}"'"""
+
+
+def _options(settings, names, indent):
+  """The YAML lines of the settings that are set, each on a new line."""
+  return "".join(f"\n{' ' * indent}{name}: {settings[name]}" for name in names if settings[name] is not None)
+
+
+def source_config(settings):
+  """The HTTP source the producers post their documents to."""
+  compression = ''
+  if settings["compression"] != "none":
+    compression = f'''
+      compression: "{settings['compression']}"'''
+  return f'''
+  source:
+    http:
+      path: "/${{pipelineName}}/test_ingestion_path"{compression}'''
+
+
+def buffer_config(settings):
+  """The bounded blocking buffer between the source and the processors, if it is tuned."""
+  if settings["buffer_size"] is None:
+    return ''
+  return f'''
+  buffer:
+    bounded_blocking:{_options(settings, ("buffer_size", "batch_size"), 6)}'''
+
+
+def processor_config(entities):
+  """
+  The processors that tag documents without an entity, such as those of older
+  producers, with the first entity, and join compound keys into one document ID.
+  """
+  id_entries = ""
+  for entity in entities:
+    key = [column["name"] for column in key_columns(entity)]
+    if len(key) > 1:
+      id_format = "#".join(f"${{/item/{column}}}" for column in key)
+      id_entries += f'''
+          - key: "document_id"
+            format: "{id_format}"
+            add_when: {route_condition(entity["name"])}'''
+  return f'''
+  processor:
+    - date:
+        from_time_received: true
+        destination: "@timestamp"
+    - add_entries:
+        entries:
+          - key: "entity"
+            value: "{entities[0]['name']}"{id_entries}'''
+
+
+def route_config(entities):
+  """The routes that send the documents of every entity to the entity's sink."""
+  routes = "".join(f'''
+    - {entity["name"]}: {route_condition(entity["name"])}''' for entity in entities)
+  return f'''
+  route:{routes}'''
+
+
+def sink_config(entity, settings, pipeline_role_arn, collection_endpoint, region):
+  """The sink that indexes the documents of an entity into the entity's index."""
+  key = [column["name"] for column in key_columns(entity)]
+  document_id_field = f"item/{key[0]}" if len(key) == 1 else "document_id"
+  return f'''
+    - opensearch:
+        hosts: [ "{collection_endpoint}" ]
+        routes: [ "{entity['name']}" ]
+        document_root_key: "item"
+        index_type: custom
+        index: "{entity['index']}"
+        document_id_field: "{document_id_field}"
+        document_version: "${{/version}}"
+        document_version_type: "external"{_options(settings, ("bulk_size", "max_retries", "flush_timeout"), 8)}
+        actions:
+          - type: "delete"
+            when: '/operation == "delete"'
+          - type: "index"
+        aws:
+          sts_role_arn: "{pipeline_role_arn}"
+          region: "{region}"
+          serverless: true'''
+
+
+def pipeline_configuration(entities, settings, pipeline_role_arn, collection_endpoint, region):
+  """
+  Builds the pipeline configuration body: one HTTP source, the optional buffer,
+  the processors, a route and a sink per entity, and the worker options.
+  """
+  sinks = "".join(sink_config(entity, settings, pipeline_role_arn, collection_endpoint, region) for entity in entities)
+  return (
+    'version: "2"\nproduct-pipeline:'
+    + _options(settings, ("workers", "delay"), 2)
+    + source_config(settings)
+    + buffer_config(settings)
+    + processor_config(entities)
+    + route_config(entities)
+    + f'''
+  sink:{sinks}'''
+  )
@@ -0,0 +1,139 @@
+import json
+
+#The options of every table when neither the "table_options" context value nor the
+#entity sets them: on-demand capacity, no TTL and no point-in-time recovery.
+DEFAULT_TABLE_OPTIONS = {
+  #on_demand, or provisioned with the read and write capacity units below.
+  "capacity_mode": "on_demand",
+  "read_capacity_units": None,
+  "write_capacity_units": None,
+  #Target tracking auto scaling of provisioned capacity, between the minimum and
+  #maximum units, keeping the utilization at the target percentage.
+  "auto_scaling": False,
+  "min_read_capacity_units": None,
+  "max_read_capacity_units": None,
+  "min_write_capacity_units": None,
+  "max_write_capacity_units": None,
+  "target_utilization": 70,
+  "scale_in_cooldown": 60,
+  "scale_out_cooldown": 60,
+  #The throughput the table is pre-warmed for, ahead of a known bulk load.
+  "warm_read_units_per_second": None,
+  "warm_write_units_per_second": None,
+  #The seconds after which rows expire, 0 for never.
+  "default_ttl": 0,
+  "point_in_time_recovery": False
+}
+
+CAPACITY_MODES = ("on_demand", "provisioned")
+#The bounds of Amazon Keyspaces.
+MAX_TTL = 630720000
+MIN_TARGET_UTILIZATION = 20
+MAX_TARGET_UTILIZATION = 90
+
+
+def _check_integer(options, name, minimum, maximum=None):
+  value = options[name]
+  if value is None:
+    return
+  if not isinstance(value, int) or isinstance(value, bool) or value < minimum or (maximum is not None and value > maximum):
+    bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+    raise ValueError(f"Table option {name} must be an integer {bounds}, got {value!r}.")
+
+
+def table_options_from_context(node, entity):
+  """
+  Reads the options of an entity's table: the "table_options" context value, an
+  object or a JSON string of the options of DEFAULT_TABLE_OPTIONS to change, and
+  then the "table_options" of the entity itself.
+
+  :raises ValueError: If an option is unknown, out of its bounds, or does not fit the capacity mode.
+  """
+  shared = node.try_get_context('table_options') or {}
+  if isinstance(shared, str):
+    shared = json.loads(shared)
+  overrides = {**shared, **entity.get("table_options", {})}
+  unknown = sorted(set(overrides) - set(DEFAULT_TABLE_OPTIONS))
+  if unknown:
+    raise ValueError(f"Unknown table options of entity {entity['name']}: {', '.join(unknown)}.")
+  options = {**DEFAULT_TABLE_OPTIONS, **overrides}
+
+  if options["capacity_mode"] not in CAPACITY_MODES:
+    raise ValueError(f"Table option capacity_mode must be one of {', '.join(CAPACITY_MODES)}, got {options['capacity_mode']!r}.")
+  provisioned = options["capacity_mode"] == "provisioned"
+  for name in ("read_capacity_units", "write_capacity_units"):
+    _check_integer(options, name, 1)
+    if provisioned and options[name] is None:
+      raise ValueError(f"Table option {name} is required with provisioned capacity.")
+    if not provisioned and options[name] is not None:
+      raise ValueError(f"Table option {name} only applies to provisioned capacity.")
+  if not isinstance(options["auto_scaling"], bool):
+    raise ValueError("Table option auto_scaling must be true or false.")
+  if options["auto_scaling"]:
+    if not provisioned:
+      raise ValueError("Table option auto_scaling only applies to provisioned capacity.")
+    for kind in ("read", "write"):
+      minimum, maximum = f"min_{kind}_capacity_units", f"max_{kind}_capacity_units"
+      if options[minimum] is None:
+        options[minimum] = options[f"{kind}_capacity_units"]
+      _check_integer(options, minimum, 1)
+      _check_integer(options, maximum, 1)
+      if options[maximum] is None or options[maximum] < options[minimum]:
+        raise ValueError(f"Table option {maximum} is required with auto scaling, and must be at least {minimum}.")
+    _check_integer(options, "target_utilization", MIN_TARGET_UTILIZATION, MAX_TARGET_UTILIZATION)
+    _check_integer(options, "scale_in_cooldown", 0)
+    _check_integer(options, "scale_out_cooldown", 0)
+  _check_integer(options, "warm_read_units_per_second", 1)
+  _check_integer(options, "warm_write_units_per_second", 1)
+  _check_integer(options, "default_ttl", 0, MAX_TTL)
+  if not isinstance(options["point_in_time_recovery"], bool):
+    raise ValueError("Table option point_in_time_recovery must be true or false.")
+  return options
+
+
+def billing_mode(options):
+  """The BillingMode of a table, or None for the on-demand default."""
+  if options["capacity_mode"] != "provisioned":
+    return None
+  return {
+    "Mode": "PROVISIONED",
+    "ProvisionedThroughput": {
+      "ReadCapacityUnits": options["read_capacity_units"],
+      "WriteCapacityUnits": options["write_capacity_units"]
+    }
+  }
+
+
+def auto_scaling_specifications(options):
+  """The AutoScalingSpecifications of a table, or None without auto scaling."""
+  if not options["auto_scaling"]:
+    return None
+
+  def capacity_auto_scaling(kind):
+    return {
+      "AutoScalingDisabled": False,
+      "MinimumUnits": options[f"min_{kind}_capacity_units"],
+      "MaximumUnits": options[f"max_{kind}_capacity_units"],
+      "ScalingPolicy": {
+        "TargetTrackingScalingPolicyConfiguration": {
+          "TargetValue": options["target_utilization"],
+          "ScaleInCooldown": options["scale_in_cooldown"],
+          "ScaleOutCooldown": options["scale_out_cooldown"],
+          "DisableScaleIn": False
+        }
+      }
+    }
+  return {
+    "ReadCapacityAutoScaling": capacity_auto_scaling("read"),
+    "WriteCapacityAutoScaling": capacity_auto_scaling("write")
+  }
+
+
+def warm_throughput(options):
+  """The WarmThroughput of a table, or None if it is not pre-warmed."""
+  warm = {
+    "ReadUnitsPerSecond": options["warm_read_units_per_second"],
+    "WriteUnitsPerSecond": options["warm_write_units_per_second"]
+  }
+  warm = {name: value for name, value in warm.items() if value is not None}
+  return warm or None
@@ -0,0 +1,244 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Rebuilds the OpenSearch index from the Keyspaces table. The token ring is split
+into ranges that are scanned in parallel, and the rows of every range are streamed
+into bulk ingestion requests. Progress is checkpointed per range, so an interrupted
+backfill resumes where it stopped when it is run again with the same checkpoint file.
+
+    python lambda/backfill.py --ingestion-endpoint <pipeline-host> --cert-file sf-class2-root.crt \\
+        --ranges 256 --workers 16 --checkpoint-file backfill.json
+
+With --bulk-load, the refresh of the index is relaxed during the backfill and
+restored afterwards, on indexes that allow it:
+
+    python lambda/backfill.py --ingestion-endpoint <pipeline-host> --bulk-load \\
+        --collection-endpoint <domain-host> --collection-service es
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.session import Session as boto3_session
+
+from collection import CollectionClient
+from entities import get_entity
+from ingestion import IngestionClient, document_version, split_payloads
+from query import QueryManager
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """
+    Tracks the progress of every token range in a JSON file. A range is stored as
+    the last token whose rows were all ingested, and whether the range is complete.
+    """
+
+    def __init__(self, path, token_ranges):
+        """
+        :param path: The path of the checkpoint file, or None to not persist progress.
+        :param token_ranges: The (start, end) token ranges of the backfill.
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.ranges = {
+            str(index): {"start": start, "end": end, "last_token": start, "done": False, "rows": 0}
+            for index, (start, end) in enumerate(token_ranges)
+        }
+        if path and os.path.exists(path):
+            with open(path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if [(r["start"], r["end"]) for r in saved.values()] != list(token_ranges):
+                raise ValueError(f"Checkpoint {path} was written for different token ranges.")
+            self.ranges = saved
+
+    def pending(self):
+        """Returns the (index, state) of every range that is not complete yet."""
+        return [(index, state) for index, state in self.ranges.items() if not state["done"]]
+
+    def update(self, index, last_token, rows, done=False):
+        """Records the progress of a range and saves the checkpoint file."""
+        with self.lock:
+            state = self.ranges[index]
+            state["last_token"] = last_token
+            state["rows"] += rows
+            state["done"] = done
+            if self.path:
+                with open(self.path + ".tmp", "w") as checkpoint_file:
+                    json.dump(self.ranges, checkpoint_file)
+                os.replace(self.path + ".tmp", self.path)
+
+
+class Progress:
+    """Counts ingested rows across workers and reports the throughput."""
+
+    def __init__(self, report_interval=10):
+        self.rows = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.report_interval = report_interval
+        self.lock = threading.Lock()
+
+    def add(self, rows):
+        with self.lock:
+            self.rows += rows
+            now = time.monotonic()
+            if now - self.reported >= self.report_interval:
+                self.reported = now
+                logger.info("## Backfilled %d rows at %.0f rows/sec.", self.rows, self.rate())
+
+    def rate(self):
+        return self.rows / max(time.monotonic() - self.started, 1e-9)
+
+
+def batches(rows, batch_size):
+    """Groups a stream of (token, item, version) rows into lists of at most batch_size rows."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def completed_token(batch, previous):
+    """
+    Returns the last token of a batch whose partitions were ingested completely. The
+    rows of the last partition of a batch, which on tables with clustering columns
+    may be many, can continue in the next batch, so its token is only complete once
+    a later token follows. Resuming after the returned token ingests that partition
+    again from its first row, which the external versions of the documents make safe.
+
+    :param previous: The completed token before the batch.
+    """
+    last = batch[-1][0]
+    for token, _, _ in reversed(batch):
+        if token != last:
+            return token
+    return previous
+
+
+def backfill_range(qm, ingestion_client, table_name, index, state, checkpoint, progress, batch_size, fetch_size, entity=None):
+    """
+    Scans one token range, from its checkpoint on, and ingests its rows in bulk.
+    The checkpoint only moves forward after a batch was accepted by the pipeline.
+    Rows are versioned by their write timestamp, so the backfill never replaces a
+    document that was indexed from a newer write in the meantime.
+    """
+    completed = state["last_token"]
+    rows = qm.scan_token_range(table_name, completed, state["end"], fetch_size=fetch_size)
+    for batch in batches(rows, batch_size):
+        documents = [
+            {"operation": "insert", "item": item, "version": version or document_version()}
+            for _, item, version in batch
+        ]
+        if entity is not None:
+            for document in documents:
+                document["entity"] = entity
+        for payload_list in split_payloads(documents):
+            response = ingestion_client.post(payload_list)
+            if response.status_code != 200:
+                raise Exception(f"## Ingesting token range {index} failed with response: {response.text}")
+        completed = completed_token(batch, completed)
+        checkpoint.update(index, completed, len(batch))
+        progress.add(len(batch))
+    checkpoint.update(index, state["end"], 0, done=True)
+
+
+def backfill(qm, ingestion_client, table_name, ranges=64, workers=8, batch_size=500, fetch_size=1000, checkpoint_file=None, entity=None):
+    """
+    Backfills the whole table into the ingestion pipeline.
+
+    :param qm: A connected QueryManager.
+    :param ingestion_client: The IngestionClient used to ingest the rows.
+    :param table_name: The name of the table, qualified with the keyspace.
+    :param ranges: The number of token ranges the ring is split into.
+    :param workers: The number of ranges scanned in parallel.
+    :param batch_size: The number of rows per ingestion request.
+    :param fetch_size: The number of rows fetched per page.
+    :param checkpoint_file: The path of the checkpoint file used to resume.
+    :param entity: The entity the documents are routed to, by default the first one.
+    :return: The number of rows ingested and the throughput in rows/sec.
+    """
+    checkpoint = Checkpoint(checkpoint_file, qm.split_token_ring(ranges))
+    pending = checkpoint.pending()
+    logger.info("## Backfilling %d of %d token ranges with %d workers.", len(pending), ranges, workers)
+    progress = Progress()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(backfill_range, qm, ingestion_client, table_name, index, state,
+                            checkpoint, progress, batch_size, fetch_size, entity)
+            for index, state in pending
+        ]
+        failures = 0
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                logger.error("## Backfilling a token range failed: %s", e)
+    logger.info("## Backfilled %d rows at %.0f rows/sec, %d ranges failed.", progress.rows, progress.rate(), failures)
+    if failures:
+        raise Exception(f"## {failures} token ranges failed, run the backfill again with the same checkpoint file to resume.")
+    return progress.rows, progress.rate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entity", help="The entity to backfill, from the ENTITIES environment variable of the API "
+                        "function, by default the first one. It selects the keyspace, table and index.")
+    parser.add_argument("--keyspace", help="Must match the keyspace of the entity if given.")
+    parser.add_argument("--table", help="Must match the table of the entity if given.")
+    parser.add_argument("--ingestion-endpoint", required=True)
+    parser.add_argument("--cert-file", default=QueryManager.DEFAULT_CERT_FILE)
+    parser.add_argument("--ranges", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--fetch-size", type=int, default=1000)
+    parser.add_argument("--checkpoint-file")
+    parser.add_argument("--connections-per-host", type=int, default=1)
+    parser.add_argument("--max-connections-per-host", type=int, default=4)
+    parser.add_argument("--compress", action="store_true", help="Gzip the requests, for pipelines with compression: gzip.")
+    parser.add_argument("--bulk-load", action="store_true", help="Relax the refresh of the index during the backfill.")
+    parser.add_argument("--collection-endpoint", help="The collection or domain of the index, for --bulk-load.")
+    parser.add_argument("--collection-service", choices=("aoss", "es"), default="aoss")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.bulk_load and not args.collection_endpoint:
+        parser.error("--bulk-load requires --collection-endpoint")
+    try:
+        entity = get_entity(args.entity)
+    except ValueError as e:
+        parser.error(f"--entity {str(e)}")
+    for option, given, expected in (("--keyspace", args.keyspace, entity.keyspace), ("--table", args.table, entity.table)):
+        if given is not None and given != expected:
+            parser.error(f"{option} {given} does not match {expected} of entity {entity.name}")
+
+    ingestion_client = IngestionClient(args.ingestion_endpoint, pool_size=args.workers, compress=args.compress)
+    bulk_load = contextlib.nullcontext()
+    if args.bulk_load:
+        bulk_load = CollectionClient(args.collection_endpoint, service=args.collection_service).bulk_load(entity.index)
+    query_manager = QueryManager(
+        args.cert_file, boto3_session(), entity.keyspace,
+        connections_per_host=args.connections_per_host, max_connections_per_host=args.max_connections_per_host,
+    )
+    with bulk_load, query_manager as qm:
+        backfill(
+            qm, ingestion_client, entity.table_name,
+            ranges=args.ranges, workers=args.workers, batch_size=args.batch_size,
+            fetch_size=args.fetch_size, checkpoint_file=args.checkpoint_file, entity=entity.name,
+        )
+
+
+if __name__ == "__main__":
+    main()
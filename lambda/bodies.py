@@ -0,0 +1,103 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import base64
+import binascii
+import gzip
+import io
+import json
+import os
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Content types of bodies with one JSON operation per line.
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+# Upper bound on the size of a request body once it is decompressed, so that a small
+# compressed body cannot make the function run out of memory.
+MAX_DECOMPRESSED_BODY_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BODY_BYTES", str(64 * 1024 * 1024)))
+# Errors raised by a gzip stream that is corrupt or cut short.
+GZIP_ERRORS = (OSError, EOFError, zlib.error)
+
+
+def request_headers(event):
+    """Returns the headers of an API Gateway event, with lower case names."""
+    return {name.lower(): value for name, value in (event.get("headers") or {}).items()}
+
+
+def is_ndjson(headers):
+    """Whether the Content-Type header announces an NDJSON body."""
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return content_type in NDJSON_CONTENT_TYPES
+
+
+def open_body(event):
+    """
+    Returns a binary stream over the body of an API Gateway event. Binary bodies,
+    which API Gateway passes base64 encoded, are decoded, and gzip bodies are
+    decompressed as they are read. Compression is recognized by the gzip header
+    rather than by the Content-Encoding header, as API Gateway may already have
+    decompressed the body.
+
+    :raises ValueError: If a base64 encoded body is not valid base64.
+    """
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        try:
+            data = base64.b64decode(body, validate=True)
+        except binascii.Error:
+            raise ValueError("the body is not valid base64")
+    else:
+        data = body.encode("utf-8")
+    stream = io.BytesIO(data)
+    if data[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    return stream
+
+
+def read_json(stream, max_bytes=MAX_DECOMPRESSED_BODY_BYTES):
+    """
+    Reads a JSON document from a body stream.
+
+    :raises ValueError: If the body is not valid JSON, is corrupt, or is larger than max_bytes.
+    """
+    try:
+        data = stream.read(max_bytes + 1)
+    except GZIP_ERRORS as e:
+        raise ValueError(f"the gzip body is corrupt: {e}")
+    if len(data) > max_bytes:
+        raise ValueError(f"the decompressed body is larger than {max_bytes} bytes")
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        raise ValueError(f"the body is not valid JSON: {e}")
+
+
+def iter_ndjson(stream, max_bytes=MAX_DECOMPRESSED_BODY_BYTES):
+    """
+    Parses an NDJSON body one line at a time, so that only the current line of the
+    body is held decompressed in memory. Blank lines are skipped.
+
+    :return: A generator of (index, record, error) tuples, where index counts the
+        records of the body and error is a message for lines that are not valid JSON.
+    :raises ValueError: While iterating, if the body is corrupt or larger than max_bytes.
+        The records yielded before are unaffected.
+    """
+    size, index = 0, 0
+    while True:
+        try:
+            line = stream.readline(max_bytes - size + 1)
+        except GZIP_ERRORS as e:
+            raise ValueError(f"the gzip body is corrupt after {index} records: {e}")
+        if not line:
+            return
+        size += len(line)
+        if size > max_bytes:
+            raise ValueError(f"the decompressed body is larger than {max_bytes} bytes")
+        if not line.strip():
+            continue
+        try:
+            record, error = json.loads(line), None
+        except ValueError as e:
+            record, error = None, f"line is not valid JSON: {e}"
+        yield index, record, error
+        index += 1
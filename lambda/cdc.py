@@ -0,0 +1,229 @@
+import logging
+import os
+
+import boto3
+
+from entities import ENTITIES
+from ingestion import IngestionClient, document_version, split_payloads
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Stop polling new records once less than this much of the invocation is left,
+# so the last batch can still be ingested and checkpointed.
+MIN_REMAINING_MILLIS = 30000
+MAX_RECORDS_PER_CALL = 1000
+
+INTEGER_TYPES = {"intT", "bigintT", "smallintT", "tinyintT", "varintT", "counterT"}
+FLOAT_TYPES = {"floatT", "doubleT"}
+
+# Shared across warm invocations so that connections stay open.
+_clients = {}
+
+def get_client(name):
+    """Returns a client cached on this execution environment."""
+    if name not in _clients:
+        if name == "ingestion":
+            _clients[name] = IngestionClient(
+                os.environ.get("INGESTION_ENDPOINT"),
+                compress=os.environ.get("INGESTION_COMPRESSION") == "gzip",
+            )
+        else:
+            _clients[name] = boto3.client(name)
+    return _clients[name]
+
+class StreamNotFoundError(LookupError):
+    """Raised when a table has no change stream."""
+
+class IngestionError(Exception):
+    """Raised when the pipeline rejects a bulk request of change documents."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+def cell_value(value):
+    """
+    Converts a typed Keyspaces change record value, such as {"intT": "100"}, into
+    the JSON value the ingestion pipeline expects. The elements of lists, sets,
+    tuples and user-defined types are cells of their own, {"value": ..., "metadata": ...},
+    while the keys and values of maps are typed values. Null elements have no value.
+    """
+    if value is None:
+        return None
+    (type_name, raw), = value.items()
+    if type_name in INTEGER_TYPES:
+        return int(raw)
+    if type_name in FLOAT_TYPES:
+        return float(raw)
+    if type_name == "boolT":
+        return raw if isinstance(raw, bool) else str(raw).lower() == "true"
+    if type_name in ("listT", "setT", "tupleT"):
+        return [cell_value(element.get("value")) for element in raw]
+    if type_name == "udtT":
+        return {field: cell_value(element.get("value")) for field, element in raw.items()}
+    if type_name == "mapT":
+        return {str(cell_value(entry["key"])): cell_value(entry["value"]) for entry in raw}
+    return raw
+
+def change_to_document(record):
+    """
+    Converts a Keyspaces change record into the {"operation", "item", "version"}
+    document the ingestion pipeline expects. A change without a new image is a delete.
+    """
+    item = {column: cell_value(value) for column, value in record.get("partitionKeys", {}).items()}
+    item.update({column: cell_value(value) for column, value in record.get("clusteringKeys", {}).items()})
+    new_image = record.get("newImage")
+    if not new_image:
+        return {"operation": "delete", "item": item, "version": change_version(record)}
+    for cells in (new_image.get("staticCells", {}), new_image.get("valueCells", {})):
+        for column, cell in cells.items():
+            if cell.get("value") is not None:
+                item[column] = cell_value(cell["value"])
+    return {"operation": "insert", "item": item, "version": change_version(record)}
+
+def change_version(record):
+    """
+    Returns the version of a change: the newest write timestamp of its cells, in
+    microseconds like the versions of API writes, or the time the change was
+    recorded for changes without cell timestamps, such as deletes.
+    """
+    write_times = [
+        int(cell["metadata"]["writeTime"])
+        for cells in ((record.get("newImage") or {}).get("staticCells", {}), (record.get("newImage") or {}).get("valueCells", {}))
+        for cell in cells.values()
+        if (cell.get("metadata") or {}).get("writeTime") is not None
+    ]
+    if write_times:
+        return max(write_times)
+    created_at = record.get("createdAt")
+    if created_at is not None:
+        return int(created_at.timestamp() * 1000000)
+    return document_version()
+
+def coalesce_changes(records, entity=None):
+    """
+    Converts change records into documents, keeping only the last change of every
+    row. Records of one partition are ordered within a shard, so the last one
+    describes the current state of the row.
+
+    :param entity: The entity the documents are tagged with, which the pipeline
+        routes them by. Untagged documents go to the index of the default entity.
+    """
+    documents = {}
+    for record in records:
+        document = change_to_document(record)
+        if entity is not None:
+            document["entity"] = entity
+        key_columns = list(record.get("partitionKeys", {})) + list(record.get("clusteringKeys", {}))
+        key = tuple(document["item"].get(column) for column in key_columns)
+        documents.pop(key, None)
+        documents[key] = document
+    return list(documents.values())
+
+def checkpoint_key(stream_arn, shard_id):
+    """
+    Returns the key of the checkpoint of a shard. The streams of several tables are
+    read by one consumer and their shard IDs can repeat, so shards are keyed by
+    their stream as well.
+    """
+    return {"shard_id": {"S": f"{stream_arn}/{shard_id}"}}
+
+def get_checkpoint(table_name, stream_arn, shard_id):
+    """Returns the last ingested sequence number of a shard, if any."""
+    response = get_client("dynamodb").get_item(
+        TableName=table_name, Key=checkpoint_key(stream_arn, shard_id), ConsistentRead=True
+    )
+    return response.get("Item", {}).get("sequence_number", {}).get("S")
+
+def put_checkpoint(table_name, stream_arn, shard_id, sequence_number):
+    """Stores the last ingested sequence number of a shard."""
+    get_client("dynamodb").put_item(
+        TableName=table_name,
+        Item={**checkpoint_key(stream_arn, shard_id), "sequence_number": {"S": sequence_number}},
+    )
+
+def list_shards(stream_arn):
+    """Lists all shards of a Keyspaces change stream."""
+    streams = get_client("keyspacesstreams")
+    kwargs = {"streamArn": stream_arn}
+    while True:
+        response = streams.get_stream(**kwargs)
+        yield from response.get("shards", [])
+        if not response.get("nextToken"):
+            return
+        kwargs["nextToken"] = response["nextToken"]
+
+def get_stream_arn(keyspace_name, table_name):
+    """Finds the change stream of a table."""
+    response = get_client("keyspacesstreams").list_streams(keyspaceName=keyspace_name, tableName=table_name)
+    streams = response.get("streams", [])
+    if not streams:
+        raise StreamNotFoundError(f"## No change stream found for table {keyspace_name}.{table_name}.")
+    return streams[0]["streamArn"]
+
+def ingest(documents):
+    """Ingests documents into the pipeline in bulk requests."""
+    client = get_client("ingestion")
+    for payload_list in split_payloads(documents):
+        response = client.post(payload_list)
+        if response.status_code != 200:
+            raise IngestionError(
+                f"## Ingesting {len(payload_list)} change documents failed with response: {response.text}",
+                status_code=response.status_code,
+            )
+
+def process_shard(stream_arn, shard_id, checkpoint_table, context, entity=None):
+    """
+    Reads the new records of one shard in batches, coalesces them per product,
+    ingests them in bulk and checkpoints after every batch.
+
+    :return: The number of change records processed.
+    """
+    streams = get_client("keyspacesstreams")
+    sequence_number = get_checkpoint(checkpoint_table, stream_arn, shard_id)
+    if sequence_number:
+        iterator = streams.get_shard_iterator(
+            streamArn=stream_arn, shardId=shard_id,
+            shardIteratorType="AFTER_SEQUENCE_NUMBER", sequenceNumber=sequence_number
+        )["shardIterator"]
+    else:
+        iterator = streams.get_shard_iterator(
+            streamArn=stream_arn, shardId=shard_id, shardIteratorType="TRIM_HORIZON"
+        )["shardIterator"]
+
+    processed = 0
+    while iterator and context.get_remaining_time_in_millis() > MIN_REMAINING_MILLIS:
+        response = streams.get_records(shardIterator=iterator, maxResults=MAX_RECORDS_PER_CALL)
+        records = response.get("changeRecords", [])
+        if not records:
+            break
+        documents = coalesce_changes(records, entity)
+        ingest(documents)
+        put_checkpoint(checkpoint_table, stream_arn, shard_id, records[-1]["sequenceNumber"])
+        logger.info("## Shard %s: ingested %d documents from %d change records.", shard_id, len(documents), len(records))
+        processed += len(records)
+        iterator = response.get("nextShardIterator")
+    return processed
+
+def handler(event, context):
+    """
+    Polls the change streams of the tables of all entities and syncs every change
+    into the ingestion pipeline, so that writes reach OpenSearch without the API
+    dual-writing them.
+    """
+    checkpoint_table = os.environ.get("CHECKPOINT_TABLE_NAME")
+
+    processed = 0
+    for entity in ENTITIES.values():
+        if len(ENTITIES) == 1 and os.environ.get("STREAM_ARN"):
+            stream_arn = os.environ.get("STREAM_ARN")
+        else:
+            stream_arn = get_stream_arn(entity.keyspace, entity.table)
+        for shard in list_shards(stream_arn):
+            if context.get_remaining_time_in_millis() <= MIN_REMAINING_MILLIS:
+                break
+            processed += process_shard(stream_arn, shard["shardId"], checkpoint_table, context, entity.name)
+        logger.info("## Processed change records of %s from stream %s.", entity.name, stream_arn)
+    logger.info("## Processed %d change records.", processed)
+    return {"processed": processed}
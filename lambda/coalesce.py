@@ -0,0 +1,90 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+KEY_FIELD = "product_id"
+
+
+def merge_operations(first, second):
+    """
+    Collapses two operations on the same product into the one that leaves the same
+    final state. Keyspaces inserts and updates are both upserts, so:
+
+    - anything followed by a delete is a delete,
+    - an insert followed by an update is an insert of the merged item,
+    - an update followed by an update is an update of the merged item,
+    - anything followed by an insert is that insert.
+
+    The merged operation keeps the version of the later one.
+
+    :param first: The earlier operation.
+    :param second: The later operation.
+    :return: The merged operation.
+    """
+    if second["operation"] in ("delete", "insert") or first["operation"] == "delete":
+        return _copy(second["operation"], second["item"], second)
+    return _copy(first["operation"], {**first["item"], **second["item"]}, second)
+
+
+def _copy(operation, item, source):
+    """Builds an operation, carrying over the version of source if it has one."""
+    copy = {"operation": operation, "item": dict(item)}
+    if source.get("version") is not None:
+        copy["version"] = source["version"]
+    return copy
+
+
+def coalesce_operations(operations, key_field=KEY_FIELD):
+    """
+    Collapses the operations of a batch to one operation per product. Operations
+    without a key are kept as they are. Operations are applied in batch order,
+    unless both carry a version, in which case the higher version is the later one,
+    just as Keyspaces orders writes by their timestamp.
+
+    :param operations: A list of operations, each with an operation and an item.
+    :param key_field: The item field that identifies a product, or a function that
+        returns the key of an operation.
+    :return: A (coalesced, positions) tuple. positions[i] is the index of the
+        coalesced operation that carries operations[i].
+    """
+    coalesced = []
+    positions = []
+    by_key = {}
+    key_of = key_field if callable(key_field) else (lambda operation: operation["item"].get(key_field))
+    for operation in operations:
+        key = key_of(operation)
+        position = by_key.get(key) if key is not None else None
+        if position is None:
+            position = len(coalesced)
+            coalesced.append(_copy(operation["operation"], operation["item"], operation))
+            if key is not None:
+                by_key[key] = position
+        elif operation.get("version") is not None and operation["version"] < coalesced[position].get("version", operation["version"]):
+            coalesced[position] = merge_operations(operation, coalesced[position])
+        else:
+            coalesced[position] = merge_operations(coalesced[position], operation)
+        positions.append(position)
+    return coalesced, positions
+
+
+def split_duplicates(operations, seen, field="idempotency_key"):
+    """
+    Separates retried operations from fresh ones by their client-supplied
+    idempotency key. A key repeats either within the batch or because an earlier
+    request with it succeeded and was recorded in seen.
+
+    :param operations: A list of operations, optionally carrying an idempotency key.
+    :param seen: A cache of the idempotency keys of operations that succeeded.
+    :param field: The operation field holding the idempotency key.
+    :return: A (fresh, duplicates) tuple of lists of operation indexes.
+    """
+    fresh, duplicates = [], []
+    keys = set()
+    for index, operation in enumerate(operations):
+        key = operation.get(field)
+        if key is not None and (key in keys or seen.get(key) is not None):
+            duplicates.append(index)
+            continue
+        if key is not None:
+            keys.add(key)
+        fresh.append(index)
+    return fresh, duplicates
@@ -0,0 +1,115 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import logging
+from contextlib import contextmanager
+
+from ingestion import CachedSigV4, pooled_http_session
+
+logger = logging.getLogger(__name__)
+
+
+class CollectionClient:
+    """
+    Sends requests to an Amazon OpenSearch Serverless collection over a pooled
+    keep-alive HTTP session, signed with SigV4 for the aoss service.
+    """
+
+    def __init__(self, collection_endpoint, pool_size=10, service="aoss", boto_session=None):
+        """
+        :param collection_endpoint: The host name or URL of the collection.
+        :param pool_size: The number of keep-alive connections kept to the collection.
+        :param service: The service requests are signed for, es for managed domains.
+        :param boto_session: A Boto3 session. This is used to acquire your AWS credentials.
+        """
+        self.endpoint = collection_endpoint
+        if not collection_endpoint.startswith(("http://", "https://")):
+            collection_endpoint = 'https://' + collection_endpoint
+        self.url = collection_endpoint.rstrip("/")
+        self.http = pooled_http_session(pool_size)
+        self.signer = CachedSigV4(service, boto_session)
+
+    def request(self, method, path, body=None):
+        """
+        Sends a JSON request to the collection.
+
+        :param method: The HTTP method.
+        :param path: The path of the API, such as /products/_search.
+        :param body: The JSON body of the request.
+        :return: The HTTP response.
+        """
+        return self.http.request(
+            method, self.url + path,
+            headers={"Content-Type": "application/json"},
+            json=body,
+            auth=self.signer.get(),
+        )
+
+    def search(self, index, body):
+        """
+        Runs a search against an index.
+
+        :param index: The name of the index.
+        :param body: The query DSL of the search.
+        :return: The decoded search response.
+        """
+        response = self.request("POST", f"/{index}/_search", body)
+        response.raise_for_status()
+        return response.json()
+
+    def scan(self, index, sort_fields, fields=None, page_size=1000):
+        """
+        Reads all documents of an index in sort_fields order, one page at a time,
+        using search_after so that only one page is held in memory.
+
+        :param index: The name of the index.
+        :param sort_fields: The fields the documents are sorted and paged by, which
+            together must be unique, such as the primary key columns.
+        :param fields: The source fields to return, or None for all of them.
+        :param page_size: The number of documents fetched per page.
+        :return: A generator of document sources.
+        """
+        body = {"size": page_size, "sort": [{field: "asc"} for field in sort_fields], "query": {"match_all": {}}}
+        if fields is not None:
+            body["_source"] = fields
+        while True:
+            hits = self.search(index, body)["hits"]["hits"]
+            for hit in hits:
+                yield hit["_source"]
+            if len(hits) < page_size:
+                return
+            body["search_after"] = hits[-1]["sort"]
+
+    @contextmanager
+    def bulk_load(self, index, refresh_interval="-1"):
+        """
+        Relaxes the refresh of an index while documents are loaded into it in bulk,
+        and restores its refresh interval and refreshes it afterwards. OpenSearch
+        Serverless refreshes indexes on its own schedule and rejects the setting, in
+        which case the load runs with the usual refresh.
+
+        :param index: The name of the index.
+        :param refresh_interval: The refresh interval during the load, -1 to not refresh.
+        :return: A context manager that yields whether the refresh was relaxed.
+        """
+        response = self.request("GET", f"/{index}/_settings/index.refresh_interval")
+        previous = None
+        if response.ok:
+            previous = response.json().get(index, {}).get("settings", {}).get("index", {}).get("refresh_interval")
+        response = self.request("PUT", f"/{index}/_settings", {"index": {"refresh_interval": refresh_interval}})
+        if not response.ok:
+            logger.warning("## The refresh interval of index %s cannot be changed, loading with the usual refresh: %s", index, response.text)
+            yield False
+            return
+        logger.info("## Relaxed the refresh interval of index %s to %s for the bulk load.", index, refresh_interval)
+        try:
+            yield True
+        finally:
+            # An interval the index did not set is reset to the default.
+            self.request("PUT", f"/{index}/_settings", {"index": {"refresh_interval": previous}}).raise_for_status()
+            self.request("POST", f"/{index}/_refresh")
+            logger.info("## Restored the refresh interval of index %s to %s.", index, previous or "the default")
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.http.close()
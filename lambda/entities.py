@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+from collections import namedtuple
+
+from schema import FLOAT_TYPES, INTEGER_TYPES
+
+# Compound keys are written as their values joined by this separator in read URLs.
+KEY_SEPARATOR = ":"
+
+
+class Entity(namedtuple("Entity", ["name", "keyspace", "table", "index", "key", "search_fields"])):
+    """
+    A type of item the API serves: the Keyspaces table it is stored in and the
+    index it is searched in. key is a dict of the CQL type of every primary key
+    column, in key order.
+    """
+
+    @property
+    def table_name(self):
+        """The name of the table, qualified with the keyspace."""
+        return f"{self.keyspace}.{self.table}"
+
+    def key_of(self, item):
+        """Returns the primary key of an item, or None if a key column is missing."""
+        values = tuple(item.get(column) for column in self.key)
+        if None in values:
+            return None
+        return values[0] if len(values) == 1 else values
+
+    def parse_key(self, text):
+        """
+        Parses a primary key from a URL, converting its values to the key column types.
+
+        :raises ValueError: If the key does not fit the key columns.
+        """
+        values = text.split(KEY_SEPARATOR) if len(self.key) > 1 else [text]
+        if len(values) != len(self.key):
+            raise ValueError(f"keys of {self.name} have the columns {KEY_SEPARATOR.join(self.key)}")
+        parsed = [self.parse_column(column, value) for column, value in zip(self.key, values)]
+        return parsed[0] if len(parsed) == 1 else tuple(parsed)
+
+    def parse_column(self, column, text):
+        """
+        Parses the value of a primary key column from a URL.
+
+        :raises ValueError: If the value does not fit the column type.
+        """
+        cql_type = self.key[column]
+        try:
+            if cql_type in INTEGER_TYPES:
+                return int(text)
+            if cql_type in FLOAT_TYPES:
+                return float(text)
+        except ValueError:
+            raise ValueError(f"{column} must be {'an integer' if cql_type in INTEGER_TYPES else 'a number'}")
+        return text
+
+
+def default_entity():
+    """The product entity, configured by the KEYSPACE_NAME, TABLE_NAME and INDEX_NAME variables."""
+    return Entity(
+        name="product",
+        keyspace=os.environ.get("KEYSPACE_NAME", "productsearch"),
+        table=os.environ.get("TABLE_NAME", "product_by_item"),
+        index=os.environ.get("INDEX_NAME", "products"),
+        key={"product_id": "int"},
+        search_fields=["product_name^2", "product_description"],
+    )
+
+
+def load_entities(config=None):
+    """
+    Loads the entities served by this deployment.
+
+    :param config: The ENTITIES JSON, a list of objects with a name, keyspace, table,
+        index, key and search_fields. Without it, only the product entity is served.
+    :return: A dict of the entities by name. The first one is the default entity.
+    """
+    if not config:
+        entity = default_entity()
+        return {entity.name: entity}
+    entities = {}
+    for definition in json.loads(config):
+        entity = Entity(
+            name=definition["name"],
+            keyspace=definition["keyspace"],
+            table=definition["table"],
+            index=definition["index"],
+            key=dict(definition["key"]),
+            search_fields=list(definition.get("search_fields") or []),
+        )
+        entities[entity.name] = entity
+    return entities
+
+
+ENTITIES = load_entities(os.environ.get("ENTITIES"))
+DEFAULT_ENTITY = next(iter(ENTITIES.values()))
+
+
+def get_entity(name=None):
+    """
+    Returns an entity by name, or the default entity.
+
+    :raises ValueError: If the entity is not served by this deployment.
+    """
+    if name is None or name == "":
+        return DEFAULT_ENTITY
+    entity = ENTITIES.get(name)
+    if entity is None:
+        raise ValueError(f"entity must be one of the following: {', '.join(ENTITIES)}")
+    return entity
+
+
+def document_key(payload):
+    """
+    Returns the key that identifies the document of an ingestion payload across
+    entities, so that payloads of several entities can be coalesced together.
+    Payloads without an entity belong to the default one.
+    """
+    entity = ENTITIES.get(payload.get("entity") or DEFAULT_ENTITY.name)
+    if entity is None:
+        return None
+    key = entity.key_of(payload.get("item") or {})
+    return None if key is None else (entity.name, key)
@@ -1,15 +1,29 @@
 import asyncio
-import boto3
+import atexit
+import functools
+import hashlib
 import os
+import signal
+import sys
 import json
 import logging
-import requests
-from requests_auth_aws_sigv4 import AWSSigV4
-from query import QueryManager
-from boto3.session import Session as boto3_session
+import bodies
+import metrics
+import search
+import validation
+from cache import TTLCache
+from coalesce import coalesce_operations, split_duplicates
+from entities import DEFAULT_ENTITY, ENTITIES, document_key, get_entity
+from ingestion import DeadLetterSink, IngestionBuffer, IngestionClient, QueueIngestionSink, document_version, split_payloads
+from resilience import status_code_for
+
+# boto3, requests and the Cassandra driver are imported when they are first used,
+# so that they do not slow down the import of this module on a cold start.
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# Payload dumps are logged at DEBUG with lazy formatting, so they cost nothing unless
+# LOG_LEVEL=DEBUG is set on the function.
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
 example_json_input = {
     "operation": "insert",
@@ -20,11 +34,66 @@ example_json_input = {
     }
 }
 
+example_batch_json_input = {
+    "operations": [
+        example_json_input,
+        {"operation": "delete", "item": {"product_id": 101}}
+    ]
+}
+
+# Upper bound on the number of operations accepted in one batch request.
+MAX_BATCH_OPERATIONS = int(os.environ.get("MAX_BATCH_OPERATIONS", "1000"))
+# Number of operations of an NDJSON body that are parsed and run together.
+STREAM_BATCH_OPERATIONS = int(os.environ.get("STREAM_BATCH_OPERATIONS", "500"))
+# Number of keep-alive connections kept open to the ingestion pipeline.
+INGESTION_POOL_SIZE = int(os.environ.get("INGESTION_POOL_SIZE", "10"))
+# Set to gzip to compress the requests to the ingestion pipeline.
+INGESTION_COMPRESSION = os.environ.get("INGESTION_COMPRESSION", "none")
+# How documents reach the ingestion pipeline after the Keyspaces write:
+#   sync   - the request waits for the pipeline to accept the documents.
+#   queue  - documents are sent to INGESTION_QUEUE_URL and the ingestion worker
+#            delivers them to the pipeline in bulk, at least once.
+#   buffer - documents are buffered in memory across invocations and flushed in
+#            bulk on size or age. Best effort: a recycled container loses them.
+#   cdc    - the API only writes to Keyspaces and the change stream consumer of
+#            OpsKeyspacesCdcStack indexes the changes.
+INGESTION_MODE = os.environ.get("INGESTION_MODE", "sync")
+INGESTION_QUEUE_URL = os.environ.get("INGESTION_QUEUE_URL")
+# Documents whose ingestion failed permanently, after retries, are stored in this queue.
+INGESTION_DLQ_URL = os.environ.get("INGESTION_DLQ_URL")
+INGESTION_BUFFER_MAX_DOCUMENTS = int(os.environ.get("INGESTION_BUFFER_MAX_DOCUMENTS", "1000"))
+INGESTION_BUFFER_MAX_AGE = float(os.environ.get("INGESTION_BUFFER_MAX_AGE", "5"))
+# Whether the operations of a batch, and the documents of the ingestion buffer, are
+# collapsed to one write per product_id before they are sent.
+COALESCE_WRITES = os.environ.get("COALESCE_WRITES", "true").lower() == "true"
+# How long a client-supplied idempotency key is remembered after its request succeeded.
+IDEMPOTENCY_KEY_TTL = float(os.environ.get("IDEMPOTENCY_KEY_TTL", "300"))
+# Connections opened to every Keyspaces host, the number the pool may grow to under
+# load, and the requests in flight allowed per connection.
+KEYSPACES_CONNECTIONS_PER_HOST = int(os.environ.get("KEYSPACES_CONNECTIONS_PER_HOST", "1"))
+KEYSPACES_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("KEYSPACES_MAX_CONNECTIONS_PER_HOST", "4"))
+KEYSPACES_MAX_REQUESTS_PER_CONNECTION = int(os.environ.get("KEYSPACES_MAX_REQUESTS_PER_CONNECTION", "1024"))
+# Whether requests are sent to a host that owns the partition they address.
+KEYSPACES_TOKEN_AWARE = os.environ.get("KEYSPACES_TOKEN_AWARE", "true").lower() == "true"
+# Upper bound on the number of product ids read in one GET /items request.
+MAX_ITEMS_PER_READ = 100
+# Open the Keyspaces session and prepare the statements while the function initializes.
+PRIME_ON_INIT = os.environ.get("PRIME_ON_INIT", "false").lower() == "true"
+# The certificates Amazon Keyspaces TLS connections chain up to (Amazon Root CA 1-4
+# and Starfield Class 2), shipped with the function code.
+BUNDLED_CERT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyspaces-bundle.pem")
+
+@functools.lru_cache(maxsize=None)
 def get_tls_cert():
     """
-    This function downloads a TLS certificate to use to secure the connection
-    to the keyspace.
+    This function returns the TLS certificate bundle used to secure the connection
+    to the keyspace. The bundle ships with the function code; without it, the
+    certificate is downloaded once per execution environment.
     """
+    if os.path.exists(BUNDLED_CERT_FILE):
+        return BUNDLED_CERT_FILE
+    import requests
+    from query import QueryManager
     cert_path = os.path.join(
         "/tmp", QueryManager.DEFAULT_CERT_FILE
     )
@@ -34,91 +103,765 @@ def get_tls_cert():
             cert_file.write(cert)
     return cert_path
 
+# The Keyspaces session is cached at module level so that it survives across warm
+# invocations of the handler. It is created lazily on the first request and shut
+# down only when the execution environment is recycled.
+_query_manager = None
+# The ingestion client is cached the same way, keeping its connections to the
+# pipeline alive between invocations.
+_ingestion_client = None
+_ingestion_buffer = None
+_dead_letter_sink = None
+# Items read through GET /items are cached across invocations and dropped when the
+# cached QueryManager writes them. It outlives reconnects of the Keyspaces session.
+_item_cache = TTLCache(
+    max_entries=int(os.environ.get("ITEM_CACHE_MAX_ENTRIES", "4096")),
+    ttl=float(os.environ.get("ITEM_CACHE_TTL", "30")),
+)
+
+# Idempotency keys of requests and batch operations that succeeded, with the response
+# of the request when the key was sent in the Idempotency-Key header. Like the other
+# caches they are kept per execution environment, so a retry that lands on another
+# environment is applied again; the writes are upserts, so this is still safe.
+_idempotency_cache = TTLCache(max_entries=10000, ttl=IDEMPOTENCY_KEY_TTL)
+
+@functools.lru_cache(maxsize=None)
+def function_settings():
+    """Returns the keyspace name and the ingestion endpoint, read from the environment once."""
+    keyspace_name = os.environ.get("KEYSPACE_NAME")
+    logger.debug("## Loaded Keyspace name from environment variable KEYSPACE_NAME: %s", keyspace_name)
+    ingestion_endpoint = os.environ.get("INGESTION_ENDPOINT")
+    logger.debug("## Loaded ingestion endpoint from environment variable INGESTION_ENDPOINT: %s", ingestion_endpoint)
+    return keyspace_name, ingestion_endpoint
+
+def get_query_manager(cert_file_path, keyspace_name):
+    """
+    Returns a connected QueryManager, reusing the one cached on this execution
+    environment when it is still healthy and reconnecting otherwise.
+
+    :raises Exception: The driver's error if the keyspace cannot be connected to. No
+        QueryManager is cached then, so the next request connects again.
+    """
+    global _query_manager
+    if _query_manager is not None and not _query_manager.is_healthy():
+        logger.warning("## Cached Keyspaces session is unhealthy, reconnecting.")
+        close_query_manager()
+    if _query_manager is None:
+        from boto3.session import Session as boto3_session
+        from query import QueryManager
+        with metrics.timer("ConnectLatency"):
+            _query_manager = QueryManager(
+                cert_file_path, boto3_session(), keyspace_name, item_cache=_item_cache,
+                connections_per_host=KEYSPACES_CONNECTIONS_PER_HOST,
+                max_connections_per_host=KEYSPACES_MAX_CONNECTIONS_PER_HOST,
+                max_requests_per_connection=KEYSPACES_MAX_REQUESTS_PER_CONNECTION,
+                token_aware=KEYSPACES_TOKEN_AWARE,
+            ).connect()
+        logger.info("## Opened a new Keyspaces session to keyspace: %s", keyspace_name)
+    return _query_manager
+
+def close_query_manager():
+    """Shuts down the cached Keyspaces session, if any."""
+    global _query_manager
+    if _query_manager is not None:
+        try:
+            _query_manager.close()
+        except Exception as e:
+            logger.warning("## Failed to close Keyspaces session: %s", e)
+        _query_manager = None
+
+def get_ingestion_client(ingestion_endpoint):
+    """
+    Returns the IngestionClient cached on this execution environment, creating it
+    on first use.
+    """
+    global _ingestion_client
+    if _ingestion_client is None or _ingestion_client.endpoint != ingestion_endpoint:
+        _ingestion_client = IngestionClient(ingestion_endpoint, pool_size=INGESTION_POOL_SIZE, compress=INGESTION_COMPRESSION == "gzip")
+    return _ingestion_client
+
+def get_ingestion_buffer(ingestion_endpoint):
+    """
+    Returns the IngestionBuffer cached on this execution environment. In queue mode
+    it flushes to the ingestion queue, otherwise straight to the pipeline.
+    """
+    global _ingestion_buffer
+    if _ingestion_buffer is None:
+        if INGESTION_MODE == "queue":
+            _ingestion_buffer = IngestionBuffer(
+                QueueIngestionSink(INGESTION_QUEUE_URL),
+                max_documents=INGESTION_BUFFER_MAX_DOCUMENTS,
+                max_bytes=QueueIngestionSink.MAX_MESSAGE_BYTES,
+                coalesce=COALESCE_WRITES,
+                coalesce_key=document_key,
+            )
+        else:
+            _ingestion_buffer = IngestionBuffer(
+                functools.partial(_flush_to_pipeline, get_ingestion_client(ingestion_endpoint)),
+                max_documents=INGESTION_BUFFER_MAX_DOCUMENTS,
+                max_age=INGESTION_BUFFER_MAX_AGE,
+                coalesce=COALESCE_WRITES,
+                coalesce_key=document_key,
+            )
+    return _ingestion_buffer
+
+def dead_letter(payload_list, reason):
+    """
+    Stores payloads that could not be ingested in the ingestion dead-letter queue,
+    from where they can be redriven once the pipeline recovers.
+
+    :return: True if the payloads were stored.
+    """
+    global _dead_letter_sink
+    if not INGESTION_DLQ_URL:
+        logger.error("## No dead-letter queue configured, dropping %d payloads: %s", len(payload_list), reason)
+        return False
+    if _dead_letter_sink is None:
+        _dead_letter_sink = DeadLetterSink(INGESTION_DLQ_URL)
+    try:
+        _dead_letter_sink(payload_list, reason)
+    except Exception as e:
+        logger.error("## Dead-lettering %d payloads failed: %s", len(payload_list), e)
+        return False
+    logger.warning("## Dead-lettered %d payloads: %s", len(payload_list), reason)
+    return True
+
+def _flush_to_pipeline(client, payload_list):
+    """Posts buffered payloads to the ingestion pipeline."""
+    try:
+        response = client.post(payload_list)
+    except Exception as e:
+        dead_letter(payload_list, f"{type(e).__name__}: {str(e)}")
+        return None
+    if response.status_code == 200:
+        logger.info("## Flushed %d buffered payloads into the ingestion pipeline.", len(payload_list))
+    else:
+        logger.error("## Flushing %d buffered payloads failed with response: %s", len(payload_list), response.text)
+        dead_letter(payload_list, f"HTTP {response.status_code}: {response.text}")
+    return response
+
+async def buffer_ingestion_async(ingestion_endpoint, payload_list):
+    """
+    Hands payloads to the ingestion buffer instead of waiting for the pipeline. In
+    queue mode the buffer is flushed before returning, so the payloads are stored
+    durably in the queue by the time the request is acknowledged.
+    """
+    buffer = get_ingestion_buffer(ingestion_endpoint)
+
+    def add_all():
+        for payload in payload_list:
+            buffer.add(payload)
+        if INGESTION_MODE == "queue":
+            buffer.flush()
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, add_all)
+
+def close_clients():
+    """Flushes buffered payloads and shuts down the cached clients."""
+    global _ingestion_client, _ingestion_buffer
+    if _ingestion_buffer is not None:
+        try:
+            _ingestion_buffer.flush()
+        except Exception as e:
+            logger.error("## Failed to flush buffered payloads on shutdown: %s", e)
+        _ingestion_buffer = None
+    close_query_manager()
+    if _ingestion_client is not None:
+        _ingestion_client.close()
+        _ingestion_client = None
+
+def _on_sigterm(signum, frame):
+    """Lambda sends SIGTERM before the execution environment is shut down."""
+    close_clients()
+    sys.exit(0)
+
+atexit.register(close_clients)
+signal.signal(signal.SIGTERM, _on_sigterm)
+
 async def ingest_data_async(ingestion_endpoint, payload):
-    """Ingests data into the Opensearch ingestion pipeline"""
-    endpoint = 'https://' + ingestion_endpoint
+    """
+    Ingests data into the Opensearch ingestion pipeline. Throttled and transient
+    failures are retried by the client; payloads that still fail are dead-lettered.
+
+    :return: The status code of the ingestion.
+    """
+    client = get_ingestion_client(ingestion_endpoint)
     payload_list = [payload]
     operation = payload['operation']
-    item = payload['item']
-    product_id = item['product_id']
-    print(f'## product_id is: {product_id}')
-    logging.info(f"## Ingesting payload: {payload} into the ingestion pipeline at endpoint: {endpoint}.")    
-    response = requests.request('POST', f'{endpoint}/product-pipeline/test_ingestion_path', 
-                         headers={"Content-Type": "application/json"},
-                         json=payload_list,
-                         auth=AWSSigV4('osis'))
+    product_id = payload['item'].get('product_id')
+    logger.debug("## Ingesting payload: %s into the ingestion pipeline at endpoint: %s.", payload, client.url)
+    try:
+        with metrics.timer("IngestionLatency"):
+            response = await client.post_async(payload_list)
+    except Exception as e:
+        logger.error("## %s of product %s into the ingestion pipeline failed with exception: %s", operation, product_id, e)
+        dead_letter(payload_list, f"{type(e).__name__}: {str(e)}")
+        return status_code_for(e)
+    metrics.put("IngestionDocuments", 1)
     if response.status_code == 200:
-        logging.info(f"## {operation} item: {item} into the ingestion pipeline succeeded with response: {response.text}")
+        logger.info("## %s of product %s into the ingestion pipeline succeeded.", operation, product_id)
     else:
-        raise Exception(f"## {operation} item: {item} into the ingestion pipeline failed with response: {response.text}")
-    return response
+        logger.error("## %s of product %s into the ingestion pipeline failed with response: %s", operation, product_id, response.text)
+        dead_letter(payload_list, f"HTTP {response.status_code}: {response.text}")
+    return response.status_code
 
+async def ingest_bulk_data_async(ingestion_endpoint, payload_list):
+    """
+    Ingests many payloads into the Opensearch ingestion pipeline, sending them in
+    as few requests as the pipeline's payload size limit allows. The requests are
+    sent concurrently.
 
-async def process_payload_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, body):
+    :return: A list of (payload_list, status_code) tuples, one per request.
     """
-    This function inserts/deletes/updates payloads in Amazon Keyspaces, and then asynchronously ingest payloads into Amazon OpenSearch using Amazon Opensearch Ingestion.
+    client = get_ingestion_client(ingestion_endpoint)
+    return await asyncio.gather(*(_post_ingestion_chunk(client, chunk) for chunk in split_payloads(payload_list)))
+
+async def _post_ingestion_chunk(client, payload_list):
+    """Posts one list of payloads to the ingestion pipeline, dead-lettering them if that fails."""
+    logger.info("## Ingesting %d payloads into the ingestion pipeline at endpoint: %s.", len(payload_list), client.url)
+    try:
+        response = await client.post_async(payload_list)
+    except Exception as e:
+        logger.error("## Bulk ingestion of %d payloads failed with exception: %s", len(payload_list), e)
+        dead_letter(payload_list, f"{type(e).__name__}: {str(e)}")
+        return payload_list, status_code_for(e)
+    if response.status_code == 200:
+        logger.info("## Bulk ingestion of %d payloads succeeded.", len(payload_list))
+    else:
+        logger.error("## Bulk ingestion of %d payloads failed with response: %s", len(payload_list), response.text)
+        dead_letter(payload_list, f"HTTP {response.status_code}: {response.text}")
+    return payload_list, response.status_code
+
+def complete_documents(qm, table_name, payload_list):
+    """
+    Replaces the items of writes that only carried some columns with the whole rows
+    they left in Keyspaces. The pipeline indexes every document as a whole, so
+    indexing only the written columns would drop the others from the index. If the
+    rows cannot be read, the payloads are ingested as they are.
+    """
+    schema = qm.table_schema(table_name)
+    partial = [payload for payload in payload_list if payload["operation"] != "delete" and schema.is_partial(payload["item"])]
+    if not partial:
+        return payload_list
+    try:
+        with metrics.timer("KeyspacesLatency"):
+            rows = qm.get_items(table_name, [schema.key(payload["item"]) for payload in partial])
+    except Exception as e:
+        logger.warning("## Reading back %d partially written items failed: %s", len(partial), e)
+        return payload_list
+    partial_ids = {id(payload) for payload in partial}
+    return [
+        {**payload, "item": rows.get(schema.key(payload["item"]), payload["item"])} if id(payload) in partial_ids else payload
+        for payload in payload_list
+    ]
+
+async def process_batch_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, body, entity=DEFAULT_ENTITY):
+    """
+    This function runs a batch of inserts/deletes/updates concurrently in Amazon Keyspaces, and then
+    ingests all successfully written payloads into Amazon OpenSearch in bulk. The response reports the
+    status of every operation in the batch. All operations of a batch are on items of one entity, and
+    the batch has been checked by validate_request.
+    """
+    operations = body["operations"]
+    logger.info("## Received batch of %d operations", len(operations))
+    metrics.put("BatchSize", len(operations))
+    summary = await run_operations_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, operations, entity)
+    return batch_response(summary)
+
+def batch_response(summary):
+    """Builds the response of a batch from the summary of its operations."""
+    results = summary["results"]
+    succeeded = sum(1 for result in results if result["statusCode"] == 200)
+    return {
+        "statusCode": 200 if succeeded == len(results) and "error" not in summary else 207,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({
+            "message": f"{succeeded} of {len(results)} operations completed successfully.",
+            **summary,
+        }),
+    }
+
+async def run_operations_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, operations, entity=DEFAULT_ENTITY):
+    """
+    Runs validated operations of one entity concurrently in Amazon Keyspaces, and then
+    ingests all successfully written payloads into Amazon OpenSearch in bulk.
+
+    :return: A dict of the number of writes, writes saved and duplicates, and of the
+        result of every operation, in the order of the operations.
     """
-    with QueryManager(cert_file_path, boto3_session(), keyspace_name) as qm:
-        operation = body.get("operation")
+    # Every operation is versioned with the timestamp of its Keyspaces write, unless
+    # the client sent one. Operations of one batch get increasing versions, so later
+    # operations on a product win in Keyspaces as well as in the index.
+    base_version = document_version()
+    for index, operation in enumerate(operations):
+        if operation.get("version") is None:
+            operation["version"] = base_version + index
+
+    # Retried operations are dropped, and the remaining ones are collapsed to one
+    # write per product, so that Keyspaces and the pipeline only see final states.
+    fresh, duplicates = split_duplicates(operations, _idempotency_cache)
+    if COALESCE_WRITES:
+        writes, positions = coalesce_operations([operations[index] for index in fresh], lambda operation: entity.key_of(operation["item"]))
+    else:
+        writes, positions = [operations[index] for index in fresh], list(range(len(fresh)))
+    logger.info("## Coalesced %d operations into %d writes, %d duplicates dropped, %d writes saved.",
+                len(operations), len(writes), len(duplicates), len(operations) - len(writes))
+    metrics.put("Writes", len(writes))
+    metrics.put("WritesSaved", len(operations) - len(writes))
+
+    qm = get_query_manager(cert_file_path, keyspace_name)
+    with metrics.timer("KeyspacesLatency"):
+        status_codes = await qm.execute_batch_async(table_name, [(op["operation"], op["item"], op["version"]) for op in writes])
+        if writes and 200 not in status_codes and not qm.is_healthy():
+            logger.warning("## Keyspace batch failed on an unhealthy session, retrying.")
+            try:
+                qm = get_query_manager(cert_file_path, keyspace_name)
+                status_codes = await qm.execute_batch_async(table_name, [(op["operation"], op["item"], op["version"]) for op in writes])
+            except Exception as e:
+                logger.error("## Reconnecting to Keyspaces failed: %s", e)
+                status_codes = [status_code_for(e)] * len(writes)
+
+    write_results = []
+    for write, status_code in zip(writes, status_codes):
+        message = "Keyspace operation succeeded." if status_code == 200 else f"Keyspace {write['operation']} operation failed."
+        write_results.append({"statusCode": status_code, "message": message})
 
+    # Ship all successfully written payloads to OpenSearch in bulk, tagged with their
+    # entity so that the pipeline routes them to the entity's index.
+    written = [index for index, status_code in enumerate(status_codes) if status_code == 200]
+    written_documents = [{**writes[index], "entity": entity.name} for index in written]
+    search.invalidate(written_documents)
+    if written and INGESTION_MODE == "cdc":
+        for index in written:
+            write_results[index]["message"] = "Keyspace operation succeeded, Opensearch ingestion follows from the change stream."
+    elif written and INGESTION_MODE != "sync":
         try:
-            assert operation in ["insert", "update", "delete"]
-            logger.info(f"## Received operation: {operation}")
-            assert isinstance(body.get("item"), dict)
-            logger.info(f"## Received item: {body.get('item')}")
-        except AssertionError as e:
-            logger.error(f"## Invalid payload: {body}.")
-            message = f"Invalid payload: {body}. Please ensure your operation is one of the following: insert, update or delete, followed by an item. Example JSON input: {example_json_input}"
-            return {
-                "statusCode": 500,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({"message": message}),
-            }
+            documents = complete_documents(qm, table_name, written_documents)
+            with metrics.timer("IngestionLatency"):
+                await buffer_ingestion_async(ingestion_endpoint, documents)
+            status_code, message = 200, "Opensearch ingestion queued."
+        except Exception as e:
+            logger.error("## Queueing %d payloads for ingestion failed: %s", len(written), e)
+            status_code, message = 500, "Opensearch ingestion could not be queued."
+        for index in written:
+            write_results[index]["statusCode"] = status_code
+            write_results[index]["message"] = message
+    elif written:
+        position = 0
+        documents = complete_documents(qm, table_name, written_documents)
+        with metrics.timer("IngestionLatency"):
+            chunks = await ingest_bulk_data_async(ingestion_endpoint, documents)
+        metrics.put("IngestionDocuments", len(written))
+        for payload_list, status_code in chunks:
+            for index in written[position:position + len(payload_list)]:
+                if status_code == 200:
+                    write_results[index]["message"] = "Opensearch ingestion completed successfully."
+                else:
+                    write_results[index]["statusCode"] = status_code
+                    write_results[index]["message"] = "Opensearch ingestion failed."
+            position += len(payload_list)
 
-        item = body.get("item")
+    results = [None] * len(operations)
+    for index, position in zip(fresh, positions):
+        results[index] = {
+            "index": index,
+            "product_id": operations[index]["item"].get("product_id"),
+            **write_results[position],
+        }
+        if results[index]["statusCode"] == 200 and operations[index].get("idempotency_key") is not None:
+            _idempotency_cache.put(operations[index]["idempotency_key"], True)
+    for index in duplicates:
+        results[index] = {
+            "index": index,
+            "product_id": operations[index]["item"].get("product_id"),
+            "statusCode": 200,
+            "message": "Duplicate of an operation that was already applied, skipped.",
+        }
+
+    return {
+        "writes": len(writes),
+        "writes_saved": len(operations) - len(writes),
+        "duplicates": len(duplicates),
+        "results": results,
+    }
+
+async def process_stream_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, records, entity=DEFAULT_ENTITY):
+    """
+    This function runs the operations of an NDJSON body, one operation per line, as consecutive
+    batches of up to STREAM_BATCH_OPERATIONS operations. Lines are parsed while the batches run,
+    so only one batch of the body is held in memory at a time. Invalid lines are reported and
+    skipped, and the response reports the status of every line like the response of a batch.
 
-        if operation == "insert":
-            response_qm = qm.insert_item(table_name, item)
-        elif operation == "update":
-            response_qm = qm.update_item(table_name, item)
+    :param records: The (index, operation, error) tuples of the lines, from bodies.iter_ndjson.
+    """
+    summary = {"writes": 0, "writes_saved": 0, "duplicates": 0}
+    results, chunk, chunk_indexes = [], [], []
+    # Operations are versioned in line order across the whole body, so that later lines
+    # on an item win over earlier ones even when they run in different batches.
+    base_version = document_version()
+    batches = 0
+    schema = validation.get_schema(entity)
+
+    async def run_chunk():
+        nonlocal batches
+        chunk_summary = await run_operations_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, chunk, entity)
+        for result in chunk_summary["results"]:
+            result["index"] = chunk_indexes[result["index"]]
+        results.extend(chunk_summary.pop("results"))
+        for name, value in chunk_summary.items():
+            summary[name] += value
+        chunk.clear()
+        chunk_indexes.clear()
+        batches += 1
+
+    error = None
+    try:
+        for index, operation, line_error in records:
+            if line_error is None:
+                line_error = schema.check_operation(operation)
+            if line_error:
+                results.append({"index": index, "statusCode": 400, "message": line_error})
+                continue
+            if operation.get("version") is None:
+                operation["version"] = base_version + index
+            chunk.append(operation)
+            chunk_indexes.append(index)
+            if len(chunk) >= STREAM_BATCH_OPERATIONS:
+                await run_chunk()
+    except ValueError as e:
+        # The lines read before the body turned out to be corrupt are still run.
+        logger.error("## Reading the NDJSON body failed: %s", e)
+        error = str(e)
+    if chunk:
+        await run_chunk()
+
+    if not results:
+        message = error or "the body has no operations"
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": f"Invalid payload: {message}. Send one operation per line, for example: {json.dumps(example_json_input)}"}),
+        }
+    logger.info("## Ran %d operations of an NDJSON body in %d batches.", len(results), batches)
+    metrics.put("BatchSize", len(results))
+    results.sort(key=lambda result: result["index"])
+    if error is not None:
+        summary["error"] = error
+    return batch_response({**summary, "results": results})
+
+async def process_payload_async(cert_file_path, keyspace_name, table_name, ingestion_endpoint, body, entity=DEFAULT_ENTITY):
+    """
+    This function inserts/deletes/updates payloads in Amazon Keyspaces, and then asynchronously ingest payloads into Amazon OpenSearch using Amazon Opensearch Ingestion.
+    The payload has been checked by validate_request.
+    """
+    operation = body["operation"]
+    logger.info("## Received operation: %s", operation)
+    logger.debug("## Received item: %s", body["item"])
+
+    item = body["item"]
+    # A retried operation whose idempotency key already succeeded is not written again,
+    # like the operations of a batch.
+    idempotency_key = body.get("idempotency_key")
+    if idempotency_key is not None and _idempotency_cache.get(idempotency_key) is not None:
+        logger.info("## Skipping the duplicate of operation with idempotency key: %s", idempotency_key)
+        return {
+            "statusCode": 200,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": "Duplicate of an operation that was already applied, skipped."}),
+        }
+    if body.get("version") is None:
+        body["version"] = document_version()
+    body["entity"] = entity.name
+
+    qm = get_query_manager(cert_file_path, keyspace_name)
+    with metrics.timer("KeyspacesLatency"):
+        response_qm = await qm.execute_write_async(table_name, operation, item, body["version"])
+
+        # A failed write on a session that has since gone unhealthy is most likely a
+        # dropped connection, so reconnect and retry the operation once.
+        if response_qm != 200 and not qm.is_healthy():
+            logger.warning("## Keyspace %s operation failed on an unhealthy session, retrying.", operation)
+            try:
+                qm = get_query_manager(cert_file_path, keyspace_name)
+                response_qm = await qm.execute_write_async(table_name, operation, item, body["version"])
+            except Exception as e:
+                logger.error("## Reconnecting to Keyspaces failed: %s", e)
+                response_qm = status_code_for(e)
+
+    logger.info("## Response from keyspace operation: %s", response_qm)
+    logger.debug("## Prepared statement cache stats: %s", qm.prepared_statement_stats())
+    logger.debug("## Keyspaces session pool stats: %s", qm.pool_stats())
+
+    if response_qm == 200:
+        search.invalidate([body])
+
+    # If keyspace operation is successful, then ingest the data into Opensearch asynchronously.
+    if response_qm == 200 and INGESTION_MODE == "cdc":
+        status_code = 200
+        message = f"Keyspace {operation} operation succeeded, Opensearch ingestion follows from the change stream for {body}."
+    elif response_qm == 200 and INGESTION_MODE != "sync":
+        try:
+            with metrics.timer("IngestionLatency"):
+                await buffer_ingestion_async(ingestion_endpoint, complete_documents(qm, table_name, [body]))
+            status_code = 200
+            message = f"Keyspace {operation} operation succeeded, Opensearch ingestion queued for {body}."
+        except Exception as e:
+            logger.error("## Queueing payload for ingestion failed: %s", e)
+            status_code = 500
+            message = f"Opensearch ingestion could not be queued for {body}."
+    elif response_qm == 200:
+        status_code = await ingest_data_async(ingestion_endpoint, complete_documents(qm, table_name, [body])[0])
+        if status_code == 200:
+            message = f"Opensearch ingestion completed successfully for {body}."
         else:
-            response_qm = qm.delete_item(table_name, item)
+            message = f"Opensearch ingestion failed for {body}."
+    else:
+        status_code = response_qm
+        message = f"Keyspace {operation} operation failed for {body}."
+    if status_code == 200 and idempotency_key is not None:
+        _idempotency_cache.put(idempotency_key, True)
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"message": message}),
+    }
 
-        logger.info(f"## Response from keyspace operation: {response_qm}")
+def validate_request(body, entity):
+    """
+    Checks a JSON body against the compiled schema of its entity, before any request is
+    sent to Amazon Keyspaces or the ingestion pipeline.
 
-        # If keyspace operation is successful, then ingest the data into Opensearch asynchronously.
-        if response_qm == 200:
-            response_osis = await ingest_data_async(ingestion_endpoint, body)
-            status_code = response_osis.status_code if response_osis else 500
-            if status_code == 200:
-                message = f"Opensearch ingestion completed successfully for {body}."
-            else:
-                message = f"Opensearch ingestion failed for {body}."
+    :return: None if the body is valid, otherwise the 400 response.
+    """
+    schema = validation.get_schema(entity)
+    if "operations" in body:
+        message, errors = schema.check_batch(body, MAX_BATCH_OPERATIONS)
+        if message is None:
+            return None
+        if errors:
+            logger.error("## Invalid batch payload with %d invalid operations.", len(errors))
+            response = {"message": message, "errors": errors}
+        else:
+            logger.error("## Invalid batch payload: %s.", message)
+            response = {"message": f"Invalid payload: {message}. Example JSON input: {json.dumps(example_batch_json_input)}"}
+    else:
+        message = schema.check_operation(body)
+        if message is None:
+            return None
+        logger.error("## Invalid payload: %s.", message)
+        response = {"message": f"Invalid payload: {message}. Example JSON input: {json.dumps(example_json_input)}"}
+    return {
+        "statusCode": 400,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(response),
+    }
+
+def process_get_items(cert_file_path, keyspace_name, event):
+    """
+    This function reads items from Amazon Keyspaces by primary key, either one item from the
+    /items/{product_id} path or up to MAX_ITEMS_PER_READ items from the ids query parameter of /items.
+    The entity query parameter selects the table, by default the products table.
+    """
+    path_parameters = event.get("pathParameters") or {}
+    query_parameters = event.get("queryStringParameters") or {}
+    single = "product_id" in path_parameters
+    try:
+        entity = get_entity(query_parameters.get("entity"))
+        table_name = entity.table_name
+        if single:
+            product_ids = [entity.parse_key(path_parameters["product_id"])]
         else:
-            status_code = response_qm
-            message = f"Keyspace {operation} operation failed for {body}."
+            product_ids = [entity.parse_key(product_id.strip()) for product_id in query_parameters.get("ids", "").split(",") if product_id.strip()]
+        if not 0 < len(product_ids) <= MAX_ITEMS_PER_READ:
+            raise ValueError(f"ids must list between 1 and {MAX_ITEMS_PER_READ} product ids")
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": f"Invalid read: {str(e)}. Example: /items/100 or /items?ids=100,101"}),
+        }
+
+    hits = _item_cache.hits
+    try:
+        qm = get_query_manager(cert_file_path, keyspace_name)
+        with metrics.timer("KeyspacesLatency"):
+            items = qm.get_items(table_name, product_ids)
+    except Exception as e:
+        logger.error("## Keyspaces read of %d items failed with exception: %s", len(product_ids), e)
         return {
-            "statusCode": status_code,
+            "statusCode": status_code_for(e),
             "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"message": message}),
+            "body": json.dumps({"message": "Keyspace read failed."}),
         }
+    cache_hit = _item_cache.hits - hits == len(set(product_ids))
+    metrics.put("ItemCacheHits", 1 if cache_hit else 0)
+    logger.info("## Item cache %s, cache stats: %s", "hit" if cache_hit else "miss", _item_cache.stats())
+
+    headers = {"Content-Type": "application/json", "X-Cache": "Hit" if cache_hit else "Miss"}
+    if single:
+        item = items.get(product_ids[0])
+        if item is None:
+            return {
+                "statusCode": 404,
+                "headers": headers,
+                "body": json.dumps({"message": f"Item {product_ids[0]} not found."}),
+            }
+        return {"statusCode": 200, "headers": headers, "body": json.dumps(item)}
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": json.dumps({
+            "items": [items[product_id] for product_id in dict.fromkeys(product_ids) if product_id in items],
+            "missing": [product_id for product_id in dict.fromkeys(product_ids) if product_id not in items],
+        }),
+    }
 
 def handler(event, context):
-    logger.info(event)
-    cert_file_path = get_tls_cert()
-    keyspace_name = os.environ.get("KEYSPACE_NAME")
-    logger.info(f"## Loaded Keyspace name from environment variable KEYSPACE_NAME: {keyspace_name}")
-    table_name = os.environ.get("TABLE_NAME")
-    logger.info(f"## Loaded table name from environment variable TABLE_NAME: {table_name}")
-    ingestion_endpoint = os.environ.get("INGESTION_ENDPOINT")
-    logger.info(f"## Loaded ingestion endpoint from environment variable INGESTION_ENDPOINT: {ingestion_endpoint}")
-    full_table_name = f"{keyspace_name}.{table_name}"
+    """
+    Routes API requests, and emits the latency of every stage of the request, the
+    request size and the batch size as one CloudWatch Embedded Metric Format line.
+    """
+    request_metrics = metrics.begin(Route="write")
+    try:
+        with request_metrics.timer("TotalLatency"):
+            response = route(event, context)
+        if response is not None:
+            request_metrics.set_property("StatusCode", response.get("statusCode"))
+        return response
+    finally:
+        metrics.end()
 
-    if event["body"]:
-        body = json.loads(event["body"])
-        logger.info(f"## Received payload: {body}")
+def route(event, context):
+    logger.debug("## Received event: %s", event)
+    metrics.put("RequestBytes", len(event.get("body") or ""), "Bytes")
+    if event.get("httpMethod") == "GET" and event.get("resource") == "/search":
+        metrics.current().set_dimension("Route", "search")
+        return search.handler(event, context)
+
+    keyspace_name, ingestion_endpoint = function_settings()
+
+    if event.get("httpMethod") == "GET" and event.get("resource") in ("/items", "/items/{product_id}"):
+        metrics.current().set_dimension("Route", "items")
+        with metrics.timer("CertLoadLatency"):
+            cert_file_path = get_tls_cert()
+        return process_get_items(cert_file_path, keyspace_name, event)
+
+    if event.get("body"):
+        # A retried request is answered with the response of the request that succeeded.
+        headers = bodies.request_headers(event)
+        idempotency_key = headers.get("idempotency-key")
+        if idempotency_key is not None:
+            request_hash = request_fingerprint(event)
+            replay = _idempotency_cache.get(("request", idempotency_key))
+            if replay is not None and replay[0] != request_hash:
+                logger.warning("## Idempotency key %s was reused with a different request.", idempotency_key)
+                return {
+                    "statusCode": 422,
+                    "headers": {"Content-Type": "application/json"},
+                    "body": json.dumps({"message": "The Idempotency-Key was already used with a different request body."}),
+                }
+            if replay is not None:
+                logger.info("## Replaying the response of idempotency key: %s", idempotency_key)
+                response = replay[1]
+                return {**response, "headers": {**response["headers"], "Idempotent-Replayed": "true"}}
+
+        # Bodies may be base64 encoded and gzip compressed. NDJSON bodies are parsed line
+        # by line while they are processed, other bodies are parsed as one JSON document.
+        # The entity field, or the entity query parameter of NDJSON bodies, selects the
+        # table and index of the request.
+        ndjson = bodies.is_ndjson(headers)
+        try:
+            stream = bodies.open_body(event)
+            if ndjson:
+                body = None
+                entity = get_entity((event.get("queryStringParameters") or {}).get("entity"))
+            else:
+                body = bodies.read_json(stream)
+                logger.debug("## Received payload: %s", body)
+                error = validation.check_body(body)
+                if error:
+                    raise ValueError(error)
+                entity = get_entity(body.get("entity"))
+        except ValueError as e:
+            return {
+                "statusCode": 400,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"message": f"Invalid payload: {str(e)}."}),
+            }
+        metrics.current().set_property("Entity", entity.name)
+
+        # Malformed payloads are rejected before the certificate is loaded or any
+        # connection is used. The lines of NDJSON bodies are checked as they are read.
+        if not ndjson:
+            if "operations" in body:
+                metrics.current().set_dimension("Route", "batch")
+            response = validate_request(body, entity)
+            if response is not None:
+                return response
+
+        with metrics.timer("CertLoadLatency"):
+            cert_file_path = get_tls_cert()
+        # Connect before processing, so that an unreachable keyspace is answered with
+        # the status of the error, such as a 503 for NoHostAvailable.
+        try:
+            get_query_manager(cert_file_path, keyspace_name)
+        except Exception as e:
+            logger.error("## Connecting to Keyspaces failed: %s", e)
+            return {
+                "statusCode": status_code_for(e),
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"message": "Keyspaces is not reachable, retry later."}),
+            }
+        if INGESTION_MODE == "buffer" and _ingestion_buffer is not None:
+            # Documents buffered by earlier invocations are flushed once they are old enough.
+            _ingestion_buffer.flush_if_due()
 
         # Run the payload processing asynchronously
-        response = asyncio.run(process_payload_async(cert_file_path, keyspace_name, full_table_name, ingestion_endpoint, body))
+        if ndjson:
+            metrics.current().set_dimension("Route", "batch")
+            response = asyncio.run(process_stream_async(cert_file_path, keyspace_name, entity.table_name, ingestion_endpoint, bodies.iter_ndjson(stream), entity))
+        elif "operations" in body:
+            response = asyncio.run(process_batch_async(cert_file_path, keyspace_name, entity.table_name, ingestion_endpoint, body, entity))
+        else:
+            response = asyncio.run(process_payload_async(cert_file_path, keyspace_name, entity.table_name, ingestion_endpoint, body, entity))
 
+        if idempotency_key is not None and response["statusCode"] == 200:
+            _idempotency_cache.put(("request", idempotency_key), (request_hash, response))
         return response
+
+    return {
+        "statusCode": 400,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"message": f"Invalid payload: the body is empty. Example JSON input: {json.dumps(example_json_input)}"}),
+    }
+
+def request_fingerprint(event):
+    """
+    Hashes what selects the effect of a write request, its body and query string,
+    so that a reused idempotency key can be told apart from a retry.
+    """
+    digest = hashlib.sha256((event.get("body") or "").encode("utf-8"))
+    digest.update(json.dumps(event.get("queryStringParameters") or {}, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+def prime():
+    """
+    Does the work of a first request during the init phase of the execution
+    environment: imports the Cassandra driver, opens the Keyspaces session, prepares
+    the statements and resolves the credentials of the ingestion client. A failure
+    is only logged, and the first request then does the work itself.
+    """
+    keyspace_name = os.environ.get("KEYSPACE_NAME")
+    try:
+        qm = get_query_manager(get_tls_cert(), keyspace_name)
+        for entity in ENTITIES.values():
+            qm.warm_up(entity.table_name)
+        if INGESTION_MODE != "cdc" and os.environ.get("INGESTION_ENDPOINT"):
+            get_ingestion_client(os.environ.get("INGESTION_ENDPOINT")).signer.get()
+        logger.info("## Primed the Keyspaces session of keyspace: %s", keyspace_name)
+    except Exception as e:
+        logger.warning("## Priming failed, the first request will connect: %s", e)
+
+if PRIME_ON_INIT:
+    prime()
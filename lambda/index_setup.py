@@ -0,0 +1,93 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+The custom resource that creates the index templates and the indexes of the
+collection before the ingestion pipeline starts, so that no index is created by
+dynamic mapping from the first document the pipeline writes.
+"""
+
+import json
+import logging
+import os
+import time
+
+from collection import CollectionClient
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Data access policies of a collection take a while to apply after they are created,
+# and requests are denied with 403 until then.
+PERMISSION_WAIT_SECONDS = int(os.environ.get("PERMISSION_WAIT_SECONDS", "300"))
+PERMISSION_RETRY_INTERVAL = 10
+
+
+def template_name(index):
+    """The name of the index template of an index."""
+    return f"{index}-template"
+
+
+def send(client, method, path, body=None, allowed=()):
+    """
+    Sends a request to the collection, waiting for the data access policy to apply
+    while the request is denied.
+
+    :param allowed: Error status codes that are expected, and returned instead of raised.
+    :return: The HTTP response.
+    """
+    deadline = time.time() + PERMISSION_WAIT_SECONDS
+    while True:
+        response = client.request(method, path, body)
+        if response.status_code != 403 or time.time() >= deadline:
+            break
+        logger.info("## %s %s was denied, waiting for the data access policy to apply.", method, path)
+        time.sleep(PERMISSION_RETRY_INTERVAL)
+    if response.status_code >= 400 and response.status_code not in allowed:
+        raise Exception(f"## {method} {path} failed with HTTP {response.status_code}: {response.text}")
+    return response
+
+
+def apply_template(client, index, template):
+    """
+    Puts the index template of an index and creates the index from it. An index that
+    already exists keeps its mapping; new fields of the template are added to it,
+    and fields whose mapping changed only apply once the index is recreated.
+    """
+    send(client, "PUT", f"/_index_template/{template_name(index)}", template)
+    if send(client, "HEAD", f"/{index}", allowed=(404,)).status_code == 404:
+        send(client, "PUT", f"/{index}", {})
+        logger.info("## Created index %s from its template.", index)
+        return
+    response = send(client, "PUT", f"/{index}/_mapping", template["template"]["mappings"], allowed=(400,))
+    if response.status_code == 400:
+        logger.warning("## The mapping of index %s conflicts with its template, recreate the index to apply it: %s", index, response.text)
+    else:
+        logger.info("## Updated the mapping of existing index %s.", index)
+
+
+def handler(event, context):
+    """
+    Handles the Create, Update and Delete events of the custom resource. Deleting
+    it deletes the index templates, but keeps the indexes and their documents. A
+    template that cannot be deleted is only logged, so that it does not block the
+    deletion of the stack.
+    """
+    properties = event["ResourceProperties"]
+    client = CollectionClient(properties["CollectionEndpoint"])
+    templates = json.loads(properties["Templates"])
+    if event["RequestType"] == "Delete":
+        removed = templates
+    else:
+        for index, template in templates.items():
+            apply_template(client, index, template)
+        old_templates = json.loads((event.get("OldResourceProperties") or {}).get("Templates", "{}"))
+        removed = {index: template for index, template in old_templates.items() if index not in templates}
+    for index in removed:
+        try:
+            send(client, "DELETE", f"/_index_template/{template_name(index)}", allowed=(404,))
+            logger.info("## Deleted the index template of index %s.", index)
+        except Exception as e:
+            logger.warning("## Deleting the index template of index %s failed: %s", index, e)
+    client.close()
+    return {"PhysicalResourceId": event.get("PhysicalResourceId") or f"index-templates-{properties['CollectionEndpoint']}"}
@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+
+from ingestion import DeadLetterSink, IngestionClient, MAX_INGESTION_PAYLOAD_BYTES
+from resilience import VALIDATION, classify
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Shared across warm invocations so that connections to the pipeline stay open.
+_ingestion_client = None
+_dead_letter_sink = None
+
+def get_ingestion_client():
+    """Returns the IngestionClient cached on this execution environment."""
+    global _ingestion_client
+    if _ingestion_client is None:
+        _ingestion_client = IngestionClient(
+            os.environ.get("INGESTION_ENDPOINT"),
+            pool_size=int(os.environ.get("INGESTION_POOL_SIZE", "10")),
+            compress=os.environ.get("INGESTION_COMPRESSION") == "gzip",
+        )
+    return _ingestion_client
+
+def get_dead_letter_sink():
+    """Returns the DeadLetterSink of the ingestion dead-letter queue, if one is configured."""
+    global _dead_letter_sink
+    if _dead_letter_sink is None and os.environ.get("INGESTION_DLQ_URL"):
+        _dead_letter_sink = DeadLetterSink(os.environ.get("INGESTION_DLQ_URL"))
+    return _dead_letter_sink
+
+def group_records(records, max_bytes=MAX_INGESTION_PAYLOAD_BYTES):
+    """
+    Groups queue messages into bulk requests that stay below the pipeline's payload
+    size limit. Each message holds a JSON list of payloads and is never split, so
+    a failed request can be mapped back to the messages it came from.
+
+    :return: A list of (message_ids, payload_list) tuples, and the IDs of the
+        messages that are not a JSON list.
+    """
+    groups, malformed = [], []
+    message_ids, payload_list, size = [], [], 2
+    for record in records:
+        try:
+            payloads = json.loads(record["body"])
+        except ValueError:
+            payloads = None
+        if not isinstance(payloads, list):
+            logger.error("## Message %s is not a JSON list of payloads.", record["messageId"])
+            malformed.append(record["messageId"])
+            continue
+        record_size = len(record["body"])
+        if payload_list and size + record_size > max_bytes:
+            groups.append((message_ids, payload_list))
+            message_ids, payload_list, size = [], [], 2
+        message_ids.append(record["messageId"])
+        payload_list.extend(payloads)
+        size += record_size
+    if payload_list:
+        groups.append((message_ids, payload_list))
+    return groups, malformed
+
+def handler(event, context):
+    """
+    Delivers payloads buffered in the ingestion queue to the ingestion pipeline in
+    bulk. Messages of failed requests are reported back as batch item failures so
+    that SQS delivers them again, and eventually moves them to the dead-letter queue.
+    Payloads the pipeline rejected as invalid would fail again, so they are moved to
+    the dead-letter queue right away. While the pipeline is saturated the client's
+    circuit breaker fails requests fast, and their messages are delivered again later.
+    """
+    client = get_ingestion_client()
+    records = event.get("Records", [])
+    groups, malformed = group_records(records)
+    # Malformed messages fail on their own, and reach the dead-letter queue through the
+    # redrive policy of the queue, without failing the rest of the batch.
+    failures = [{"itemIdentifier": message_id} for message_id in malformed]
+    for message_ids, payload_list in groups:
+        try:
+            response = client.post(payload_list)
+            outcome = response if response.status_code != 200 else None
+            if outcome is not None:
+                logger.error("## Ingesting %d payloads failed with response: %s", len(payload_list), response.text)
+        except Exception as e:
+            logger.error("## Ingesting %d payloads failed with exception: %s", len(payload_list), e)
+            outcome = e
+        if outcome is None:
+            logger.info("## Ingested %d payloads from %d messages.", len(payload_list), len(message_ids))
+            continue
+        sink = get_dead_letter_sink()
+        if classify(outcome) == VALIDATION and sink is not None:
+            if isinstance(outcome, Exception):
+                reason = f"{type(outcome).__name__}: {str(outcome)}"
+            else:
+                reason = f"HTTP {outcome.status_code}: {outcome.text}"
+            try:
+                sink(payload_list, reason)
+                logger.warning("## Dead-lettered %d payloads rejected by the pipeline.", len(payload_list))
+                continue
+            except Exception as e:
+                logger.error("## Dead-lettering %d payloads failed: %s", len(payload_list), e)
+        failures.extend({"itemIdentifier": message_id} for message_id in message_ids)
+    return {"batchItemFailures": failures}
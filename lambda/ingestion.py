@@ -0,0 +1,322 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import functools
+import gzip
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from coalesce import KEY_FIELD, coalesce_operations
+from resilience import CircuitBreaker, RetryPolicy
+
+# The OpenSearch Ingestion HTTP source rejects request bodies larger than 10 MB,
+# so bulk ingestion requests are split to stay below this size. Payloads are sized
+# before compression, so compressed requests stay well below it.
+MAX_INGESTION_PAYLOAD_BYTES = 9 * 1024 * 1024
+# Compression level of gzip request bodies. JSON documents compress well at low
+# levels, and higher levels mostly cost CPU time.
+GZIP_LEVEL = 5
+
+
+def document_version():
+    """
+    Returns the version of a document written now. It is the current time in
+    microseconds, the unit of Keyspaces write timestamps, so that the version of a
+    document is also the timestamp of its Keyspaces write. The pipeline indexes
+    documents with it as an external version, and drops older versions.
+    """
+    return time.time_ns() // 1000
+
+
+def split_payloads(payload_list, max_bytes=MAX_INGESTION_PAYLOAD_BYTES):
+    """
+    Splits payloads into lists whose JSON encoding stays below max_bytes.
+
+    :param payload_list: The payloads to split.
+    :param max_bytes: The maximum size of one encoded list.
+    :return: A list of payload lists.
+    """
+    chunks = []
+    chunk, chunk_size = [], 2
+    for payload in payload_list:
+        payload_size = len(json.dumps(payload)) + 1
+        if chunk and chunk_size + payload_size > max_bytes:
+            chunks.append(chunk)
+            chunk, chunk_size = [], 2
+        chunk.append(payload)
+        chunk_size += payload_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+class _SerializedAuth:
+    """
+    AWSSigV4 keeps the request date on the signer while signing, so requests
+    signed from several threads at once must take turns. requests accepts any
+    callable as auth, so this module does not need to import it up front.
+    """
+
+    def __init__(self, auth):
+        self.auth = auth
+        self.lock = threading.Lock()
+
+    def __call__(self, r):
+        with self.lock:
+            return self.auth(r)
+
+
+class CachedSigV4:
+    """
+    Provides a SigV4 signer for an AWS service whose credentials are resolved once
+    and resolved again only shortly before they expire.
+    """
+
+    # Credentials are refreshed this many seconds before they expire.
+    CREDENTIAL_REFRESH_MARGIN = 300
+
+    def __init__(self, service, boto_session=None):
+        """
+        :param service: The AWS service the requests are signed for, such as osis.
+        :param boto_session: A Boto3 session. This is used to acquire your AWS credentials.
+        """
+        if boto_session is None:
+            import boto3
+            boto_session = boto3.Session()
+        self.service = service
+        self.boto_session = boto_session
+        self._auth = None
+        self._auth_expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Returns the signer, resolving credentials again only when they expire."""
+        with self._lock:
+            if self._auth is None or time.time() >= self._auth_expires_at:
+                from requests_auth_aws_sigv4 import AWSSigV4
+                credentials = self.boto_session.get_credentials()
+                frozen = credentials.get_frozen_credentials()
+                auth = AWSSigV4(
+                    self.service,
+                    session=self.boto_session,
+                    aws_access_key_id=frozen.access_key,
+                    aws_secret_access_key=frozen.secret_key,
+                    aws_session_token=frozen.token,
+                )
+                # Refreshable credentials (e.g. from an assumed role) carry an expiry
+                # time; static credentials such as Lambda's environment ones do not.
+                expiry = getattr(credentials, "_expiry_time", None)
+                self._auth_expires_at = expiry.timestamp() - self.CREDENTIAL_REFRESH_MARGIN if expiry else float("inf")
+                self._auth = _SerializedAuth(auth)
+            return self._auth
+
+
+def pooled_http_session(pool_size):
+    """Creates a requests session that keeps up to pool_size connections alive per host."""
+    import requests
+    from requests.adapters import HTTPAdapter
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    return http
+
+
+class IngestionClient:
+    """
+    Sends documents to an Amazon OpenSearch Ingestion pipeline. The client holds a
+    pooled keep-alive HTTP session and a SigV4 signer whose credentials are cached
+    until they are about to expire, so it is meant to be created once per execution
+    environment and shared across invocations.
+    """
+
+    DEFAULT_PATH = "/product-pipeline/test_ingestion_path"
+
+    def __init__(self, ingestion_endpoint, pool_size=10, path=DEFAULT_PATH, boto_session=None, retry_policy=None, compress=False):
+        """
+        :param ingestion_endpoint: The host name or URL of the ingestion pipeline.
+        :param pool_size: The number of keep-alive connections kept to the pipeline.
+        :param path: The ingestion path of the pipeline's HTTP source.
+        :param boto_session: A Boto3 session. This is used to acquire your AWS credentials.
+        :param retry_policy: The RetryPolicy requests are sent with. By default 429, 503
+            and other transient failures are retried with backoff, and requests fail
+            fast with CircuitOpenError while the pipeline stays saturated.
+        :param compress: Whether request bodies are gzip compressed. The pipeline's HTTP
+            source must be configured with compression: gzip.
+        """
+        self.endpoint = ingestion_endpoint
+        if not ingestion_endpoint.startswith(("http://", "https://")):
+            ingestion_endpoint = 'https://' + ingestion_endpoint
+        self.url = ingestion_endpoint + path
+        self.http = pooled_http_session(pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.signer = CachedSigV4('osis', boto_session)
+        self.retry_policy = retry_policy or RetryPolicy(breaker=CircuitBreaker())
+        self.compress = compress
+
+    def post(self, payload_list):
+        """
+        Posts a list of payloads to the pipeline over a pooled connection, retrying
+        as the retry policy allows. The body is encoded, and compressed, only once
+        for all attempts.
+
+        :param payload_list: The payloads to ingest.
+        :return: The HTTP response of the last attempt.
+        """
+        headers = {"Content-Type": "application/json"}
+        data = json.dumps(payload_list, separators=(",", ":")).encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+        return self.retry_policy.call(self._post, data, headers)
+
+    def _post(self, data, headers):
+        return self.http.post(self.url, headers=headers, data=data, auth=self.signer.get())
+
+    async def post_async(self, payload_list):
+        """
+        Posts a list of payloads without blocking the event loop.
+
+        :param payload_list: The payloads to ingest.
+        :return: The HTTP response.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self.post, payload_list))
+
+    def close(self):
+        """Closes the pooled connections."""
+        self.http.close()
+        self.executor.shutdown(wait=False)
+
+
+class IngestionBuffer:
+    """
+    Accumulates ingestion payloads and hands them to a sink in bulk once a document
+    count, encoded size or age threshold is reached.
+    """
+
+    def __init__(self, sink, max_documents=1000, max_bytes=MAX_INGESTION_PAYLOAD_BYTES, max_age=5.0, coalesce=False, coalesce_key=KEY_FIELD):
+        """
+        :param sink: A callable that receives a list of payloads on every flush.
+        :param max_documents: Flush once this many payloads are buffered.
+        :param max_bytes: Flush before the encoded payload list would exceed this size.
+        :param max_age: Flush once the oldest buffered payload is this many seconds old.
+        :param coalesce: Collapse the buffered payloads to one per product_id on flush.
+        :param coalesce_key: The item field or function that payloads are coalesced by.
+        """
+        self.sink = sink
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.coalesce = coalesce
+        self.coalesce_key = coalesce_key
+        self.payloads_saved = 0
+        self._payloads = []
+        self._size = 2
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._payloads)
+
+    def add(self, payload):
+        """
+        Buffers a payload, flushing first if it would not fit.
+
+        :param payload: The payload to ingest.
+        :return: The results of the flushes this call triggered.
+        """
+        payload_size = len(json.dumps(payload)) + 1
+        results = []
+        with self._lock:
+            if self._payloads and self._size + payload_size > self.max_bytes:
+                results.append(self._flush_locked())
+            if not self._payloads:
+                self._oldest = time.monotonic()
+            self._payloads.append(payload)
+            self._size += payload_size
+            if len(self._payloads) >= self.max_documents or self._size >= self.max_bytes:
+                results.append(self._flush_locked())
+        return results
+
+    def flush_if_due(self):
+        """
+        Flushes the buffer if the oldest payload has reached the age threshold.
+
+        :return: The result of the flush, or None if nothing was flushed.
+        """
+        with self._lock:
+            if self._payloads and time.monotonic() - self._oldest >= self.max_age:
+                return self._flush_locked()
+        return None
+
+    def flush(self):
+        """
+        Hands all buffered payloads to the sink.
+
+        :return: The result of the sink, or None if the buffer was empty.
+        """
+        with self._lock:
+            if self._payloads:
+                return self._flush_locked()
+        return None
+
+    def _flush_locked(self):
+        payloads = self._payloads
+        self._payloads, self._size, self._oldest = [], 2, None
+        if self.coalesce:
+            coalesced = coalesce_operations(payloads, self.coalesce_key)[0]
+            self.payloads_saved += len(payloads) - len(coalesced)
+            payloads = coalesced
+        return self.sink(payloads)
+
+
+class QueueIngestionSink:
+    """
+    Sends payload lists to an Amazon SQS queue, one message per list, from where
+    the ingestion worker delivers them to the pipeline at least once.
+    """
+
+    # SQS rejects messages larger than 256 KiB.
+    MAX_MESSAGE_BYTES = 250 * 1024
+
+    def __init__(self, queue_url, sqs_client=None):
+        """
+        :param queue_url: The URL of the ingestion queue.
+        :param sqs_client: A Boto3 SQS client.
+        """
+        if sqs_client is None:
+            import boto3
+            sqs_client = boto3.client("sqs")
+        self.queue_url = queue_url
+        self.sqs = sqs_client
+
+    def __call__(self, payload_list):
+        return self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(payload_list))
+
+
+class DeadLetterSink(QueueIngestionSink):
+    """
+    Stores payloads whose ingestion failed permanently in the ingestion dead-letter
+    queue. The messages have the format of the ingestion queue, so once the cause is
+    fixed they can be moved back to it with an SQS redrive and are ingested by the
+    ingestion worker.
+    """
+
+    def __call__(self, payload_list, reason=""):
+        """
+        :param payload_list: The payloads that could not be ingested.
+        :param reason: Why they could not be ingested, stored as a message attribute.
+        :return: The number of messages sent.
+        """
+        chunks = split_payloads(payload_list, self.MAX_MESSAGE_BYTES)
+        for chunk in chunks:
+            self.sqs.send_message(
+                QueueUrl=self.queue_url,
+                MessageBody=json.dumps(chunk),
+                MessageAttributes={"reason": {"DataType": "String", "StringValue": reason[:1024] or "unknown"}},
+            )
+        return len(chunks)
@@ -0,0 +1,114 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import contextvars
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "KeyspacesOpenSearch")
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Collects the metrics of one request and writes them as a single CloudWatch
+    Embedded Metric Format (EMF) log line, from which CloudWatch extracts the
+    metrics without any API calls. Values of the same metric are summed, so a
+    stage that runs several times reports its total time.
+    """
+
+    def __init__(self, namespace=NAMESPACE, **dimensions):
+        """
+        :param namespace: The CloudWatch namespace of the metrics.
+        :param dimensions: The dimensions of the metrics, such as Route.
+        """
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+
+    def put(self, name, value, unit="Count"):
+        """Adds a value to a metric."""
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    @contextmanager
+    def timer(self, name):
+        """Adds the time spent in the with block to a metric, in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, (time.perf_counter() - start) * 1000, "Milliseconds")
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = str(value)
+
+    def set_property(self, name, value):
+        """Adds a value that is logged with the metrics but is not a metric."""
+        self.properties[name] = value
+
+    def to_emf(self):
+        """Returns the EMF document of the metrics."""
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [sorted(self.dimensions)],
+                    "Metrics": [{"Name": name, "Unit": self.units[name]} for name in self.values],
+                }],
+            },
+        }
+        document.update(self.properties)
+        document.update(self.dimensions)
+        document.update({name: round(value, 3) for name, value in self.values.items()})
+        return document
+
+    def emit(self, stream=None):
+        """Writes the metrics to stdout, which Lambda sends to CloudWatch Logs."""
+        print(json.dumps(self.to_emf(), default=str), file=stream or sys.stdout, flush=True)
+
+
+def begin(**dimensions):
+    """Starts collecting the metrics of a request in the current context."""
+    metrics = RequestMetrics(**dimensions)
+    _current.set(metrics)
+    return metrics
+
+
+def end(stream=None):
+    """Emits and stops collecting the metrics of the current request."""
+    metrics = _current.get()
+    _current.set(None)
+    if metrics is not None:
+        metrics.emit(stream)
+    return metrics
+
+
+def current():
+    """Returns the metrics of the current request, or None outside of a request."""
+    return _current.get()
+
+
+def put(name, value, unit="Count"):
+    """Adds a value to a metric of the current request, if any."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.put(name, value, unit)
+
+
+@contextmanager
+def timer(name):
+    """Times the with block into a metric of the current request, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+    else:
+        with metrics.timer(name):
+            yield
@@ -1,8 +1,11 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
+import asyncio
 from datetime import date
 import json
+import logging
+import threading
 from ssl import SSLContext, PROTOCOL_TLSv1_2, CERT_REQUIRED
 
 from cassandra.cluster import (
@@ -11,9 +14,132 @@ from cassandra.cluster import (
     EXEC_PROFILE_DEFAULT,
     DCAwareRoundRobinPolicy,
 )
-from cassandra import ConsistencyLevel
+from cassandra.policies import TokenAwarePolicy
+from cassandra import ConsistencyLevel, InvalidRequest
 from cassandra.query import SimpleStatement
+from cassandra.metadata import protect_name
 from cassandra_sigv4.auth import SigV4AuthProvider
+from functools import lru_cache
+
+import metrics
+from resilience import CircuitBreaker, RetryPolicy, status_code_for
+from schema import PRODUCT_SCHEMA, TableSchema
+
+logger = logging.getLogger(__name__)
+
+# Stands in for the USING TIMESTAMP parameter among the columns a write statement binds.
+TIMESTAMP_MARKER = "[timestamp]"
+
+
+@lru_cache(maxsize=None)
+def ssl_context(cert_file_path):
+    """
+    Builds the TLS context of Keyspaces connections once per certificate file, as
+    loading the certificates is only needed once per execution environment.
+    """
+    context = SSLContext(PROTOCOL_TLSv1_2)
+    context.load_verify_locations(cert_file_path)
+    context.verify_mode = CERT_REQUIRED
+    return context
+
+
+class SessionPool:
+    """
+    Spreads requests over several sessions of one cluster. With protocol v3 and
+    later the driver opens a single connection per host and session, and Keyspaces
+    serves a limited number of requests per connection, so every session adds one
+    connection to each host. Requests go to the session with the fewest requests in
+    flight, and once the requests in flight on every session approach
+    max_requests_per_connection, another session is opened in the background, up to
+    max_sessions.
+    """
+
+    def __init__(self, connect, sessions, max_sessions=1, max_requests_per_connection=1024, expand_threshold=0.8):
+        """
+        :param connect: A function that opens another session.
+        :param sessions: The sessions opened up front, at least one.
+        :param max_sessions: The number of sessions the pool may grow to.
+        :param max_requests_per_connection: The requests in flight per session the pool
+            is sized for.
+        :param expand_threshold: The share of max_requests_per_connection in flight on
+            every session at which the pool grows.
+        """
+        self.connect = connect
+        self.sessions = list(sessions)
+        self.in_flight = [0] * len(self.sessions)
+        self.max_sessions = max(max_sessions, len(self.sessions))
+        self.max_requests_per_connection = max_requests_per_connection
+        self.expand_at = max(1, int(max_requests_per_connection * expand_threshold))
+        self.requests = 0
+        self.peak_in_flight = 0
+        self.saturated = 0
+        self.expansions = 0
+        self._expanding = False
+        self._lock = threading.Lock()
+
+    def execute_async(self, statement, parameters=None):
+        """Sends a request on the least loaded session, like Session.execute_async."""
+        with self._lock:
+            index = min(range(len(self.sessions)), key=self.in_flight.__getitem__)
+            self.in_flight[index] += 1
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, sum(self.in_flight))
+            if self.in_flight[index] > self.max_requests_per_connection:
+                self.saturated += 1
+            expand = self.in_flight[index] >= self.expand_at and len(self.sessions) < self.max_sessions and not self._expanding
+            if expand:
+                self._expanding = True
+            session = self.sessions[index]
+        if expand:
+            threading.Thread(target=self._expand, daemon=True).start()
+        # The callbacks of a paged request run again for every page it fetches, but the
+        # request only counts as in flight until its first page.
+        released = []
+
+        def release(_):
+            with self._lock:
+                if not released:
+                    released.append(True)
+                    self.in_flight[index] -= 1
+
+        try:
+            response_future = session.execute_async(statement, parameters)
+        except Exception:
+            release(None)
+            raise
+        response_future.add_callbacks(callback=release, errback=release)
+        return response_future
+
+    def _expand(self):
+        try:
+            session = self.connect()
+        except Exception as e:
+            logger.warning("### Opening another Keyspaces session failed: %s", e)
+            session = None
+        with self._lock:
+            if session is not None:
+                self.sessions.append(session)
+                self.in_flight.append(0)
+                self.expansions += 1
+            self._expanding = False
+        if session is not None:
+            logger.info("### Keyspaces session pool grew to %d sessions.", len(self.sessions))
+
+    def stats(self):
+        """Returns the size of the pool, the requests in flight and how close they came to its capacity."""
+        with self._lock:
+            capacity = len(self.sessions) * self.max_requests_per_connection
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "in_flight": sum(self.in_flight),
+                "peak_in_flight": self.peak_in_flight,
+                "utilization": round(sum(self.in_flight) / capacity, 4),
+                "peak_utilization": round(self.peak_in_flight / capacity, 4),
+                "requests": self.requests,
+                "saturated": self.saturated,
+                "expansions": self.expansions,
+            }
 
 
 class QueryManager:
@@ -30,128 +156,487 @@ class QueryManager:
     DEFAULT_CERT_FILE = "sf-class2-root.crt"
     CERT_URL = f"https://certs.secureserver.net/repository/sf-class2-root.crt"
 
-    def __init__(self, cert_file_path, boto_session, keyspace_name):
+    def __init__(self, cert_file_path, boto_session, keyspace_name, item_cache=None, retry_policy=None,
+                 connections_per_host=1, max_connections_per_host=4, max_requests_per_connection=1024, token_aware=True):
         """
         :param cert_file_path: The path and file name of the certificate used for TLS.
         :param boto_session: A Boto3 session. This is used to acquire your AWS credentials.
         :param keyspace_name: The name of the keyspace to connect.
+        :param item_cache: An optional TTLCache that point reads are served from. Writes
+            through this QueryManager drop the cached items they change.
+        :param retry_policy: The RetryPolicy requests are sent with. By default throttled
+            and timed out requests are retried with backoff, and requests fail fast
+            while Keyspaces keeps failing.
+        :param connections_per_host: The connections opened to every Keyspaces host on
+            connect, one per session of the SessionPool.
+        :param max_connections_per_host: The connections per host the pool may grow to
+            when the requests in flight approach max_requests_per_connection.
+        :param max_requests_per_connection: The requests in flight one connection is
+            allowed. Further requests wait for a free stream of the connection.
+        :param token_aware: Whether requests are routed to a host that owns the partition
+            they address.
         """
         self.cert_file_path = cert_file_path
         self.boto_session = boto_session
         self.ks_name = keyspace_name
         self.cluster = None
         self.session = None
+        # Prepared statements are bound to the session, keyed by
+        # (table, operation, columns) and stored with the table metadata they were
+        # prepared against so that a schema change invalidates them.
+        self.prepared_statements = {}
+        # Table schemas are cached the same way, keyed by table.
+        self.table_schemas = {}
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        self.item_cache = item_cache
+        self.retry_policy = retry_policy or RetryPolicy(breaker=CircuitBreaker())
+        self.connections_per_host = connections_per_host
+        self.max_connections_per_host = max(max_connections_per_host, connections_per_host)
+        self.max_requests_per_connection = max_requests_per_connection
+        self.token_aware = token_aware
+        self._session_pool = None
 
     def __enter__(self):
         """
         Creates a session connection to the keyspace that is secured by TLS and
         authenticated by SigV4.
         """
-        ssl_context = SSLContext(PROTOCOL_TLSv1_2)
-        ssl_context.load_verify_locations(self.cert_file_path)
-        ssl_context.verify_mode = CERT_REQUIRED
+        return self.connect()
+
+    def connect(self):
+        """
+        Creates a session connection to the keyspace that is secured by TLS and
+        authenticated by SigV4. Unlike the context manager, the connection stays
+        open until close() is called, so it can be reused across invocations.
+
+        :raises Exception: The driver's error if the keyspace cannot be connected to,
+            after the cluster was shut down.
+        """
         auth_provider = SigV4AuthProvider(self.boto_session)
         contact_point = f"cassandra.{self.boto_session.region_name}.amazonaws.com"
+        load_balancing_policy = DCAwareRoundRobinPolicy()
+        if self.token_aware:
+            # Prepared statements carry the routing key of the partition they address.
+            load_balancing_policy = TokenAwarePolicy(load_balancing_policy)
         exec_profile = ExecutionProfile(
             consistency_level=ConsistencyLevel.LOCAL_QUORUM,
-            load_balancing_policy=DCAwareRoundRobinPolicy(),
+            load_balancing_policy=load_balancing_policy,
         )
         self.cluster = Cluster(
             [contact_point],
-            ssl_context=ssl_context,
+            ssl_context=ssl_context(self.cert_file_path),
             auth_provider=auth_provider,
             port=9142,
             execution_profiles={EXEC_PROFILE_DEFAULT: exec_profile},
             protocol_version=4,
         )
-        self.cluster.__enter__()
-        self.session = self.cluster.connect(self.ks_name)
+        # The driver only sizes its pools for protocol v1 and v2, so the requests in
+        # flight per connection are capped through the connection class.
+        connection_class = self.cluster.connection_class
+        self.cluster.connection_class = type(connection_class.__name__, (connection_class,), {
+            "max_in_flight": self.max_requests_per_connection,
+            "orphaned_threshold": 3 * self.max_requests_per_connection // 4,
+        })
+        # A cluster that failed to connect still runs its control connection and event
+        # loop threads, so it is shut down before the error is raised.
+        try:
+            self.session = self.cluster.connect(self.ks_name)
+            sessions = [self.session] + [self.cluster.connect(self.ks_name) for _ in range(self.connections_per_host - 1)]
+        except Exception:
+            self.close()
+            raise
+        self._session_pool = self._new_session_pool(sessions)
         return self
 
+    def _new_session_pool(self, sessions):
+        return SessionPool(
+            lambda: self.cluster.connect(self.ks_name), sessions,
+            max_sessions=self.max_connections_per_host,
+            max_requests_per_connection=self.max_requests_per_connection,
+        )
+
+    def session_pool(self):
+        """Returns the SessionPool that writes and point reads are spread over."""
+        if self._session_pool is None or self._session_pool.sessions[0] is not self.session:
+            self._session_pool = self._new_session_pool([self.session])
+        return self._session_pool
+
+    def pool_stats(self):
+        """Returns the size and utilization of the session pool."""
+        return self.session_pool().stats()
+
     def __exit__(self, *args):
         """
         Exits the cluster. This shuts down all existing session connections.
         """
-        self.cluster.__exit__(*args)
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the cluster and all existing session connections.
+        """
+        if self.cluster is not None:
+            self.cluster.shutdown()
+        self.cluster = None
+        self.session = None
+        self._session_pool = None
+        self.prepared_statements.clear()
+        self.table_schemas.clear()
+
+    def is_healthy(self):
+        """
+        Checks whether the session can still serve requests.
+
+        :return: True if the session is open and at least one host is up.
+        """
+        if self.session is None or self.session.is_shutdown:
+            return False
+        return any(host.is_up for host in self.cluster.metadata.all_hosts())
+
+    def _table_metadata(self, table_name):
+        """
+        Looks up the driver's schema metadata for a table.
+
+        :param table_name: The name of the table, optionally qualified with the keyspace.
+        :return: The TableMetadata of the table, or None if it is not known.
+        """
+        keyspace_name, _, name = table_name.rpartition(".")
+        keyspace = self.cluster.metadata.keyspaces.get(keyspace_name or self.ks_name)
+        return keyspace.tables.get(name) if keyspace else None
 
-    def insert_item(self, table_name, item):
+    def prepare(self, table_name, operation, columns, query):
         """
-        Insert an item into a table in the keyspace.
+        Returns a prepared statement for a query, preparing it only once per session.
+
+        :param table_name: The name of the table the query runs against.
+        :param operation: The operation the query implements, such as insert.
+        :param columns: The columns bound by the query.
+        :param query: The CQL query to prepare on a cache miss.
+        :return: The prepared statement.
+        """
+        key = (table_name, operation, tuple(columns))
+        table_metadata = self._table_metadata(table_name)
+        cached = self.prepared_statements.get(key)
+        if cached is not None and cached[1] is table_metadata:
+            self.prepared_hits += 1
+            return cached[0]
+        self.prepared_misses += 1
+        with metrics.timer("PrepareLatency"):
+            statement = self.session.prepare(query)
+        self.prepared_statements[key] = (statement, table_metadata)
+        return statement
+
+    def invalidate_prepared(self, table_name, operation=None, columns=None):
+        """
+        Drops cached prepared statements so that they are prepared again on next use,
+        and the table's schema so that it is rebuilt from the driver's metadata.
+
+        :param table_name: The name of the table whose statements are dropped.
+        :param operation: If given, only drop statements for this operation.
+        :param columns: If given, only drop the statement bound to these columns.
+        """
+        for key in list(self.prepared_statements):
+            if key[0] != table_name:
+                continue
+            if operation is not None and key[1] != operation:
+                continue
+            if columns is not None and key[2] != tuple(columns):
+                continue
+            del self.prepared_statements[key]
+        self.table_schemas.pop(table_name, None)
+
+    def prepared_statement_stats(self):
+        """
+        Returns hit/miss counters of the prepared statement cache.
+
+        :return: A dict with the number of hits, misses and cached statements.
+        """
+        return {
+            "hits": self.prepared_hits,
+            "misses": self.prepared_misses,
+            "size": len(self.prepared_statements),
+        }
+
+    def table_schema(self, table_name):
+        """
+        Returns the schema of a table, built from the driver's metadata once per
+        session and rebuilt when the table changes. Tables the driver has no metadata
+        for are assumed to have the layout of product_by_item.
+
+        :param table_name: The name of the table, optionally qualified with the keyspace.
+        :return: The TableSchema of the table.
+        """
+        table_metadata = self._table_metadata(table_name)
+        cached = self.table_schemas.get(table_name)
+        if cached is not None and cached[1] is table_metadata:
+            return cached[0]
+        schema = TableSchema.from_metadata(table_metadata) if table_metadata is not None else PRODUCT_SCHEMA
+        self.table_schemas[table_name] = (schema, table_metadata)
+        return schema
+
+    def _write_statement(self, table_name, operation, columns, versioned):
+        """
+        Returns the prepared statement of a write of a set of columns.
+
+        :param columns: The columns written, including the primary key columns.
+        :param versioned: Whether the write carries its timestamp with USING TIMESTAMP.
+        :return: A (statement, bound_columns) tuple. bound_columns lists the columns in
+            the order the statement binds them, with TIMESTAMP_MARKER for the timestamp.
+        """
+        schema = self.table_schema(table_name)
+        using = " USING TIMESTAMP ?" if versioned else ""
+        key = list(schema.primary_key)
+        where = " AND ".join(f"{protect_name(column)}=?" for column in key)
+        if operation == "insert":
+            bound = list(columns)
+            query = (f"INSERT INTO {table_name} ({', '.join(protect_name(column) for column in bound)}) "
+                     f"VALUES ({','.join('?' for _ in bound)}){using};")
+            bound += [TIMESTAMP_MARKER] if versioned else []
+        elif operation == "update":
+            assignments = [column for column in columns if column not in schema.primary_key]
+            bound = ([TIMESTAMP_MARKER] if versioned else []) + assignments + key
+            query = (f"UPDATE {table_name}{using} SET {', '.join(f'{protect_name(column)}=?' for column in assignments)} "
+                     f"WHERE {where}")
+        elif operation == "delete":
+            bound = ([TIMESTAMP_MARKER] if versioned else []) + key
+            query = f"DELETE FROM {table_name}{using} WHERE {where}"
+        else:
+            raise ValueError(f"Unsupported operation: {operation}")
+        return self.prepare(table_name, operation, bound, query), bound
+
+    def bind_write(self, table_name, operation, item, version=None):
+        """
+        Builds the prepared statement and parameters for a write operation. The item
+        is validated and converted with the codecs of the table's schema, and only the
+        columns it holds are written, so partial updates leave the other columns as
+        they are. A statement is prepared once for every set of columns written.
 
         :param table_name: The name of the table.
-        :param item: The item to insert. The item is a json object.
-        :return: The return code of the operation.
+        :param operation: One of insert, update or delete.
+        :param item: The item to write. The item is a json object.
+        :param version: An optional write timestamp in microseconds. Keyspaces keeps
+            the cells with the highest timestamp, so a write that carries an older
+            version than the stored one is ignored instead of overwriting it.
+        :return: A (statement, parameters) tuple.
+        :raises ValueError: If the item does not fit the table's schema.
         """
-        statement = self.session.prepare(
-            f"INSERT INTO {table_name} (product_id, product_name, product_description) VALUES (?,?,?);"
-        )
-        try:            
-            response = self.session.execute(
-                statement,
-                parameters=[
-                    item["product_id"],
-                    item["product_name"],
-                    item["product_description"],
-                ])
-            results = response.response_future
-            print(f"### Keyspaces insert succeeded with response: {results}")
+        if operation not in ("insert", "update", "delete"):
+            raise ValueError(f"Unsupported operation: {operation}")
+        values = self.table_schema(table_name).encode(item, operation)
+        statement, bound = self._write_statement(table_name, operation, tuple(values), version is not None)
+        return statement, [version if column == TIMESTAMP_MARKER else values[column] for column in bound]
+
+    async def execute_write_async(self, table_name, operation, item, version=None):
+        """
+        Runs an insert/update/delete operation without blocking the event loop. The
+        request is sent with the driver's execute_async and awaited through an
+        asyncio future, so several writes can wait on the network at the same time.
+
+        :param table_name: The name of the table.
+        :param operation: One of insert, update or delete.
+        :param item: The item to write. The item is a json object.
+        :param version: An optional write timestamp in microseconds.
+        :return: The return code of the operation: 200, or 429, 503, 400 or 500 depending
+            on whether the write was throttled, failed transiently, was invalid or failed.
+        """
+        try:
+            statement, parameters = self.bind_write(table_name, operation, item, version)
+            await self.retry_policy.call_async(
+                lambda: _as_asyncio_future(self.session_pool().execute_async(statement, parameters))
+            )
+            logger.debug("### Keyspaces %s succeeded.", operation)
             status_code = 200
         except Exception as e:
-            print(f"### Keyspaces insert failed with exception: {str(e)}.")
-            status_code = 500
+            logger.warning("### Keyspaces %s failed with exception: %s.", operation, e)
+            if isinstance(e, InvalidRequest):
+                self.invalidate_prepared(table_name, operation)
+            status_code = status_code_for(e)
+        self._invalidate_item(table_name, item)
         return status_code
-    
 
-    def update_item(self, table_name, item):
+    async def execute_batch_async(self, table_name, operations, concurrency=100):
         """
-        Update an item in a table in the keyspace.
+        Runs many insert/update/delete operations with overlapping network waits.
 
         :param table_name: The name of the table.
-        :param item: The item to update. The item is a json object.
-        :return: The return code of the operation. 
+        :param operations: A list of (operation, item) or (operation, item, version) tuples.
+        :param concurrency: The maximum number of requests in flight at once.
+        :return: A list with the return code of each operation, in order.
         """
-        statement = self.session.prepare(
-            f"UPDATE {table_name} SET product_name=?, product_description=? WHERE product_id=?"
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def write(operation, *write):
+            async with semaphore:
+                return await self.execute_write_async(table_name, operation, *write)
+
+        status_codes = await asyncio.gather(*(write(*operation) for operation in operations))
+        logger.info("### Keyspaces batch of %d operations completed with %d successes.", len(operations), status_codes.count(200))
+        return list(status_codes)
+
+    def _invalidate_item(self, table_name, item):
+        """
+        Drops a written item from the item cache. This also runs after failed writes,
+        since a write that timed out may still have been applied.
+        """
+        if self.item_cache is not None and isinstance(item, dict):
+            self.item_cache.invalidate((table_name, self.table_schema(table_name).key(item)))
+
+    def get_items(self, table_name, keys):
+        """
+        Reads items by their primary key. Items found in the item cache are served
+        from it, the others are read with concurrent point reads through a prepared
+        statement and added to the cache.
+
+        :param table_name: The name of the table.
+        :param keys: The primary keys of the items to read, such as product ids. Keys
+            of tables with a compound primary key are tuples.
+        :return: A dict of the items found, keyed by primary key.
+        :raises ValueError: If a key does not fit the primary key columns.
+        """
+        items = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            item = self.item_cache.get((table_name, key)) if self.item_cache is not None else None
+            if item is None:
+                missing.append(key)
+            else:
+                items[key] = item
+        if not missing:
+            return items
+
+        schema = self.table_schema(table_name)
+        parameters = []
+        for key in missing:
+            values = key if isinstance(key, tuple) else (key,)
+            if len(values) != len(schema.primary_key):
+                raise ValueError(f"keys of table {schema.name} have the columns {', '.join(schema.primary_key)}")
+            try:
+                parameters.append([schema.codecs[column](value) for column, value in zip(schema.primary_key, values)])
+            except ValueError as e:
+                raise ValueError(f"invalid key {key}: {e}")
+        statement = self._select_statement(table_name)
+        # All point reads are sent before waiting on any of them, so they overlap on
+        # the network instead of costing one round trip each.
+        pool = self.session_pool()
+        futures = [pool.execute_async(statement, values) for values in parameters]
+        try:
+            for key, future in zip(missing, futures):
+                for row in future.result():
+                    item = schema.decode(row)
+                    items[key] = item
+                    if self.item_cache is not None:
+                        self.item_cache.put((table_name, key), item)
+        except InvalidRequest:
+            self.invalidate_prepared(table_name, "select")
+            raise
+        return items
+
+    def _select_statement(self, table_name):
+        schema = self.table_schema(table_name)
+        where = " AND ".join(f"{protect_name(column)} = ?" for column in schema.primary_key)
+        return self.prepare(
+            table_name, "select", schema.primary_key,
+            f"SELECT {', '.join(protect_name(column) for column in schema.columns)} FROM {table_name} WHERE {where}"
         )
-        try:            
-            response = self.session.execute(
-                statement,
-                parameters=[
-                    item["product_name"],
-                    item["product_description"],
-                    item["product_id"]
-                ])
-            results = response.response_future
-            print(f"### Keyspaces update succeeded with response: {results}")
-            status_code = 200
-        except Exception as e:
-            print(f"### Keyspaces update failed with exception: {str(e)}.")
-            status_code = 500  
-        return status_code
 
+    def warm_up(self, table_name):
+        """
+        Prepares the statements of the writes of whole items and of point reads, so
+        that the first requests do not wait for them.
 
-    def delete_item(self, table_name, item):
+        :param table_name: The name of the table.
         """
-        Delete an item from a table in the keyspace.
+        schema = self.table_schema(table_name)
+        for operation in ("insert", "update", "delete"):
+            self._write_statement(table_name, operation, tuple(schema.columns), versioned=True)
+        self._select_statement(table_name)
+
+    def get_item(self, table_name, key):
+        """
+        Reads one item by its primary key.
 
         :param table_name: The name of the table.
-        :param item: The item to delete.
-        :return: The return code of the operation.
+        :param key: The primary key of the item, such as a product id.
+        :return: The item, or None if it does not exist.
+        """
+        return self.get_items(table_name, [key]).get(key)
+
+    def token_ring_bounds(self):
         """
-        statement = self.session.prepare(
-            f"DELETE FROM {table_name} WHERE product_id = ?"
+        Returns the token range of the cluster's partitioner.
+
+        :return: A (min_token, max_token) tuple. Every partition has a token t with
+            min_token < t <= max_token.
+        """
+        partitioner = self.cluster.metadata.partitioner or ""
+        if partitioner.endswith("RandomPartitioner"):
+            return -1, 2 ** 127
+        return -2 ** 63, 2 ** 63 - 1
+
+    def split_token_ring(self, count):
+        """
+        Splits the token ring into contiguous ranges of about equal size.
+
+        :param count: The number of ranges.
+        :return: A list of (start, end) tuples covering tokens start < t <= end.
+        """
+        min_token, max_token = self.token_ring_bounds()
+        width = (max_token - min_token) // count
+        bounds = [min_token + width * i for i in range(count)] + [max_token]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def scan_token_range(self, table_name, start, end, fetch_size=1000):
+        """
+        Reads all rows of a table whose partition token falls in a range. Rows are
+        fetched in pages of fetch_size and yielded as they arrive, so the range is
+        never held in memory.
+
+        :param table_name: The name of the table.
+        :param start: Rows with a token greater than start are read.
+        :param end: Rows with a token up to and including end are read.
+        :param fetch_size: The number of rows fetched per page.
+        :return: A generator of (token, item, version) tuples in token order. The
+            version is the newest write timestamp of the row's cells.
+        """
+        schema = self.table_schema(table_name)
+        partition_key = ", ".join(protect_name(column) for column in schema.partition_key)
+        columns = ", ".join(protect_name(column) for column in schema.columns)
+        # Collections have a write time per element, so only the other columns are versioned.
+        write_times = "".join(f", writetime({protect_name(column)})" for column in schema.scalar_columns())
+        statement = self.prepare(
+            table_name, "scan", ("token_start", "token_end"),
+            f"SELECT token({partition_key}), {columns}{write_times} FROM {table_name} "
+            f"WHERE token({partition_key}) > ? AND token({partition_key}) <= ?"
         )
-        try:            
-            response = self.session.execute(
-                statement,
-                parameters=[
-                    item["product_id"]
-                ])
-            results = response.response_future
-            print(f"### Keyspaces delete succeeded with response:: {results}")
-            status_code = 200
-        except Exception as e:
-            print(f"### Keyspaces delete failed with exception: {str(e)}.")
-            status_code = 500
-        return status_code
+        bound_statement = statement.bind([start, end])
+        bound_statement.fetch_size = fetch_size
+        first_write_time = 1 + len(schema.columns)
+        # Concurrent scans are spread over the sessions of the pool; the following pages
+        # of a range are read on the session of its first page.
+        for row in self.session_pool().execute_async(bound_statement).result():
+            yield row[0], schema.decode(row), max(row[first_write_time:], key=lambda t: t or 0, default=None) or None
+
+
+def _as_asyncio_future(response_future):
+    """
+    Bridges a driver ResponseFuture into an asyncio future. The driver completes
+    requests on its own event loop thread, so results are handed back to the
+    asyncio loop with call_soon_threadsafe.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exception):
+        if not future.done():
+            future.set_exception(exception)
 
+    response_future.add_callbacks(
+        callback=lambda result: loop.call_soon_threadsafe(set_result, result),
+        errback=lambda exception: loop.call_soon_threadsafe(set_exception, exception),
+    )
+    return future
@@ -0,0 +1,263 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Finds and repairs drift between the Keyspaces table and the OpenSearch index.
+
+Both sides are streamed twice at most, without ever being loaded into memory:
+
+1. Every row and document is hashed into one of N buckets by its primary key, and
+   each bucket keeps an order-independent digest of the (key, content hash) pairs
+   in it. This pass needs constant memory.
+2. Only buckets whose digests differ are compared item by item. Their rows and
+   documents are spilled to disk in one pass over each side, in groups of buckets
+   of at most --max-rows-in-memory rows. Each group of rows is then held in memory
+   and the documents of the same group are read back against it.
+
+The repairs (index missing or stale items, delete items that only exist in the
+index) are sent to the ingestion pipeline in bulk. The entity selects the table and
+index, and every column of the table is compared.
+
+    python lambda/reconcile.py --ingestion-endpoint <pipeline-host> --collection-endpoint <collection-host> \\
+        --cert-file sf-class2-root.crt --dry-run
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+
+from boto3.session import Session as boto3_session
+
+from collection import CollectionClient
+from entities import get_entity
+from ingestion import IngestionClient, document_version, split_payloads
+from query import QueryManager
+
+logger = logging.getLogger(__name__)
+
+# Keyspaces items may carry the write timestamp of their row under this field. It is
+# not compared, but becomes the version of the repair.
+VERSION_FIELD = "version"
+
+
+def content_hash(item, fields):
+    """Hashes the compared fields of an item."""
+    content = json.dumps([item.get(field) for field in fields], separators=(",", ":"), default=str)
+    return hashlib.sha1(content.encode("utf-8")).digest()
+
+
+def bucket_of(key, buckets):
+    """Assigns a key to one of the buckets, the same way on both sides."""
+    return zlib.crc32(str(key).encode("utf-8")) % buckets
+
+
+def bucket_digests(items, buckets, entity, fields):
+    """
+    Folds a stream of items into one digest and count per bucket. The digest is the
+    XOR of a hash per (key, content) pair, so it does not depend on the order the
+    items are read in.
+
+    :param entity: The Entity whose primary key the items are bucketed by.
+    :param fields: The compared fields.
+
+    :return: A (digests, counts) tuple of lists indexed by bucket.
+    """
+    digests = [0] * buckets
+    counts = [0] * buckets
+    for item in items:
+        key = entity.key_of(item)
+        bucket = bucket_of(key, buckets)
+        pair = hashlib.sha1(str(key).encode("utf-8") + content_hash(item, fields)).digest()
+        digests[bucket] ^= int.from_bytes(pair[:8], "big")
+        counts[bucket] += 1
+    return digests, counts
+
+
+def group_buckets(buckets, counts, max_rows):
+    """Groups buckets so that the rows of each group fit into max_rows."""
+    groups, group, rows = [], [], 0
+    for bucket in buckets:
+        if group and rows + counts[bucket] > max_rows:
+            groups.append(group)
+            group, rows = [], 0
+        group.append(bucket)
+        rows += counts[bucket]
+    if group:
+        groups.append(group)
+    return groups
+
+
+def insert_repair(entity, item):
+    """Builds the repair that indexes a Keyspaces item, versioned by its write timestamp."""
+    item = dict(item)
+    version = item.pop(VERSION_FIELD, None)
+    return {"operation": "insert", "item": item, "version": version or document_version(), "entity": entity.name}
+
+
+def delete_repair(entity, key):
+    """Builds the repair that deletes a document that is not in the table anymore."""
+    values = key if len(entity.key) > 1 else (key,)
+    return {"operation": "delete", "item": dict(zip(entity.key, values)), "version": document_version(), "entity": entity.name}
+
+
+def spill_groups(items, group_of, buckets, entity, prefix):
+    """
+    Writes the items of the selected buckets to one JSON lines file per group of
+    buckets, so that the groups can be compared one by one without reading the
+    side again.
+
+    :param items: A stream of items.
+    :param group_of: The group of every selected bucket.
+    :param buckets: The total number of buckets.
+    :param entity: The Entity of the items.
+    :param prefix: The path the files are named after, followed by the group.
+    """
+    files = {}
+    try:
+        for item in items:
+            group = group_of.get(bucket_of(entity.key_of(item), buckets))
+            if group is None:
+                continue
+            if group not in files:
+                files[group] = open(f"{prefix}-{group}.jsonl", "w", encoding="utf-8")
+            files[group].write(json.dumps(item, separators=(",", ":"), default=str) + "\n")
+    finally:
+        for file in files.values():
+            file.close()
+
+
+def read_group(prefix, group):
+    """Reads back the items spilled for a group of buckets."""
+    path = f"{prefix}-{group}.jsonl"
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def diff_buckets(table_items, index_items, entity, fields):
+    """
+    Compares the items of one group of buckets one by one. The Keyspaces items are
+    held in memory, the index documents are streamed.
+
+    :param table_items: The Keyspaces items of the group.
+    :param index_items: The index documents of the group.
+    :param entity: The Entity of the items.
+    :param fields: The compared fields.
+    :return: A generator of repair operations.
+    """
+    expected = {}
+    for item in table_items:
+        expected[entity.key_of(item)] = (content_hash(item, fields), item)
+    for document in index_items:
+        key = entity.key_of(document)
+        entry = expected.pop(key, None)
+        if entry is None:
+            yield delete_repair(entity, key)
+        elif entry[0] != content_hash(document, fields):
+            yield insert_repair(entity, entry[1])
+    for _, item in expected.values():
+        yield insert_repair(entity, item)
+
+
+def reconcile(table_items, index_items, entity, fields, buckets=4096, max_rows_in_memory=100000, spill_dir=None):
+    """
+    Streams both sides at most twice and yields the repair operations that make the
+    index match the table.
+
+    :param table_items: A callable returning a fresh stream of Keyspaces items.
+    :param index_items: A callable returning a fresh stream of index documents.
+    :param entity: The Entity of the items.
+    :param fields: The compared fields, the columns of the table.
+    :param buckets: The number of buckets the first pass folds the items into.
+    :param max_rows_in_memory: The maximum number of Keyspaces rows held at once.
+    :param spill_dir: The directory the items of differing buckets are spilled to,
+        by default the temporary directory.
+    :return: A generator of repair operations.
+    """
+    table_digests, table_counts = bucket_digests(table_items(), buckets, entity, fields)
+    index_digests, index_counts = bucket_digests(index_items(), buckets, entity, fields)
+    mismatched = [
+        bucket for bucket in range(buckets)
+        if table_digests[bucket] != index_digests[bucket] or table_counts[bucket] != index_counts[bucket]
+    ]
+    logger.info("## %d rows in the table, %d documents in the index, %d of %d buckets differ.",
+                sum(table_counts), sum(index_counts), len(mismatched), buckets)
+    if not mismatched:
+        return
+    groups = group_buckets(mismatched, table_counts, max_rows_in_memory)
+    group_of = {bucket: position for position, group in enumerate(groups) for bucket in group}
+    with tempfile.TemporaryDirectory(dir=spill_dir) as directory:
+        table_prefix, index_prefix = os.path.join(directory, "table"), os.path.join(directory, "index")
+        spill_groups(table_items(), group_of, buckets, entity, table_prefix)
+        spill_groups(index_items(), group_of, buckets, entity, index_prefix)
+        for position in range(len(groups)):
+            yield from diff_buckets(read_group(table_prefix, position), read_group(index_prefix, position), entity, fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entity", help="The entity to reconcile, from the ENTITIES environment variable of the API "
+                        "function, by default the first one. It selects the keyspace, table and index.")
+    parser.add_argument("--keyspace", help="Must match the keyspace of the entity if given.")
+    parser.add_argument("--table", help="Must match the table of the entity if given.")
+    parser.add_argument("--index", help="Must match the index of the entity if given.")
+    parser.add_argument("--ingestion-endpoint", required=True)
+    parser.add_argument("--collection-endpoint", required=True)
+    parser.add_argument("--cert-file", default=QueryManager.DEFAULT_CERT_FILE)
+    parser.add_argument("--ranges", type=int, default=64)
+    parser.add_argument("--buckets", type=int, default=4096)
+    parser.add_argument("--max-rows-in-memory", type=int, default=100000)
+    parser.add_argument("--spill-dir", help="The directory the items of differing buckets are spilled to.")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="Only report the repairs.")
+    parser.add_argument("--compress", action="store_true", help="Gzip the requests, for pipelines with compression: gzip.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        entity = get_entity(args.entity)
+    except ValueError as e:
+        parser.error(f"--entity {str(e)}")
+    for option, given, expected in (
+        ("--keyspace", args.keyspace, entity.keyspace), ("--table", args.table, entity.table), ("--index", args.index, entity.index),
+    ):
+        if given is not None and given != expected:
+            parser.error(f"{option} {given} does not match {expected} of entity {entity.name}")
+
+    collection = CollectionClient(args.collection_endpoint)
+    ingestion_client = IngestionClient(args.ingestion_endpoint, compress=args.compress)
+    with QueryManager(args.cert_file, boto3_session(), entity.keyspace) as qm:
+        fields = list(qm.table_schema(entity.table_name).columns)
+
+        def table_items():
+            for start, end in qm.split_token_ring(args.ranges):
+                for _, item, version in qm.scan_token_range(entity.table_name, start, end):
+                    yield {**item, VERSION_FIELD: version}
+
+        def index_items():
+            return collection.scan(entity.index, list(entity.key), fields=fields)
+
+        def send(batch):
+            if not args.dry_run:
+                for payload_list in split_payloads(batch):
+                    ingestion_client.post(payload_list).raise_for_status()
+
+        repairs = {"insert": 0, "delete": 0}
+        batch = []
+        for repair in reconcile(table_items, index_items, entity, fields, args.buckets, args.max_rows_in_memory, args.spill_dir):
+            repairs[repair["operation"]] += 1
+            batch.append(repair)
+            if len(batch) >= args.batch_size:
+                send(batch)
+                batch = []
+        send(batch)
+    logger.info("## %s %d index and %d delete repairs.", "Found" if args.dry_run else "Sent", repairs["insert"], repairs["delete"])
+
+
+if __name__ == "__main__":
+    main()
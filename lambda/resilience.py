@@ -0,0 +1,247 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import asyncio
+import random
+import threading
+import time
+
+THROTTLING = "throttling"
+TRANSIENT = "transient"
+VALIDATION = "validation"
+FATAL = "fatal"
+
+# The status code a request is answered with when it failed with an error of a class.
+STATUS_CODES = {THROTTLING: 429, TRANSIENT: 503, VALIDATION: 400, FATAL: 500}
+
+# Driver errors are matched by class name, so that functions packaged without the
+# Cassandra driver, like the ingestion worker, can use this module. Amazon Keyspaces
+# reports exceeded capacity as timeouts and unavailable errors.
+THROTTLING_ERRORS = {"Unavailable", "ReadTimeout", "WriteTimeout", "ReadFailure", "WriteFailure", "OverloadedErrorMessage"}
+TRANSIENT_ERRORS = {
+    "OperationTimedOut", "NoHostAvailable", "ConnectionException", "ConnectionShutdown", "ServerError",
+    "CircuitOpenError", "ConnectionError", "Timeout", "ConnectTimeout", "ReadTimeoutError", "ChunkedEncodingError",
+}
+# Input that does not fit is reported with ValueError. Other built-in errors, such as
+# KeyError and TypeError, are bugs and fail as FATAL.
+VALIDATION_ERRORS = {"InvalidRequest", "SyntaxException", "Unauthorized", "ValueError"}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its circuit breaker is open."""
+
+
+def classify(outcome):
+    """
+    Classifies the outcome of a call to Keyspaces or the ingestion pipeline.
+
+    :param outcome: An exception, or the result of a call such as an HTTP response.
+    :return: One of THROTTLING, TRANSIENT, VALIDATION or FATAL, or None if the
+        outcome is a success.
+    """
+    if isinstance(outcome, BaseException):
+        names = {cls.__name__ for cls in type(outcome).__mro__}
+        if names & THROTTLING_ERRORS:
+            return THROTTLING
+        if names & TRANSIENT_ERRORS:
+            return TRANSIENT
+        if names & VALIDATION_ERRORS:
+            return VALIDATION
+        return FATAL
+    status_code = getattr(outcome, "status_code", None)
+    if status_code is None or status_code < 400:
+        return None
+    if status_code in (429, 503):
+        return THROTTLING
+    if status_code in (500, 502, 504):
+        return TRANSIENT
+    if status_code < 500:
+        return VALIDATION
+    return FATAL
+
+
+def is_retryable(category):
+    """Whether a call that failed with an error of this class may succeed when retried."""
+    return category in (THROTTLING, TRANSIENT)
+
+
+def status_code_for(outcome):
+    """Returns the status code a request that failed with this outcome is answered with."""
+    return STATUS_CODES.get(classify(outcome), 200)
+
+
+class RetryBudget:
+    """
+    A token bucket that bounds how many retries a client makes. Every retry takes
+    tokens and every successful call puts one back, so while a dependency keeps
+    failing the bucket drains and calls stop being retried, instead of multiplying
+    the load on a dependency that is already throttling.
+    """
+
+    def __init__(self, capacity=500, retry_cost=5, throttling_cost=10):
+        """
+        :param capacity: The number of tokens in a full bucket.
+        :param retry_cost: The tokens taken by the retry of a transient error.
+        :param throttling_cost: The tokens taken by the retry of a throttling error.
+        """
+        self.capacity = capacity
+        self.retry_cost = retry_cost
+        self.throttling_cost = throttling_cost
+        self.tokens = capacity
+        self._lock = threading.Lock()
+
+    def acquire(self, category):
+        """
+        Takes the tokens for a retry.
+
+        :return: True if the retry may be made.
+        """
+        cost = self.throttling_cost if category == THROTTLING else self.retry_cost
+        with self._lock:
+            if self.tokens < cost:
+                return False
+            self.tokens -= cost
+            return True
+
+    def release(self):
+        """Puts a token back after a successful call."""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast once a dependency failed failure_threshold times in a row. After
+    reset_timeout seconds one trial call is let through; it closes the circuit if it
+    succeeds and opens it again if it fails.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=20, reset_timeout=10.0):
+        """
+        :param failure_threshold: The number of consecutive failures that open the circuit.
+        :param reset_timeout: The number of seconds the circuit stays open.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Checks that a call may be made.
+
+        :raises CircuitOpenError: If the circuit is open.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenError(f"Circuit is {self.state}, failing fast after {self.failures} consecutive failures.")
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Calls a dependency, retrying throttling and transient errors with exponential
+    backoff and full jitter, as long as the retry budget allows, and failing fast
+    while the circuit breaker is open. Validation and fatal errors are not retried.
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.05, max_delay=2.0, budget=None, breaker=None):
+        """
+        :param max_attempts: The maximum number of calls, including the first one.
+        :param base_delay: The backoff before the first retry is drawn from [0, base_delay].
+        :param max_delay: The upper bound of the backoff.
+        :param budget: The RetryBudget retries are taken from.
+        :param breaker: An optional CircuitBreaker guarding the dependency.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker
+        self.retries = 0
+
+    def backoff(self, attempt):
+        """Returns the delay before retry number attempt, counting from 0."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _should_retry(self, attempt, outcome):
+        """
+        Records the outcome of a call with the budget and the breaker.
+
+        :return: True if the call should be retried.
+        """
+        category = classify(outcome)
+        if category is None:
+            self.budget.release()
+        if not is_retryable(category):
+            # The dependency answered, even if the call was wrong.
+            if self.breaker is not None:
+                self.breaker.record_success()
+            return False
+        if self.breaker is not None:
+            self.breaker.record_failure()
+        if attempt + 1 >= self.max_attempts or not self.budget.acquire(category):
+            return False
+        self.retries += 1
+        return True
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func, retrying it as the policy allows.
+
+        :return: The result of the last call. An HTTP response is returned even if its
+            status code is an error; exceptions of the last call are raised.
+        """
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                outcome = func(*args, **kwargs)
+            except Exception as e:
+                outcome = e
+            if not self._should_retry(attempt, outcome):
+                break
+            time.sleep(self.backoff(attempt))
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def call_async(self, func, *args, **kwargs):
+        """
+        Awaits the coroutine function func, retrying it as the policy allows, without
+        blocking the event loop during the backoff.
+        """
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.before_call()
+            try:
+                outcome = await func(*args, **kwargs)
+            except Exception as e:
+                outcome = e
+            if not self._should_retry(attempt, outcome):
+                break
+            await asyncio.sleep(self.backoff(attempt))
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
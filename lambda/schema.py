@@ -0,0 +1,284 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import base64
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+INTEGER_TYPES = {"int", "bigint", "smallint", "tinyint", "varint", "counter"}
+# The sizes of the fixed size signed integer types; varint and counter are unbounded.
+INTEGER_BITS = {"tinyint": 8, "smallint": 16, "int": 32, "bigint": 64}
+FLOAT_TYPES = {"float", "double"}
+TEXT_TYPES = {"text", "varchar", "ascii", "inet"}
+
+
+def parse_type(cql_type):
+    """
+    Splits a CQL type into its name and parameters, dropping frozen<>.
+    For example map<text, frozen<list<int>>> is ("map", ["text", "list<int>"]).
+    """
+    cql_type = cql_type.strip()
+    name, _, rest = cql_type.partition("<")
+    name = name.strip().lower()
+    if not rest:
+        return name, []
+    parameters, depth, start = [], 0, 0
+    rest = rest[:rest.rindex(">")]
+    for position, character in enumerate(rest):
+        if character == "<":
+            depth += 1
+        elif character == ">":
+            depth -= 1
+        elif character == "," and depth == 0:
+            parameters.append(rest[start:position].strip())
+            start = position + 1
+    parameters.append(rest[start:].strip())
+    if name == "frozen":
+        return parse_type(parameters[0])
+    return name, parameters
+
+
+def _expect(condition, expected):
+    if not condition:
+        raise ValueError(f"must be {expected}")
+
+
+def _integer(value):
+    _expect(isinstance(value, int) and not isinstance(value, bool), "an integer")
+    return value
+
+
+def _sized_integer(bits):
+    """Returns the codec of a signed integer type of a number of bits."""
+    minimum, maximum = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+    def codec(value):
+        _integer(value)
+        _expect(minimum <= value <= maximum, f"an integer between {minimum} and {maximum}")
+        return value
+    return codec
+
+
+def _float(value):
+    _expect(isinstance(value, (int, float)) and not isinstance(value, bool), "a number")
+    return float(value)
+
+
+def _decimal(value):
+    _expect(isinstance(value, (int, float, str)) and not isinstance(value, bool), "a number")
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError("must be a number")
+
+
+def _text(value):
+    _expect(isinstance(value, str), "a string")
+    return value
+
+
+def _boolean(value):
+    _expect(isinstance(value, bool), "true or false")
+    return value
+
+
+def _timestamp(value):
+    """Accepts milliseconds since the epoch or an ISO 8601 date and time."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+    _expect(isinstance(value, str), "an ISO 8601 timestamp or milliseconds since the epoch")
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError("must be an ISO 8601 timestamp or milliseconds since the epoch")
+
+
+def _date(value):
+    _expect(isinstance(value, str), "an ISO 8601 date")
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError("must be an ISO 8601 date")
+
+
+def _uuid(value):
+    _expect(isinstance(value, str), "a UUID")
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise ValueError("must be a UUID")
+
+
+def _blob(value):
+    _expect(isinstance(value, str), "a base64 string")
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        raise ValueError("must be a base64 string")
+
+
+def _any(value):
+    return value
+
+
+SCALAR_CODECS = {
+    **{name: _integer for name in INTEGER_TYPES},
+    **{name: _sized_integer(bits) for name, bits in INTEGER_BITS.items()},
+    **{name: _float for name in FLOAT_TYPES},
+    **{name: _text for name in TEXT_TYPES},
+    "decimal": _decimal,
+    "boolean": _boolean,
+    "timestamp": _timestamp,
+    "date": _date,
+    "uuid": _uuid,
+    "timeuuid": _uuid,
+    "blob": _blob,
+}
+
+
+def compile_codec(cql_type):
+    """
+    Builds the function that converts a JSON value into the driver value of a CQL
+    type, raising ValueError if the value does not fit. Types without a codec, such
+    as user-defined types, are passed to the driver as they are.
+    """
+    name, parameters = parse_type(cql_type)
+    if name in ("list", "set"):
+        element = compile_codec(parameters[0])
+        container = list if name == "list" else set
+
+        def collection(value):
+            _expect(isinstance(value, list), "a list")
+            try:
+                return container(element(entry) for entry in value)
+            except TypeError:
+                # Elements of sets must be hashable, which collections are not.
+                raise ValueError(f"must be a list of values that can be held in a {name}")
+        return collection
+    if name == "map":
+        key, value_codec = compile_codec(parameters[0]), compile_codec(parameters[1])
+        # JSON object keys are always strings.
+        numeric_keys = parse_type(parameters[0])[0] in INTEGER_TYPES
+
+        def mapping(value):
+            _expect(isinstance(value, dict), "an object")
+            try:
+                return {key(int(k) if numeric_keys else k): value_codec(v) for k, v in value.items()}
+            except (ValueError, TypeError):
+                raise ValueError("must be an object of valid keys and values")
+        return mapping
+    return SCALAR_CODECS.get(name, _any)
+
+
+def to_json(value):
+    """Converts a value read through the driver into a JSON value."""
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, dict) or hasattr(value, "items"):
+        return {str(to_json(k)): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)) or hasattr(value, "__iter__"):
+        return [to_json(entry) for entry in value]
+    # Types like the driver's Date and Duration.
+    return str(value)
+
+
+class TableSchema:
+    """
+    The columns of a table with a codec compiled for each of them, so that items
+    are validated and converted with one lookup per column.
+    """
+
+    def __init__(self, name, partition_key, clustering_key, columns):
+        """
+        :param name: The name of the table.
+        :param partition_key: The names of the partition key columns, in order.
+        :param clustering_key: The names of the clustering columns, in order.
+        :param columns: A dict of the CQL type of every column, in table order.
+        """
+        self.name = name
+        self.partition_key = tuple(partition_key)
+        self.clustering_key = tuple(clustering_key)
+        self.primary_key = self.partition_key + self.clustering_key
+        self.columns = dict(columns)
+        self.regular_columns = tuple(column for column in self.columns if column not in self.primary_key)
+        self.codecs = {column: compile_codec(cql_type) for column, cql_type in self.columns.items()}
+
+    @classmethod
+    def from_metadata(cls, table_metadata):
+        """Builds the schema of a table from the driver's TableMetadata."""
+        return cls(
+            table_metadata.name,
+            [column.name for column in table_metadata.partition_key],
+            [column.name for column in table_metadata.clustering_key],
+            {name: column.cql_type for name, column in table_metadata.columns.items()},
+        )
+
+    def key(self, item):
+        """Returns the primary key of an item, as a value or a tuple for compound keys."""
+        if len(self.primary_key) == 1:
+            return item.get(self.primary_key[0])
+        return tuple(item.get(column) for column in self.primary_key)
+
+    def scalar_columns(self):
+        """Returns the regular columns that are not collections, which have a single write time."""
+        return tuple(
+            column for column in self.regular_columns
+            if parse_type(self.columns[column])[0] not in ("list", "set", "map")
+        )
+
+    def is_partial(self, item):
+        """Whether an item lacks some regular columns of the table."""
+        return any(column not in item for column in self.regular_columns)
+
+    def encode(self, item, operation):
+        """
+        Validates an item and converts its values for the driver.
+
+        :param item: The item of a JSON payload.
+        :param operation: One of insert, update or delete. Deletes only use the primary
+            key, and updates must set at least one regular column.
+        :return: A dict of the converted values, in table order.
+        :raises ValueError: If the item has unknown columns, misses a primary key
+            column, or has a value that does not fit its column type.
+        """
+        unknown = [column for column in item if column not in self.codecs]
+        if unknown:
+            raise ValueError(f"unknown columns for table {self.name}: {', '.join(map(str, unknown))}")
+        missing = [column for column in self.primary_key if item.get(column) is None]
+        if missing:
+            raise ValueError(f"missing primary key columns: {', '.join(missing)}")
+        columns = self.primary_key if operation == "delete" else self.columns
+        values = {}
+        for column in columns:
+            if column not in item:
+                continue
+            value = item[column]
+            try:
+                values[column] = None if value is None else self.codecs[column](value)
+            except ValueError as e:
+                raise ValueError(f"{column} {e}")
+        if operation == "update" and len(values) == len(self.primary_key):
+            raise ValueError("update must set at least one column besides the primary key")
+        return values
+
+    def decode(self, row, columns=None):
+        """Converts a driver row into a JSON item."""
+        columns = columns or self.columns
+        return {column: to_json(getattr(row, column)) for column in columns}
+
+
+# The layout of the product_by_item table, used when the driver has no schema
+# metadata for a table, as with sessions that do not load it.
+PRODUCT_SCHEMA = TableSchema(
+    "product_by_item", ["product_id"], [],
+    {"product_id": "int", "product_name": "text", "product_description": "text"},
+)
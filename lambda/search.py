@@ -0,0 +1,177 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+from cache import TTLCache
+from collection import CollectionClient
+from entities import DEFAULT_ENTITY, document_key, get_entity
+
+logger = logging.getLogger()
+
+MAX_PAGE_SIZE = 100
+SEARCH_FIELDS = ["product_name^2", "product_description"]
+
+# Search results are cached per execution environment, keyed by the entity and the
+# normalized query, and tagged with the document keys they contain.
+_search_cache = TTLCache(
+    max_entries=int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.environ.get("SEARCH_CACHE_TTL", "30")),
+)
+# Written documents become searchable only once the ingestion buffer and the pipeline
+# flushed them and the index refreshed. Until then, searches are still answered from
+# the index as it was before the write.
+SEARCH_CACHE_SETTLE = float(os.environ.get("SEARCH_CACHE_SETTLE", "10"))
+# The time until which the searches of a document key, or of all keys under ALL_KEYS,
+# can still return stale results, in deadline order.
+_settling = OrderedDict()
+ALL_KEYS = "*"
+_collection_client = None
+
+class SearchNotConfiguredError(RuntimeError):
+    """Raised when the function has no collection to search."""
+
+def get_collection_client():
+    """
+    Returns the CollectionClient cached on this execution environment.
+
+    :raises SearchNotConfiguredError: If COLLECTION_ENDPOINT is not set.
+    """
+    global _collection_client
+    if _collection_client is None:
+        collection_endpoint = os.environ.get("COLLECTION_ENDPOINT")
+        if not collection_endpoint:
+            raise SearchNotConfiguredError("COLLECTION_ENDPOINT is not set")
+        _collection_client = CollectionClient(collection_endpoint)
+    return _collection_client
+
+def normalize_params(params, entity=DEFAULT_ENTITY):
+    """
+    Validates the query string parameters of a search and normalizes them, so that
+    equivalent searches share one cache entry.
+
+    :param params: The query string parameters, q, size, from and the primary key
+        columns of the entity, such as product_id.
+    :param entity: The Entity whose index is searched.
+    :return: A tuple of (name, value) pairs.
+    """
+    params = params or {}
+    normalized = {}
+    text = " ".join(str(params.get("q", "")).lower().split())
+    if text:
+        normalized["q"] = text
+    for column in entity.key:
+        if params.get(column) not in (None, ""):
+            normalized[column] = entity.parse_column(column, params[column])
+    size = int(params.get("size", 10))
+    offset = int(params.get("from", 0))
+    if not 0 < size <= MAX_PAGE_SIZE or offset < 0:
+        raise ValueError(f"size must be between 1 and {MAX_PAGE_SIZE} and from must not be negative")
+    normalized["size"] = size
+    normalized["from"] = offset
+    return tuple(sorted(normalized.items()))
+
+def build_query(key, search_fields=SEARCH_FIELDS, key_fields=("product_id",)):
+    """Translates normalized search parameters into an OpenSearch query."""
+    params = dict(key)
+    clauses = []
+    if "q" in params:
+        clauses.append({"multi_match": {"query": params["q"], "fields": search_fields}})
+    for field in key_fields:
+        if field in params:
+            clauses.append({"term": {field: params[field]}})
+    query = {"bool": {"must": clauses}} if clauses else {"match_all": {}}
+    return {"query": query, "size": params["size"], "from": params["from"]}
+
+def search_products(params, entity=DEFAULT_ENTITY):
+    """
+    Searches the index of an entity, serving repeated searches from the cache.
+
+    :param params: The query string parameters of the search.
+    :param entity: The Entity whose index is searched.
+    :return: A (result, cache_hit) tuple.
+    """
+    normalized = normalize_params(params, entity)
+    key = (entity.name, normalized)
+    result = _search_cache.get(key)
+    if result is not None:
+        return result, True
+    with metrics.timer("SearchLatency"):
+        response = get_collection_client().search(
+            entity.index, build_query(normalized, entity.search_fields or SEARCH_FIELDS, tuple(entity.key)),
+        )
+    items = [hit["_source"] for hit in response["hits"]["hits"]]
+    result = {"total": response["hits"]["total"]["value"], "items": items}
+    tags = [(entity.name, entity.key_of(item)) for item in items]
+    _search_cache.put(key, result, tags=tags, ttl=_settle_time(tags))
+    return result, False
+
+def _settle_time(tags):
+    """
+    Returns the seconds until the documents of a search result were written long
+    enough ago to be searchable, or None if they all are. A result read before then
+    may miss a write, so it is only cached until then and read again afterwards.
+    """
+    now = time.monotonic()
+    while _settling and next(iter(_settling.values())) <= now:
+        _settling.popitem(last=False)
+    deadline = max((_settling.get(tag, 0) for tag in (ALL_KEYS, *tags)), default=0)
+    return deadline - now if deadline > now else None
+
+def invalidate(payload_list):
+    """
+    Drops cached searches affected by written payloads. Updates and deletes drop
+    the searches that returned the product, and since a new product may match any
+    cached search, inserts drop the whole cache. The index only reflects a write
+    after SEARCH_CACHE_SETTLE seconds, so searches read in between are cached until
+    then instead of for the TTL. An update can also make a product match searches
+    that did not return it before; those catch up within the TTL.
+    """
+    deadline = time.monotonic() + SEARCH_CACHE_SETTLE
+    for payload in payload_list:
+        tag = ALL_KEYS if payload.get("operation") == "insert" else document_key(payload)
+        _settling[tag] = deadline
+        _settling.move_to_end(tag)
+        if tag == ALL_KEYS:
+            _search_cache.clear()
+            return
+        _search_cache.invalidate_tag(tag)
+
+def handler(event, context):
+    """Handles GET /search requests."""
+    from requests import RequestException
+    params = event.get("queryStringParameters") or {}
+    try:
+        result, cache_hit = search_products(params, get_entity(params.get("entity")))
+    except ValueError as e:
+        return {
+            "statusCode": 400,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": f"Invalid search: {str(e)}"}),
+        }
+    except SearchNotConfiguredError as e:
+        logger.error("## Search is not configured: %s", e)
+        return {
+            "statusCode": 500,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": f"Search is not configured: {str(e)}."}),
+        }
+    except RequestException as e:
+        logger.error("## Search against the collection failed: %s", e)
+        return {
+            "statusCode": 502,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"message": "Search against the collection failed."}),
+        }
+    metrics.put("SearchCacheHits", 1 if cache_hit else 0)
+    logger.info("## Search cache %s, cache stats: %s", "hit" if cache_hit else "miss", _search_cache.stats())
+    return {
+        "statusCode": 200,
+        "headers": {"Content-Type": "application/json", "X-Cache": "Hit" if cache_hit else "Miss"},
+        "body": json.dumps(result),
+    }
@@ -0,0 +1,144 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Checks the write payloads of the API before any request is sent to Amazon Keyspaces
+or the ingestion pipeline, so that malformed requests are answered with a 400 and do
+not use connections or capacity. The schema of every entity is compiled once per
+execution environment.
+"""
+
+import json
+import os
+import time
+
+from entities import ENTITIES
+from ingestion import QueueIngestionSink
+from schema import compile_codec
+
+OPERATIONS = ("insert", "update", "delete")
+# Upper bound on the size of an item as JSON. Rows of Amazon Keyspaces are at most 1 MB.
+MAX_ITEM_BYTES = int(os.environ.get("MAX_ITEM_BYTES", str(1024 * 1024)))
+# In queue mode every document is sent to the ingestion queue as one SQS message, so
+# its item must also leave room for the operation, version and entity of the payload.
+MESSAGE_ENVELOPE_BYTES = 1024
+if os.environ.get("INGESTION_MODE") == "queue":
+    MAX_ITEM_BYTES = min(MAX_ITEM_BYTES, QueueIngestionSink.MAX_MESSAGE_BYTES - MESSAGE_ENVELOPE_BYTES)
+MAX_IDEMPOTENCY_KEY_LENGTH = 256
+# Versions are write timestamps in microseconds. Smaller values are most likely seconds
+# or milliseconds, and a version ahead of the clock would win over every later write
+# of the item until the clock catches up.
+MIN_VERSION = 10 ** 15
+MAX_VERSION_AHEAD_SECONDS = float(os.environ.get("MAX_VERSION_AHEAD_SECONDS", "5"))
+
+
+class PayloadSchema:
+    """
+    The checks of the payloads of one entity: the fields of a payload, the range of
+    its version, the types of its primary key columns and the size of its item. The
+    other columns are checked against the table when the item is written.
+    """
+
+    def __init__(self, entity, max_item_bytes=MAX_ITEM_BYTES, min_version=MIN_VERSION, max_version_ahead=MAX_VERSION_AHEAD_SECONDS):
+        """
+        :param entity: The Entity the payloads are written to.
+        :param max_item_bytes: The maximum size of an item as JSON.
+        :param min_version: The smallest accepted version, in microseconds.
+        :param max_version_ahead: The seconds a version may be ahead of the clock.
+        """
+        self.entity = entity
+        self.key_codecs = {column: compile_codec(cql_type) for column, cql_type in entity.key.items()}
+        self.max_item_bytes = max_item_bytes
+        self.min_version = min_version
+        self.max_version_ahead = max_version_ahead
+        self.max_version_skew = int(max_version_ahead * 1000000)
+
+    def check_operation(self, payload):
+        """
+        Checks one write payload.
+
+        :return: None if the payload is valid, otherwise an error message.
+        """
+        if not isinstance(payload, dict):
+            return "operation must be a JSON object"
+        if payload.get("operation") not in OPERATIONS:
+            return "operation must be one of the following: insert, update or delete"
+        item = payload.get("item")
+        if not isinstance(item, dict):
+            return "item must be a JSON object"
+        version = payload.get("version")
+        if version is not None:
+            error = self.check_version(version)
+            if error:
+                return error
+        idempotency_key = payload.get("idempotency_key")
+        if idempotency_key is not None and (not isinstance(idempotency_key, str) or not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH):
+            return f"idempotency_key must be a string of 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+        for column, codec in self.key_codecs.items():
+            value = item.get(column)
+            if value is None:
+                return f"item must have the primary key column {column} of {self.entity.name}"
+            try:
+                codec(value)
+            except ValueError as e:
+                return f"item {column} {e}"
+        # Sized like the ingestion queue encodes it.
+        if len(json.dumps(item)) > self.max_item_bytes:
+            return f"item is larger than {self.max_item_bytes} bytes"
+        return None
+
+    def check_version(self, version):
+        """
+        Checks the version of a payload: a write timestamp in microseconds since the
+        epoch, at most max_version_ahead seconds ahead of the clock.
+
+        :return: None if the version is valid, otherwise an error message.
+        """
+        if not isinstance(version, int) or isinstance(version, bool):
+            return "version must be an integer, the write timestamp in microseconds"
+        if version < self.min_version:
+            return "version must be the write timestamp in microseconds since the epoch"
+        if version > time.time_ns() // 1000 + self.max_version_skew:
+            return f"version must not be more than {self.max_version_ahead:g} seconds ahead of the clock"
+        return None
+
+    def check_batch(self, body, max_operations):
+        """
+        Checks the operations of a batch payload.
+
+        :return: An error message, or None if the batch is valid, and a list of the
+            errors of the invalid operations, by index.
+        """
+        operations = body.get("operations")
+        if not isinstance(operations, list) or not 0 < len(operations) <= max_operations:
+            return f"operations must be a list of between 1 and {max_operations} operations", []
+        errors = []
+        for index, operation in enumerate(operations):
+            error = self.check_operation(operation)
+            if error:
+                errors.append({"index": index, "message": error})
+        if errors:
+            return "Invalid operations in batch.", errors
+        return None, []
+
+
+def check_body(body):
+    """
+    Checks the fields shared by all JSON bodies, before the entity is looked up.
+
+    :return: None if the body is valid, otherwise an error message.
+    """
+    if not isinstance(body, dict):
+        return "the body must be a JSON object"
+    entity = body.get("entity")
+    if entity is not None and not isinstance(entity, str):
+        return "entity must be a string"
+    return None
+
+
+SCHEMAS = {name: PayloadSchema(entity) for name, entity in ENTITIES.items()}
+
+
+def get_schema(entity):
+    """Returns the compiled PayloadSchema of an entity."""
+    return SCHEMAS[entity.name]
@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+LAMBDA_DIR = os.path.join(ROOT_DIR, "lambda")
+for path in (ROOT_DIR, LAMBDA_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# The Lambda modules create their AWS clients lazily, but still need a region.
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,62 @@
+import pytest
+
+import backfill
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.text = "" if status_code == 200 else "failed"
+
+
+class FailingIngestionClient:
+    """Accepts requests until it was asked to fail, and records the ingested items."""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.requests = 0
+        self.items = []
+
+    def post(self, payload_list):
+        self.requests += 1
+        if self.fail_after is not None and self.requests > self.fail_after:
+            return Response(500)
+        self.items.extend((payload["item"]["product_id"], payload["item"]["review_id"]) for payload in payload_list)
+        return Response(200)
+
+
+class ScanQueryManager:
+    """Scans rows of a table with a clustering column, sorted by token like Keyspaces."""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows)
+
+    def split_token_ring(self, count):
+        return [(0, 100)]
+
+    def scan_token_range(self, table_name, start, end, fetch_size=1000):
+        for token, product_id, review_id in self.rows:
+            if start < token <= end:
+                yield token, {"product_id": product_id, "review_id": review_id}, 1
+
+
+def test_completed_token_skips_the_last_partition():
+    batch = [(5, {}, 1), (7, {}, 1), (7, {}, 1)]
+    assert backfill.completed_token(batch, 1) == 5
+    assert backfill.completed_token([(7, {}, 1), (7, {}, 1)], 1) == 1
+
+
+def test_resume_keeps_the_rows_of_a_partition_split_across_batches(tmp_path):
+    # Partition 2 has three rows, so the batches of two rows end in its middle.
+    rows = [(10, 1, 1), (20, 2, 1), (20, 2, 2), (20, 2, 3), (30, 3, 1)]
+    qm = ScanQueryManager(rows)
+    checkpoint_file = str(tmp_path / "backfill.json")
+
+    failing = FailingIngestionClient(fail_after=1)
+    with pytest.raises(Exception):
+        backfill.backfill(qm, failing, "reviews.review_by_product", ranges=1, workers=1, batch_size=2, checkpoint_file=checkpoint_file)
+
+    resumed = FailingIngestionClient()
+    backfill.backfill(qm, resumed, "reviews.review_by_product", ranges=1, workers=1, batch_size=2, checkpoint_file=checkpoint_file)
+    ingested = set(failing.items) | set(resumed.items)
+    assert ingested == {(product_id, review_id) for _, product_id, review_id in rows}
@@ -0,0 +1,107 @@
+import pytest
+
+import cdc
+
+
+def cell(value, write_time="1700000000000000"):
+    return {"value": value, "metadata": {"writeTime": write_time}}
+
+
+# A change record shaped like those of keyspacesstreams GetRecords: the elements of
+# lists, sets and tuples are cells of their own, the entries of maps are typed values.
+RECORD = {
+    "sequenceNumber": "49",
+    "partitionKeys": {"product_id": {"intT": "100"}},
+    "clusteringKeys": {"variant": {"textT": "red"}},
+    "newImage": {
+        "valueCells": {
+            "product_name": cell({"textT": "Reindeer sweater"}),
+            "price": cell({"doubleT": "39.5"}),
+            "sizes": cell({"listT": [
+                {"value": {"intT": "1"}, "metadata": {"writeTime": "1700000000000000"}},
+                {"value": {"intT": "2"}, "metadata": {}}
+            ]}),
+            "tags": cell({"setT": [{"value": {"textT": "wool"}, "metadata": {}}, {"value": {"textT": "winter"}}]}),
+            "dimensions": cell({"tupleT": [{"value": {"floatT": "1.5"}}, {"value": {"boolT": True}}, {}]}),
+            "stock": cell({"mapT": [
+                {"key": {"textT": "berlin"}, "value": {"intT": "3"}, "metadata": {}},
+                {"key": {"textT": "paris"}, "value": {"intT": "0"}, "metadata": {}}
+            ]}),
+            "supplier": cell({"udtT": {"name": {"value": {"textT": "Acme"}}, "rating": {"value": {"intT": "4"}}}})
+        }
+    }
+}
+
+
+def test_change_to_document_converts_collection_cells():
+    document = cdc.change_to_document(RECORD)
+    assert document == {
+        "operation": "insert",
+        "item": {
+            "product_id": 100,
+            "variant": "red",
+            "product_name": "Reindeer sweater",
+            "price": 39.5,
+            "sizes": [1, 2],
+            "tags": ["wool", "winter"],
+            "dimensions": [1.5, True, None],
+            "stock": {"berlin": 3, "paris": 0},
+            "supplier": {"name": "Acme", "rating": 4}
+        },
+        "version": 1700000000000000
+    }
+
+
+def test_change_without_new_image_is_a_delete():
+    record = {"partitionKeys": RECORD["partitionKeys"], "clusteringKeys": RECORD["clusteringKeys"], "newImage": None}
+    document = cdc.change_to_document(record)
+    assert document["operation"] == "delete"
+    assert document["item"] == {"product_id": 100, "variant": "red"}
+
+
+def test_failed_ingestion_raises_ingestion_error(monkeypatch):
+    class Response:
+        status_code = 400
+        text = "rejected"
+
+    class Client:
+        def post(self, payload_list):
+            return Response()
+
+    monkeypatch.setitem(cdc._clients, "ingestion", Client())
+    with pytest.raises(cdc.IngestionError) as error:
+        cdc.ingest([{"operation": "insert", "item": {"product_id": 1}}])
+    assert error.value.status_code == 400
+
+
+def test_missing_stream_raises_stream_not_found(monkeypatch):
+    class Streams:
+        def list_streams(self, **kwargs):
+            return {"streams": []}
+
+    monkeypatch.setitem(cdc._clients, "keyspacesstreams", Streams())
+    with pytest.raises(cdc.StreamNotFoundError):
+        cdc.get_stream_arn("productsearch", "product_by_item")
+
+
+class CheckpointTable:
+    """Mimics the get_item and put_item calls of the DynamoDB checkpoint table."""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        item = self.items.get(Key["shard_id"]["S"])
+        return {"Item": item} if item else {}
+
+    def put_item(self, TableName, Item):
+        self.items[Item["shard_id"]["S"]] = Item
+
+
+def test_checkpoints_of_equal_shard_ids_on_different_streams_are_kept_apart(monkeypatch):
+    monkeypatch.setattr(cdc, "_clients", {"dynamodb": CheckpointTable()})
+    cdc.put_checkpoint("checkpoints", "arn:stream/products", "shard-1", "100")
+    cdc.put_checkpoint("checkpoints", "arn:stream/reviews", "shard-1", "7")
+    assert cdc.get_checkpoint("checkpoints", "arn:stream/products", "shard-1") == "100"
+    assert cdc.get_checkpoint("checkpoints", "arn:stream/reviews", "shard-1") == "7"
+    assert cdc.get_checkpoint("checkpoints", "arn:stream/products", "shard-2") is None
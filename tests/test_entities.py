@@ -0,0 +1,24 @@
+import pytest
+
+from entities import Entity, default_entity
+
+REVIEW = Entity(
+    name="review", keyspace="productsearch", table="review_by_product", index="reviews",
+    key={"product_id": "int", "rating": "double", "review_id": "text"}, search_fields=[],
+)
+
+
+def test_parse_key():
+    assert default_entity().parse_key("100") == 100
+    assert REVIEW.parse_key("100:4.5:abc") == (100, 4.5, "abc")
+
+
+@pytest.mark.parametrize("text, message", [
+    ("abc:4.5:x", "product_id must be an integer"),
+    ("1:high:x", "rating must be a number"),
+    ("1:2", "keys of review have the columns product_id:rating:review_id"),
+])
+def test_parse_key_errors_name_the_column(text, message):
+    with pytest.raises(ValueError) as e:
+        REVIEW.parse_key(text)
+    assert str(e.value) == message
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from benchmarks.standins import IngestionStub, fake_query_manager
+
+import index
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """Runs the API handler against a FakeSession and an ingestion stub, in sync mode."""
+    qm = fake_query_manager(latency=0)
+    with IngestionStub(latency=0) as stub:
+        monkeypatch.setattr(index, "INGESTION_MODE", "sync")
+        monkeypatch.setattr(index, "_query_manager", qm)
+        monkeypatch.setattr(index, "_idempotency_cache", index.TTLCache())
+        monkeypatch.setattr(index, "function_settings", lambda: ("productsearch", stub.endpoint))
+        monkeypatch.setattr(index, "get_tls_cert", lambda: None)
+
+        def post(body, headers=None):
+            text = body if isinstance(body, str) else json.dumps(body)
+            response = index.handler({"httpMethod": "POST", "resource": "/", "body": text, "headers": headers or {}}, None)
+            return response["statusCode"], json.loads(response["body"])
+
+        post.session = qm.session
+        yield post
+
+
+def writes(session):
+    return session.round_trips - session.prepares
+
+
+def test_single_operation_with_a_retried_idempotency_key_is_written_once(api):
+    body = {"operation": "insert", "item": {"product_id": 1, "product_name": "a"}, "idempotency_key": "k1"}
+    status_code, _ = api(body)
+    assert status_code == 200
+    written = writes(api.session)
+
+    status_code, response = api(body)
+    assert status_code == 200
+    assert "Duplicate" in response["message"]
+    assert writes(api.session) == written
+
+    # The keys are shared with the operations of batches.
+    status_code, response = api({"operations": [body]})
+    assert status_code == 200
+    assert response["duplicates"] == 1
+    assert writes(api.session) == written
+
+
+def test_single_operation_key_is_recorded_only_when_it_succeeded(api, monkeypatch):
+    body = {"operation": "insert", "item": {"product_id": 2, "product_name": "b"}, "idempotency_key": "k2"}
+    monkeypatch.setattr(api.session, "throttle_rate", 1.0)
+    status_code, _ = api(body)
+    assert status_code != 200
+
+    monkeypatch.setattr(api.session, "throttle_rate", 0.0)
+    status_code, response = api(body)
+    assert status_code == 200
+    assert "Duplicate" not in response["message"]
+
+
+@pytest.mark.parametrize("version", [1700000000, 10 ** 18])
+def test_implausible_versions_are_rejected_on_every_write_path(api, version):
+    operation = {"operation": "insert", "item": {"product_id": 3, "product_name": "c"}, "version": version}
+    written = writes(api.session)
+
+    status_code, response = api(operation)
+    assert status_code == 400
+    assert "version" in response["message"]
+
+    status_code, response = api({"operations": [operation]})
+    assert status_code == 400
+    assert "version" in response["errors"][0]["message"]
+
+    status_code, response = api(json.dumps(operation) + "\n", headers={"Content-Type": "application/x-ndjson"})
+    assert "version" in response["results"][0]["message"]
+    assert response["results"][0]["statusCode"] == 400
+
+    assert writes(api.session) == written
+
+
+def test_out_of_range_keys_are_rejected_before_the_write(api):
+    written = writes(api.session)
+    status_code, response = api({"operation": "insert", "item": {"product_id": 2 ** 40, "product_name": "d"}})
+    assert status_code == 400
+    assert "product_id" in response["message"]
+    assert writes(api.session) == written
+
+
+def test_an_unreachable_keyspace_is_answered_with_a_503(api, monkeypatch):
+    from cassandra.cluster import NoHostAvailable
+    import query
+
+    def connect(self):
+        raise NoHostAvailable("Unable to connect to any servers", {})
+
+    monkeypatch.setattr(index, "_query_manager", None)
+    monkeypatch.setattr(query.QueryManager, "connect", connect)
+    status_code, response = api({"operation": "insert", "item": {"product_id": 4, "product_name": "e"}})
+    assert status_code == 503
+    assert "not reachable" in response["message"]
+    assert index._query_manager is None
+
+
+def test_idempotency_key_header_replays_only_the_same_request(api):
+    headers = {"Idempotency-Key": "request-1"}
+    body = {"operation": "insert", "item": {"product_id": 5, "product_name": "f"}}
+    assert api(body, headers)[0] == 200
+    written = writes(api.session)
+
+    status_code, response = api(body, headers)
+    assert status_code == 200
+    assert writes(api.session) == written
+
+    status_code, response = api({"operation": "insert", "item": {"product_id": 6, "product_name": "g"}}, headers)
+    assert status_code == 422
+    assert "different request" in response["message"]
+    assert writes(api.session) == written
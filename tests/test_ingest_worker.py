@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import ingest_worker
+
+
+class Response:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class Client:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def post(self, payload_list):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+
+@pytest.fixture
+def dead_letters(monkeypatch):
+    dead_letters = []
+    monkeypatch.setattr(ingest_worker, "_dead_letter_sink", lambda payload_list, reason: dead_letters.append((payload_list, reason)))
+    return dead_letters
+
+
+def event():
+    payloads = [{"operation": "insert", "item": {"product_id": 1}, "version": 1}]
+    return {"Records": [{"messageId": "m1", "body": json.dumps(payloads)}]}
+
+
+def test_payloads_rejected_by_the_pipeline_are_dead_lettered(monkeypatch, dead_letters):
+    monkeypatch.setattr(ingest_worker, "_ingestion_client", Client(Response(400, "mapper_parsing_exception")))
+    assert ingest_worker.handler(event(), None) == {"batchItemFailures": []}
+    assert dead_letters[0][1] == "HTTP 400: mapper_parsing_exception"
+
+
+def test_payloads_failing_validation_with_an_exception_are_dead_lettered(monkeypatch, dead_letters):
+    monkeypatch.setattr(ingest_worker, "_ingestion_client", Client(ValueError("payload is not serializable")))
+    assert ingest_worker.handler(event(), None) == {"batchItemFailures": []}
+    assert dead_letters[0][1] == "ValueError: payload is not serializable"
+
+
+def test_transient_failures_are_delivered_again(monkeypatch, dead_letters):
+    monkeypatch.setattr(ingest_worker, "_ingestion_client", Client(Response(503)))
+    assert ingest_worker.handler(event(), None) == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert dead_letters == []
+
+
+def test_programming_errors_are_not_dead_lettered(monkeypatch, dead_letters):
+    monkeypatch.setattr(ingest_worker, "_ingestion_client", Client(KeyError("item")))
+    assert ingest_worker.handler(event(), None) == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+    assert dead_letters == []
+
+
+class RecordingClient:
+    def __init__(self):
+        self.payloads = []
+
+    def post(self, payload_list):
+        self.payloads.extend(payload_list)
+        return Response(200)
+
+
+def test_malformed_messages_fail_alone(monkeypatch, dead_letters):
+    client = RecordingClient()
+    monkeypatch.setattr(ingest_worker, "_ingestion_client", client)
+    records = event()["Records"] + [
+        {"messageId": "m2", "body": "{not json"},
+        {"messageId": "m3", "body": json.dumps({"operation": "insert"})},
+        {"messageId": "m4", "body": json.dumps([{"operation": "delete", "item": {"product_id": 2}, "version": 2}])},
+    ]
+    assert ingest_worker.handler({"Records": records}, None) == {
+        "batchItemFailures": [{"itemIdentifier": "m2"}, {"itemIdentifier": "m3"}],
+    }
+    assert [payload["item"]["product_id"] for payload in client.payloads] == [1, 2]
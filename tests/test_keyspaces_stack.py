@@ -0,0 +1,96 @@
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Match, Template
+
+from cdk_stacks import OpsKeyspacesStack
+from cdk_stacks.entities import DEFAULT_ENTITIES
+
+TABLE = "AWS::Cassandra::Table"
+
+
+def template(**context):
+    return Template.from_stack(OpsKeyspacesStack(cdk.App(context=context), "OpsKeyspacesStack"))
+
+
+def test_tables_are_on_demand_without_ttl_or_recovery_by_default():
+    template().has_resource_properties(TABLE, {
+        "TableName": "product_by_item",
+        "ClientSideTimestampsEnabled": True,
+        "BillingMode": Match.absent(),
+        "AutoScalingSpecifications": Match.absent(),
+        "WarmThroughput": Match.absent(),
+        "DefaultTimeToLive": Match.absent(),
+        "PointInTimeRecoveryEnabled": Match.absent(),
+    })
+
+
+def test_provisioned_capacity_with_auto_scaling():
+    options = {
+        "capacity_mode": "provisioned", "read_capacity_units": 10, "write_capacity_units": 20,
+        "auto_scaling": True, "max_read_capacity_units": 100, "max_write_capacity_units": 200,
+        "target_utilization": 60,
+    }
+    template(table_options=options).has_resource_properties(TABLE, {
+        "BillingMode": {
+            "Mode": "PROVISIONED",
+            "ProvisionedThroughput": {"ReadCapacityUnits": 10, "WriteCapacityUnits": 20},
+        },
+        "AutoScalingSpecifications": {
+            # The minimum defaults to the provisioned capacity.
+            "ReadCapacityAutoScaling": Match.object_like({
+                "MinimumUnits": 10, "MaximumUnits": 100,
+                "ScalingPolicy": {"TargetTrackingScalingPolicyConfiguration": Match.object_like({"TargetValue": 60})},
+            }),
+            "WriteCapacityAutoScaling": Match.object_like({"MinimumUnits": 20, "MaximumUnits": 200}),
+        },
+    })
+
+
+def test_warm_throughput_ttl_and_recovery():
+    options = {"warm_write_units_per_second": 50000, "default_ttl": 86400, "point_in_time_recovery": True}
+    template(table_options=options).has_resource_properties(TABLE, {
+        "BillingMode": Match.absent(),
+        "WarmThroughput": {"WriteUnitsPerSecond": 50000},
+        "DefaultTimeToLive": 86400,
+        "PointInTimeRecoveryEnabled": True,
+    })
+
+
+def test_entity_table_options_override_the_shared_ones():
+    entities = [
+        DEFAULT_ENTITIES[0],
+        {
+            "name": "review", "keyspace": "productsearch", "table": "review_by_product", "index": "reviews",
+            "partition_key": [{"name": "product_id", "type": "int"}],
+            "clustering_key": [{"name": "review_id", "type": "text"}],
+            "table_options": {"capacity_mode": "provisioned", "read_capacity_units": 5, "write_capacity_units": 5},
+        },
+    ]
+    stack = template(entities=entities, table_options={"point_in_time_recovery": True})
+    stack.resource_count_is(TABLE, 2)
+    stack.has_resource_properties(TABLE, {"TableName": "product_by_item", "BillingMode": Match.absent(), "PointInTimeRecoveryEnabled": True})
+    stack.has_resource_properties(TABLE, {
+        "TableName": "review_by_product",
+        "BillingMode": {"Mode": "PROVISIONED", "ProvisionedThroughput": {"ReadCapacityUnits": 5, "WriteCapacityUnits": 5}},
+        "PointInTimeRecoveryEnabled": True,
+    })
+
+
+@pytest.mark.parametrize("options", [
+    {"capacity_mode": "serverless"},
+    {"capacity_mode": "provisioned", "read_capacity_units": 10},
+    {"read_capacity_units": 10},
+    {"auto_scaling": True},
+    {"capacity_mode": "provisioned", "read_capacity_units": 10, "write_capacity_units": 10, "auto_scaling": True},
+    {"capacity_mode": "provisioned", "read_capacity_units": 10, "write_capacity_units": 10, "auto_scaling": True,
+     "max_read_capacity_units": 5, "max_write_capacity_units": 100},
+    {"capacity_mode": "provisioned", "read_capacity_units": 10, "write_capacity_units": 10, "auto_scaling": True,
+     "max_read_capacity_units": 100, "max_write_capacity_units": 100, "target_utilization": 95},
+    {"warm_read_units_per_second": 0},
+    {"default_ttl": -1},
+    {"point_in_time_recovery": "yes"},
+    {"billing_mode": "PROVISIONED"},
+])
+def test_invalid_table_options_are_rejected(options):
+    with pytest.raises(ValueError):
+        template(table_options=options)
@@ -0,0 +1,89 @@
+import aws_cdk as cdk
+import pytest
+import yaml
+
+from cdk_stacks.entities import DEFAULT_ENTITIES
+from cdk_stacks.pipeline_config import pipeline_configuration, pipeline_settings_from_context
+
+REVIEW = {
+    "name": "review",
+    "keyspace": "productsearch",
+    "table": "review_by_product",
+    "index": "reviews",
+    "partition_key": [{"name": "product_id", "type": "int"}],
+    "clustering_key": [{"name": "review_id", "type": "text"}],
+    "columns": [{"name": "review_text", "type": "text"}],
+}
+
+
+def settings(**context):
+    return pipeline_settings_from_context(cdk.App(context=context).node)
+
+
+def pipeline(entities, pipeline_settings):
+    body = pipeline_configuration(entities, pipeline_settings, "arn:aws:iam::123456789012:role/pipeline", "https://collection", "us-east-1")
+    return yaml.safe_load(body)["product-pipeline"]
+
+
+def test_default_pipeline():
+    config = pipeline(DEFAULT_ENTITIES, settings())
+    assert "workers" not in config and "buffer" not in config
+    assert "compression" not in config["source"]["http"]
+    sink, = config["sink"]
+    assert sink["opensearch"]["flush_timeout"] == -1
+    assert "bulk_size" not in sink["opensearch"]
+
+
+def test_tuned_settings_reach_the_pipeline():
+    tuned = {
+        "workers": 4, "delay": 50, "buffer_size": 4096, "batch_size": 512,
+        "bulk_size": 10, "max_retries": 5, "flush_timeout": 1000, "compression": "gzip",
+    }
+    config = pipeline(DEFAULT_ENTITIES, settings(pipeline=tuned))
+    assert config["workers"] == 4
+    assert config["delay"] == 50
+    assert config["buffer"] == {"bounded_blocking": {"buffer_size": 4096, "batch_size": 512}}
+    assert config["source"]["http"]["compression"] == "gzip"
+    sink = config["sink"][0]["opensearch"]
+    assert (sink["bulk_size"], sink["max_retries"], sink["flush_timeout"]) == (10, 5, 1000)
+
+
+def test_settings_are_read_from_a_json_string_and_ingestion_compression():
+    assert settings(pipeline='{"workers": 2}')["workers"] == 2
+    assert settings(ingestion_compression="gzip")["compression"] == "gzip"
+    assert settings(pipeline={"compression": "none"}, ingestion_compression="gzip")["compression"] == "none"
+
+
+def test_every_entity_has_a_route_and_an_externally_versioned_sink():
+    config = pipeline(DEFAULT_ENTITIES + [REVIEW], settings())
+    assert config["route"] == [{"product": '/entity == "product"'}, {"review": '/entity == "review"'}]
+    sinks = {sink["opensearch"]["routes"][0]: sink["opensearch"] for sink in config["sink"]}
+    assert sinks["product"]["index"] == "products"
+    assert sinks["product"]["document_id_field"] == "item/product_id"
+    assert sinks["review"]["index"] == "reviews"
+    assert sinks["review"]["document_id_field"] == "document_id"
+    for sink in sinks.values():
+        assert sink["document_version"] == "${/version}"
+        assert sink["document_version_type"] == "external"
+    # Compound keys are joined into the document ID of their entity only.
+    entries = config["processor"][1]["add_entries"]["entries"]
+    assert entries[0] == {"key": "entity", "value": "product"}
+    assert entries[1] == {"key": "document_id", "format": "${/item/product_id}#${/item/review_id}", "add_when": '/entity == "review"'}
+
+
+@pytest.mark.parametrize("pipeline_settings", [
+    {"workers": 0},
+    {"workers": "4"},
+    {"delay": -1},
+    {"min_units": 4, "max_units": 2},
+    {"max_units": 97},
+    {"buffer_size": 4096},
+    {"buffer_size": 256, "batch_size": 512},
+    {"bulk_size": 101},
+    {"flush_timeout": -2},
+    {"compression": "zstd"},
+    {"threads": 4},
+])
+def test_invalid_settings_are_rejected(pipeline_settings):
+    with pytest.raises(ValueError):
+        settings(pipeline=pipeline_settings)
@@ -0,0 +1,153 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from cassandra.cluster import NoHostAvailable
+
+import query
+
+
+class UnreachableCluster:
+    """A Cluster whose keyspace cannot be connected to, recording whether it was shut down."""
+
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.connection_class = type("Connection", (), {})
+        self.shut_down = False
+        UnreachableCluster.instances.append(self)
+
+    def connect(self, keyspace=None):
+        raise NoHostAvailable("Unable to connect to any servers", {})
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+def test_a_cluster_that_fails_to_connect_is_shut_down(monkeypatch):
+    monkeypatch.setattr(query, "Cluster", UnreachableCluster)
+    monkeypatch.setattr(query, "ssl_context", lambda cert_file_path: None)
+    qm = query.QueryManager(None, SimpleNamespace(region_name="us-east-1"), "productsearch")
+
+    with pytest.raises(NoHostAvailable):
+        qm.connect()
+
+    assert UnreachableCluster.instances[-1].shut_down
+    assert qm.cluster is None and qm.session is None
+
+
+class ManualFuture:
+    """A ResponseFuture that completes when the test says so, once per page."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callbacks(self, callback, errback):
+        self.callbacks.append(callback)
+
+    def complete(self, pages=1):
+        for _ in range(pages):
+            for callback in self.callbacks:
+                callback([])
+
+
+class RecordingSession:
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.futures = []
+
+    def execute_async(self, statement, parameters=None):
+        if self.error is not None:
+            raise self.error
+        future = ManualFuture()
+        self.futures.append(future)
+        return future
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_requests_go_to_the_session_with_the_fewest_in_flight():
+    first, second = RecordingSession("first"), RecordingSession("second")
+    pool = query.SessionPool(None, [first, second], max_sessions=2)
+
+    futures = [pool.execute_async("SELECT") for _ in range(3)]
+    assert (len(first.futures), len(second.futures)) == (2, 1)
+    assert pool.in_flight == [2, 1]
+
+    # Completing both requests of the first session makes it the least loaded one.
+    futures[0].complete()
+    futures[2].complete()
+    pool.execute_async("SELECT")
+    assert (len(first.futures), len(second.futures)) == (3, 1)
+    pool.execute_async("SELECT")
+    pool.execute_async("SELECT")
+    assert pool.in_flight == [2, 2]
+    assert pool.stats()["requests"] == 6
+
+
+def test_paged_requests_are_released_once():
+    session = RecordingSession("only")
+    pool = query.SessionPool(None, [session])
+    future = pool.execute_async("SELECT")
+    future.complete(pages=3)
+    assert pool.in_flight == [0]
+
+
+def test_failed_sends_are_released():
+    pool = query.SessionPool(None, [RecordingSession("broken", error=RuntimeError("closed"))])
+    with pytest.raises(RuntimeError):
+        pool.execute_async("SELECT")
+    assert pool.in_flight == [0]
+
+
+def test_pool_expands_in_the_background_near_capacity():
+    opened = []
+
+    def connect():
+        opened.append(RecordingSession(f"extra-{len(opened)}"))
+        return opened[-1]
+
+    first = RecordingSession("first")
+    pool = query.SessionPool(connect, [first], max_sessions=2, max_requests_per_connection=5, expand_threshold=0.8)
+
+    # Below 80% of 5 requests in flight the pool keeps one session.
+    for _ in range(3):
+        pool.execute_async("SELECT")
+    assert pool.stats()["expansions"] == 0
+
+    # The fourth request reaches the threshold and opens another session.
+    pool.execute_async("SELECT")
+    wait_for(lambda: pool.stats()["sessions"] == 2)
+    assert pool.stats()["expansions"] == 1
+
+    # New requests now go to the idle session, and the pool does not grow past max_sessions.
+    for _ in range(4):
+        pool.execute_async("SELECT")
+    assert len(opened[0].futures) == 4
+    time.sleep(0.05)
+    assert len(opened) == 1
+    assert pool.stats()["sessions"] == 2
+
+
+def test_failed_expansions_are_retried_later():
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("no host available")
+        return RecordingSession("extra")
+
+    pool = query.SessionPool(connect, [RecordingSession("first")], max_sessions=2, max_requests_per_connection=2, expand_threshold=0.5)
+    pool.execute_async("SELECT")
+    wait_for(lambda: len(attempts) == 1 and not pool._expanding)
+    assert pool.stats()["sessions"] == 1
+
+    pool.execute_async("SELECT")
+    wait_for(lambda: pool.stats()["sessions"] == 2)
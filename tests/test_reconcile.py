@@ -0,0 +1,118 @@
+import asyncio
+
+from benchmarks.standins import SearchStub, fake_query_manager
+
+from collection import CollectionClient
+from entities import Entity, default_entity
+import reconcile
+
+PRODUCT = default_entity()
+REVIEW = Entity(
+    name="review", keyspace="productsearch", table="review_by_product", index="reviews",
+    key={"product_id": "int", "review_id": "text"}, search_fields=["review_text"],
+)
+
+
+def product(product_id, name):
+    return {"product_id": product_id, "product_name": name, "product_description": f"{name} description"}
+
+
+def table_scan(qm, entity):
+    def table_items():
+        for start, end in qm.split_token_ring(4):
+            for _, item, version in qm.scan_token_range(entity.table_name, start, end):
+                yield {**item, reconcile.VERSION_FIELD: version}
+    return table_items
+
+
+def test_reconcile_repairs_missing_extra_and_stale_documents():
+    qm = fake_query_manager(latency=0)
+    for product_id in range(1, 21):
+        asyncio.run(qm.execute_write_async(PRODUCT.table_name, "insert", product(product_id, "Widget"), version=1000 + product_id))
+    fields = list(qm.table_schema(PRODUCT.table_name).columns)
+    documents = {str(product_id): product(product_id, "Widget") for product_id in range(1, 21)}
+    # Product 3 is missing, product 7 is stale and product 99 is not in the table anymore.
+    del documents["3"]
+    documents["7"] = product(7, "Old widget")
+    documents["99"] = product(99, "Gone")
+
+    with SearchStub(documents) as stub:
+        collection = CollectionClient(stub.endpoint)
+        repairs = list(reconcile.reconcile(
+            table_scan(qm, PRODUCT), lambda: collection.scan(PRODUCT.index, list(PRODUCT.key), fields=fields, page_size=5),
+            PRODUCT, fields, buckets=8, max_rows_in_memory=5,
+        ))
+
+    inserts = sorted((r for r in repairs if r["operation"] == "insert"), key=lambda r: r["item"]["product_id"])
+    deletes = [r for r in repairs if r["operation"] == "delete"]
+    assert [r["item"] for r in inserts] == [product(3, "Widget"), product(7, "Widget")]
+    # Repairs are versioned by the write timestamps of the rows.
+    assert [r["version"] for r in inserts] == [1003, 1007]
+    assert [r["item"] for r in deletes] == [{"product_id": 99}]
+    assert all(r["entity"] == "product" for r in repairs)
+
+
+def test_reconcile_finds_no_repairs_when_in_sync():
+    qm = fake_query_manager(latency=0)
+    for product_id in range(1, 11):
+        asyncio.run(qm.execute_write_async(PRODUCT.table_name, "insert", product(product_id, "Widget")))
+    fields = list(qm.table_schema(PRODUCT.table_name).columns)
+    documents = [product(product_id, "Widget") for product_id in range(1, 11)]
+
+    assert list(reconcile.reconcile(table_scan(qm, PRODUCT), lambda: iter(documents), PRODUCT, fields, buckets=4)) == []
+
+
+def test_reconcile_compound_keys():
+    fields = ["product_id", "review_id", "review_text"]
+    rows = [
+        {"product_id": 1, "review_id": "a", "review_text": "good"},
+        {"product_id": 1, "review_id": "b", "review_text": "bad"},
+        {"product_id": 2, "review_id": "a", "review_text": "fine"},
+    ]
+    documents = [
+        {"product_id": 1, "review_id": "a", "review_text": "good"},
+        {"product_id": 1, "review_id": "b", "review_text": "great"},
+        {"product_id": 2, "review_id": "b", "review_text": "gone"},
+    ]
+
+    repairs = list(reconcile.reconcile(lambda: iter(rows), lambda: iter(documents), REVIEW, fields, buckets=4))
+
+    assert sorted((r["operation"], r["item"]["product_id"], r["item"]["review_id"]) for r in repairs) == [
+        ("delete", 2, "b"), ("insert", 1, "b"), ("insert", 2, "a"),
+    ]
+    delete, = [r for r in repairs if r["operation"] == "delete"]
+    assert delete["item"] == {"product_id": 2, "review_id": "b"}
+    assert all(r["entity"] == "review" for r in repairs)
+
+
+def test_each_side_is_streamed_at_most_twice():
+    fields = ["product_id", "product_name", "product_description"]
+    rows = [product(product_id, "Widget") for product_id in range(1, 201)]
+    # Every document is stale, so every bucket differs and the rows need many groups.
+    documents = [product(product_id, "Old widget") for product_id in range(1, 201)]
+    streams = {"table": 0, "index": 0}
+
+    def side(name, items):
+        def stream():
+            streams[name] += 1
+            return iter(items)
+        return stream
+
+    repairs = list(reconcile.reconcile(side("table", rows), side("index", documents), PRODUCT, fields, buckets=64, max_rows_in_memory=10))
+
+    assert sorted(r["item"]["product_id"] for r in repairs) == list(range(1, 201))
+    assert all(r["operation"] == "insert" for r in repairs)
+    assert streams == {"table": 2, "index": 2}
+
+
+def test_sides_in_sync_are_streamed_once():
+    fields = ["product_id", "product_name", "product_description"]
+    rows = [product(product_id, "Widget") for product_id in range(1, 11)]
+    streams = []
+
+    def stream():
+        streams.append(1)
+        return iter(rows)
+
+    assert list(reconcile.reconcile(stream, stream, PRODUCT, fields, buckets=8)) == []
+    assert len(streams) == 2
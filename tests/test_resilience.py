@@ -0,0 +1,26 @@
+import pytest
+
+from resilience import FATAL, THROTTLING, TRANSIENT, VALIDATION, classify, status_code_for
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize("outcome, category", [
+    (ValueError("item product_id must be an integer"), VALIDATION),
+    (KeyError("product_id"), FATAL),
+    (TypeError("unhashable type"), FATAL),
+    (Response(400), VALIDATION),
+    (Response(429), THROTTLING),
+    (Response(502), TRANSIENT),
+    (Response(200), None),
+])
+def test_classify(outcome, category):
+    assert classify(outcome) == category
+
+
+def test_programming_errors_are_answered_with_a_500():
+    assert status_code_for(KeyError("product_id")) == 500
+    assert status_code_for(ValueError("bad input")) == 400
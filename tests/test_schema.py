@@ -0,0 +1,34 @@
+import pytest
+
+from schema import compile_codec
+
+
+@pytest.mark.parametrize("cql_type, bits", [("tinyint", 8), ("smallint", 16), ("int", 32), ("bigint", 64)])
+def test_fixed_size_integers_are_bounded(cql_type, bits):
+    codec = compile_codec(cql_type)
+    assert codec(2 ** (bits - 1) - 1) == 2 ** (bits - 1) - 1
+    assert codec(-2 ** (bits - 1)) == -2 ** (bits - 1)
+    for value in (2 ** (bits - 1), -2 ** (bits - 1) - 1):
+        with pytest.raises(ValueError, match="must be an integer between"):
+            codec(value)
+
+
+@pytest.mark.parametrize("cql_type", ["varint", "counter"])
+def test_varint_and_counter_are_unbounded(cql_type):
+    assert compile_codec(cql_type)(2 ** 100) == 2 ** 100
+
+
+def test_integers_must_be_integers():
+    for value in ("1", 1.0, True):
+        with pytest.raises(ValueError, match="must be an integer"):
+            compile_codec("int")(value)
+
+
+def test_bounds_apply_inside_collections():
+    with pytest.raises(ValueError):
+        compile_codec("list<smallint>")([1, 2 ** 20])
+
+
+def test_unhashable_set_elements_are_invalid_input():
+    with pytest.raises(ValueError, match="can be held in a set"):
+        compile_codec("set<frozen<list<int>>>")([[1, 2]])
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from entities import Entity, default_entity
+import search
+
+REVIEW = Entity(
+    name="review", keyspace="productsearch", table="review_by_product", index="reviews",
+    key={"product_id": "int", "review_id": "text"}, search_fields=["review_text"],
+)
+
+
+class Collection:
+    """Answers searches from a dict of documents that only changes when told to."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.searches = []
+
+    def search(self, index, body):
+        self.searches.append(body)
+        hits = [{"_source": document} for document in self.documents]
+        return {"hits": {"total": {"value": len(hits)}, "hits": hits}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(search, "_search_cache", search.TTLCache(ttl=30))
+    monkeypatch.setattr(search, "_settling", search.OrderedDict())
+    monkeypatch.setattr(search, "SEARCH_CACHE_SETTLE", 10)
+    return now
+
+
+def test_search_read_before_the_index_caught_up_is_not_cached_for_the_ttl(clock, monkeypatch):
+    collection = Collection([{"product_id": 1, "product_name": "old"}])
+    monkeypatch.setattr(search, "_collection_client", collection)
+    assert search.search_products({"q": "sweater"}) == ({"total": 1, "items": [{"product_id": 1, "product_name": "old"}]}, False)
+
+    search.invalidate([{"operation": "update", "item": {"product_id": 1, "product_name": "new"}}])
+    # The index has not caught up with the update yet, so the old document is read again.
+    assert search.search_products({"q": "sweater"})[0]["items"][0]["product_name"] == "old"
+    clock[0] += 5
+    assert search.search_products({"q": "sweater"})[1] is True
+
+    collection.documents = [{"product_id": 1, "product_name": "new"}]
+    clock[0] += 6
+    result, cache_hit = search.search_products({"q": "sweater"})
+    assert not cache_hit
+    assert result["items"][0]["product_name"] == "new"
+    # Once the write settled, results are cached for the TTL again.
+    clock[0] += 20
+    assert search.search_products({"q": "sweater"})[1] is True
+
+
+def test_inserts_settle_every_search(clock, monkeypatch):
+    monkeypatch.setattr(search, "_collection_client", Collection([]))
+    search.search_products({"q": "sweater"})
+    search.invalidate([{"operation": "insert", "item": {"product_id": 2}}])
+    search.search_products({"q": "sweater"})
+    clock[0] += 11
+    assert search.search_products({"q": "sweater"})[1] is False
+
+
+def test_key_fields_come_from_the_entity():
+    assert search.normalize_params({"product_id": "7", "review_id": "abc"}, REVIEW) == (
+        ("from", 0), ("product_id", 7), ("review_id", "abc"), ("size", 10),
+    )
+    query = search.build_query(search.normalize_params({"review_id": "abc"}, REVIEW), REVIEW.search_fields, tuple(REVIEW.key))
+    assert query["query"] == {"bool": {"must": [{"term": {"review_id": "abc"}}]}}
+    # Key columns of other entities are not search parameters of products.
+    assert search.normalize_params({"review_id": "abc"}, default_entity()) == (("from", 0), ("size", 10))
+    with pytest.raises(ValueError):
+        search.normalize_params({"product_id": "abc"}, REVIEW)
+
+
+def test_search_without_a_collection_endpoint_is_a_clear_500(monkeypatch):
+    monkeypatch.setattr(search, "_collection_client", None)
+    monkeypatch.setattr(search, "_search_cache", search.TTLCache())
+    monkeypatch.delenv("COLLECTION_ENDPOINT", raising=False)
+    response = search.handler({"queryStringParameters": {"q": "sweater"}}, None)
+    assert response["statusCode"] == 500
+    assert "COLLECTION_ENDPOINT is not set" in response["body"]
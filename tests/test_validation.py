@@ -0,0 +1,106 @@
+import importlib
+import time
+
+import pytest
+
+from entities import Entity, default_entity
+from ingestion import QueueIngestionSink
+import validation
+
+SCHEMA = validation.PayloadSchema(default_entity())
+
+
+def operation(**fields):
+    return {"operation": "insert", "item": {"product_id": 1, "product_name": "a"}, **fields}
+
+
+def now_micros():
+    return time.time_ns() // 1000
+
+
+def test_version_must_be_a_timestamp_in_microseconds():
+    assert SCHEMA.check_operation(operation()) is None
+    assert SCHEMA.check_operation(operation(version=now_micros())) is None
+    # Seconds and milliseconds are rejected.
+    assert "microseconds since the epoch" in SCHEMA.check_operation(operation(version=int(time.time())))
+    assert "microseconds since the epoch" in SCHEMA.check_operation(operation(version=int(time.time() * 1000)))
+    assert "microseconds since the epoch" in SCHEMA.check_operation(operation(version=10 ** 15 - 1))
+
+
+def test_version_must_not_be_ahead_of_the_clock():
+    assert SCHEMA.check_operation(operation(version=now_micros() + 1000000)) is None
+    assert "ahead of the clock" in SCHEMA.check_operation(operation(version=now_micros() + 60 * 1000000))
+    # Nanoseconds are far ahead of the clock.
+    assert "ahead of the clock" in SCHEMA.check_operation(operation(version=time.time_ns()))
+
+
+def test_version_must_be_an_integer():
+    for version in ("1", 1.5, True):
+        assert "must be an integer" in SCHEMA.check_operation(operation(version=version))
+
+
+def test_version_bounds_are_compiled_into_the_schema():
+    schema = validation.PayloadSchema(default_entity(), max_version_ahead=120)
+    assert schema.check_operation(operation(version=now_micros() + 60 * 1000000)) is None
+    assert validation.get_schema(default_entity()).max_version_skew == int(validation.MAX_VERSION_AHEAD_SECONDS * 1000000)
+
+
+def test_primary_key_columns_are_required_and_typed():
+    review = validation.PayloadSchema(Entity(
+        name="review", keyspace="productsearch", table="review_by_product", index="reviews",
+        key={"product_id": "int", "review_id": "uuid"}, search_fields=[],
+    ))
+    item = {"product_id": 1, "review_id": "8d6a3c52-6f7b-4f11-9a3c-3f1f0c3a2b10"}
+    assert review.check_operation({"operation": "insert", "item": item}) is None
+    assert "primary key column review_id" in review.check_operation({"operation": "insert", "item": {"product_id": 1}})
+    assert review.check_operation({"operation": "delete", "item": {**item, "product_id": "1"}}) == "item product_id must be an integer"
+    assert review.check_operation({"operation": "delete", "item": {**item, "review_id": "x"}}) == "item review_id must be a UUID"
+
+
+def test_idempotency_key_length():
+    assert SCHEMA.check_operation(operation(idempotency_key="k" * validation.MAX_IDEMPOTENCY_KEY_LENGTH)) is None
+    for key in ("", "k" * (validation.MAX_IDEMPOTENCY_KEY_LENGTH + 1), 5):
+        assert "idempotency_key" in SCHEMA.check_operation(operation(idempotency_key=key))
+
+
+def test_batch_size_limits():
+    assert SCHEMA.check_batch({"operations": [operation()] * 3}, 3) == (None, [])
+    for operations in ([], [operation()] * 4, "x", None):
+        message, errors = SCHEMA.check_batch({"operations": operations}, 3)
+        assert message == "operations must be a list of between 1 and 3 operations"
+        assert errors == []
+
+
+def test_batch_reports_invalid_operations_by_index():
+    message, errors = SCHEMA.check_batch({"operations": [operation(), {"operation": "upsert"}, 3]}, 10)
+    assert message == "Invalid operations in batch."
+    assert [error["index"] for error in errors] == [1, 2]
+
+
+def test_item_size_limit():
+    schema = validation.PayloadSchema(default_entity(), max_item_bytes=100)
+    assert schema.check_operation(operation()) is None
+    assert schema.check_operation({"operation": "insert", "item": {"product_id": 1, "product_name": "a" * 100}}) == "item is larger than 100 bytes"
+
+
+@pytest.fixture
+def queue_mode(monkeypatch):
+    monkeypatch.setenv("INGESTION_MODE", "queue")
+    yield importlib.reload(validation)
+    monkeypatch.delenv("INGESTION_MODE")
+    importlib.reload(validation)
+
+
+def test_queue_mode_caps_items_at_the_message_size(queue_mode):
+    cap = QueueIngestionSink.MAX_MESSAGE_BYTES - queue_mode.MESSAGE_ENVELOPE_BYTES
+    assert queue_mode.MAX_ITEM_BYTES == cap
+    schema = queue_mode.get_schema(default_entity())
+    item = {"product_id": 1, "product_name": ""}
+    item["product_name"] = "a" * (cap - len(validation.json.dumps(item)))
+    assert schema.check_operation({"operation": "insert", "item": item}) is None
+    item["product_name"] += "a"
+    assert schema.check_operation({"operation": "insert", "item": item}) == f"item is larger than {cap} bytes"
+
+
+def test_item_cap_is_not_lowered_outside_queue_mode():
+    assert validation.MAX_ITEM_BYTES == 1024 * 1024